@@ -0,0 +1,291 @@
+"""Estimates working memory capacity (K) from change detection data.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+K is estimated from the hit rate H (responding 'different' on diff trials) and the false alarm rate
+F (responding 'different' on same trials) at each set size N:
+
+Cowan's K = N * (H - F), appropriate for single probe tests.
+Pashler's K = N * (H - F) / (1 - F), appropriate for whole display tests.
+
+Data files are read in parallel across a process pool. Grouping and counting is done with NumPy on
+the combined trials from every file, so thousands of subjects are summarized in one table. Data
+can be read from the CSV files written by the experiment or from the directories written by
+columnar.py. To summarize a whole data directory:
+
+    python analysis.py ~/Desktop/ChangeDetection/Data --output k_summary.csv
+
+Functions:
+find_data_files -- Returns the data files in a directory.
+k_estimates -- Computes Cowan's and Pashler's K from hit and false alarm rates.
+read_trials -- Reads the trial fields needed to estimate K from one data file.
+estimate_k -- Computes K for each group of trials.
+summarize -- Reads many data files in parallel and returns a table of K estimates.
+write_summary -- Saves a summary table as a CSV file.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import functools
+import glob
+import os
+
+import numpy as np
+
+import columnar
+
+SUMMARY_FIELDS = [
+    'Subject', 'Block', 'SetSize', 'NSame', 'NDiff', 'HitRate', 'FalseAlarmRate', 'CowanK',
+    'PashlerK',
+]
+
+
+def k_estimates(set_size, hit_rate, false_alarm_rate):
+    """Computes Cowan's and Pashler's K.
+
+    Returns a tuple of (cowan_k, pashler_k). Arguments can be numbers or arrays. Pashler's K is NaN
+    when the false alarm rate is 1.
+
+    Parameters:
+    set_size -- The number of stimuli in the display.
+    hit_rate -- The proportion of diff trials answered 'different'.
+    false_alarm_rate -- The proportion of same trials answered 'different'.
+    """
+    set_size = np.asarray(set_size, dtype=float)
+    hit_rate = np.asarray(hit_rate, dtype=float)
+    false_alarm_rate = np.asarray(false_alarm_rate, dtype=float)
+
+    cowan_k = set_size * (hit_rate - false_alarm_rate)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pashler_k = np.where(false_alarm_rate < 1, cowan_k / (1 - false_alarm_rate), np.nan)
+
+    return cowan_k, pashler_k
+
+
+def _read_csv_columns(filename, fields):
+    """Returns the given fields of a CSV data file as lists, or None if any are missing."""
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+
+        if not set(fields) <= set(header):
+            return None
+
+        indices = [header.index(field) for field in fields]
+        columns = [[] for _ in fields]
+
+        for row in reader:
+            if len(row) < len(header):
+                continue  # Cut off by a crash
+            for column, index in zip(columns, indices):
+                column.append(row[index])
+
+    return dict(zip(fields, columns))
+
+
+def read_trials(filename, include_practice=False):
+    """Reads the trial fields needed to estimate K from one data file.
+
+    Returns a dict of arrays ('Subject', 'Block', 'SetSize', 'Diff' and 'ACC'), or None if the
+    file is not a data file. Trials without a numeric accuracy are dropped.
+
+    Parameters:
+    filename -- A CSV data file or a columnar data directory.
+    include_practice -- If False, trials whose Block is not a number (such as practice trials
+        added by a hook) are dropped.
+    """
+    fields = ['Subject', 'Block', 'SetSize', 'TrialType', 'ACC']
+
+    if os.path.isdir(filename):
+        data = columnar.load_columns(filename)
+        if not set(fields) <= set(data):
+            return None
+        data = {field: data[field] for field in fields}
+    else:
+        data = _read_csv_columns(filename, fields)
+        if data is None:
+            return None
+
+    acc = np.array([_to_float(value) for value in data['ACC']])
+    keep = ~np.isnan(acc)
+
+    if not include_practice:
+        keep &= ~np.isnan([_to_float(value) for value in data['Block']])
+
+    return {
+        'Subject': _as_labels(data['Subject'])[keep],
+        'Block': _as_labels(data['Block'])[keep],
+        'SetSize': np.asarray(data['SetSize'], dtype=float).astype(int)[keep],
+        'Diff': (np.asarray(data['TrialType']).astype(str) == 'diff')[keep],
+        'ACC': acc[keep].astype(int),
+    }
+
+
+def _to_float(value):
+    """Returns value as a float, or NaN if it is not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _as_labels(values):
+    """Returns values as strings, writing whole numbers without a decimal point."""
+    labels = []
+    for value in np.asarray(values).tolist():
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        labels.append(str(value))
+    return np.array(labels)
+
+
+def estimate_k(trials, by=('Subject', 'Block', 'SetSize')):
+    """Computes hit rates, false alarm rates and K for each group of trials.
+
+    Returns a list of summary rows (dicts with the keys in SUMMARY_FIELDS). Fields not in by are
+    set to 'all', except SetSize which is always grouped on.
+
+    Parameters:
+    trials -- A dict of arrays as returned by read_trials (or several of them concatenated).
+    by -- The fields to group trials by.
+    """
+    by = [field for field in by if field != 'SetSize'] + ['SetSize']
+
+    codes, labels = [], []
+    for field in by:
+        field_labels, field_codes = np.unique(trials[field], return_inverse=True)
+        labels.append(field_labels)
+        codes.append(field_codes)
+
+    shape = tuple(len(field_labels) for field_labels in labels)
+    group = np.ravel_multi_index(codes, shape) if trials['ACC'].size else np.array([], int)
+    n_groups = int(np.prod(shape))
+
+    diff = trials['Diff']
+    n_diff = np.bincount(group, weights=diff, minlength=n_groups)
+    n_same = np.bincount(group, weights=~diff, minlength=n_groups)
+    hits = np.bincount(group, weights=diff & (trials['ACC'] == 1), minlength=n_groups)
+    false_alarms = np.bincount(group, weights=~diff & (trials['ACC'] == 0), minlength=n_groups)
+
+    present = np.flatnonzero(n_diff + n_same)
+    set_sizes = labels[-1][np.unravel_index(present, shape)[-1]]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        hit_rate = hits[present] / n_diff[present]
+        false_alarm_rate = false_alarms[present] / n_same[present]
+
+    cowan_k, pashler_k = k_estimates(set_sizes, hit_rate, false_alarm_rate)
+
+    rows = []
+    for i, index in enumerate(present):
+        row = {field: 'all' for field in SUMMARY_FIELDS[:3]}
+        for field, field_labels, code in zip(by, labels, np.unravel_index(index, shape)):
+            row[field] = field_labels[code].item()
+        row.update({
+            'NSame': int(n_same[index]),
+            'NDiff': int(n_diff[index]),
+            'HitRate': hit_rate[i],
+            'FalseAlarmRate': false_alarm_rate[i],
+            'CowanK': cowan_k[i],
+            'PashlerK': pashler_k[i],
+        })
+        rows.append(row)
+
+    return rows
+
+
+def _concatenate(trial_sets):
+    """Joins the trial dicts read from several files."""
+    return {
+        field: np.concatenate([trials[field] for trials in trial_sets])
+        for field in ['Subject', 'Block', 'SetSize', 'Diff', 'ACC']
+    }
+
+
+def summarize(filenames, processes=None, include_practice=False):
+    """Reads data files in parallel and estimates K per subject, block and set size.
+
+    Rows with Block 'all' are estimated from every block of a subject. Practice trials (those
+    whose Block is not a number) are left out unless include_practice is True.
+
+    Returns a list of summary rows.
+
+    Parameters:
+    filenames -- CSV data files or columnar data directories. Files that are not data files
+        (such as experiment info files) are skipped.
+    processes -- The number of worker processes. If None, one per CPU is used.
+    include_practice -- If True, trials whose Block is not a number are estimated as their own
+        blocks and counted in Block 'all'.
+    """
+    workers = processes or os.cpu_count() or 1
+    chunksize = max(len(filenames) // (4 * workers), 1)
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        trial_sets = executor.map(
+            functools.partial(read_trials, include_practice=include_practice), filenames,
+            chunksize=chunksize)
+        trial_sets = [trials for trials in trial_sets if trials is not None]
+
+    if not trial_sets:
+        return []
+
+    trials = _concatenate(trial_sets)
+
+    return (estimate_k(trials, ('Subject', 'Block', 'SetSize'))
+            + estimate_k(trials, ('Subject', 'SetSize')))
+
+
+def write_summary(rows, filename):
+    """Saves summary rows as a CSV file.
+
+    Parameters:
+    rows -- The rows returned by summarize or estimate_k.
+    filename -- Where to save the table.
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def find_data_files(directory):
+    """Returns the data files in a directory.
+
+    A CSV file is skipped when columnar output was saved for it, so no session is counted twice.
+
+    Parameters:
+    directory -- The directory to search.
+    """
+    columns = sorted(glob.glob(os.path.join(directory, '*_columns')))
+    csv_files = [filename for filename in sorted(glob.glob(os.path.join(directory, '*.csv')))
+                 if os.path.splitext(filename)[0] + '_columns' not in columns]
+
+    return csv_files + columns
+
+
+def main(argv=None):
+    """Summarizes a data directory from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='+', help='Data files or directories of data files.')
+    parser.add_argument('--output', default='k_summary.csv', help='Where to save the table.')
+    parser.add_argument('--processes', type=int, default=None, help='Worker processes to use.')
+    parser.add_argument('--include-practice', action='store_true',
+                        help='Include trials whose Block is not a number.')
+    args = parser.parse_args(argv)
+
+    filenames = []
+    for path in args.paths:
+        if os.path.isdir(path) and not os.path.exists(os.path.join(path, 'fields.json')):
+            filenames.extend(find_data_files(path))
+        else:
+            filenames.append(path)
+
+    rows = summarize(filenames, args.processes, args.include_practice)
+    write_summary(rows, args.output)
+    print('Saved K estimates for {} groups to {}'.format(len(rows), args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""Benchmarks for trial generation and the per-trial overhead of the experiment loop.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Two kinds of benchmarks are run:
+
+generation -- How many trials per second generation.TrialGenerator.make_block produces over a
+    grid of set sizes, min_distance, max_per_quad, palette sizes and repeat_stim_colors /
+    repeat_test_colors. These only need NumPy.
+trial_loop -- The time taken by run_trial followed by send_data on a headless.NullWindow, for
+    each timing mode. Display durations are simulated, so this is the pure code overhead. These
+    need psychopy and are skipped when it is not installed.
+
+Each result is printed as one JSON object per line so runs can be saved and compared:
+
+    python benchmark.py --output results.jsonl
+    python benchmark.py --quick
+
+Functions:
+benchmark_generation -- Measures trial generation speed for one set of parameters.
+benchmark_trial_loop -- Measures the per-trial overhead of run_trial and send_data.
+generation_grid -- Yields the parameter combinations used by the generation benchmarks.
+run_benchmarks -- Runs every benchmark and yields the results.
+"""
+
+import argparse
+import importlib.util
+import itertools
+import json
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import generation
+import palette
+
+
+def _best_of(func, repeats):
+    """Returns the shortest of several timings of func."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def benchmark_generation(set_size, min_distance, max_per_quad, n_colors, repeat_stim_colors,
+                         repeat_test_colors, n_trials=500, repeats=3, location_engine='rejection'):
+    """Measures how quickly make_block creates trials.
+
+    Returns a dict describing the parameters and the result.
+
+    Parameters:
+    set_size -- The set size of every trial.
+    min_distance -- The minimum distance between stimuli.
+    max_per_quad -- The number of stimuli allowed in each quadrant, or None.
+    n_colors -- The number of colors in the palette, taken from palette.color_wheel.
+    repeat_stim_colors -- Sent to TrialGenerator.
+    repeat_test_colors -- Sent to TrialGenerator.
+    n_trials -- The number of trials made by each block.
+    repeats -- The number of blocks timed. The fastest is reported.
+    location_engine -- Sent to TrialGenerator.
+    """
+    task = generation.TrialGenerator(
+        set_sizes=[set_size], min_distance=min_distance, max_per_quad=max_per_quad,
+        colors=palette.color_wheel(n_colors), repeat_stim_colors=repeat_stim_colors,
+        repeat_test_colors=repeat_test_colors, number_of_trials_per_block=n_trials,
+        percent_same=0.5, location_engine=location_engine)
+
+    seconds = _best_of(task.make_block, repeats)
+    n_made = task.same_trials_per_set_size + task.diff_trials_per_set_size
+
+    return {
+        'benchmark': 'generation',
+        'set_size': set_size,
+        'min_distance': min_distance,
+        'max_per_quad': max_per_quad,
+        'n_colors': n_colors,
+        'repeat_stim_colors': repeat_stim_colors,
+        'repeat_test_colors': repeat_test_colors,
+        'location_engine': location_engine,
+        'trials': n_made,
+        'seconds': seconds,
+        'trials_per_second': n_made / seconds,
+    }
+
+
+def benchmark_trial_loop(timing_mode='wait', set_size=6, n_trials=500, repeats=3, **kwargs):
+    """Measures the per-trial overhead of run_trial and send_data on a NullWindow.
+
+    Returns a dict describing the parameters and the result.
+
+    Parameters:
+    timing_mode -- Sent to Ktask.
+    set_size -- The set size of every trial.
+    n_trials -- The number of trials run in each repeat.
+    repeats -- The number of times the trials are run. The fastest is reported.
+    Additional keyword arguments are sent to headless.HeadlessKtask().
+    """
+    import headless  # Needs psychopy, unlike the generation benchmarks
+
+    with tempfile.TemporaryDirectory() as data_directory:
+        task = headless.HeadlessKtask(
+            set_sizes=[set_size], number_of_trials_per_block=n_trials, timing_mode=timing_mode,
+            data_directory=data_directory, **kwargs)
+        task.get_experiment_info_from_dialog()
+        task.open_window()
+
+        block = task.make_block()
+
+        def run_block():
+            for trial_num, trial in enumerate(block):
+                task.send_data(task.run_trial(trial, 0, trial_num))
+
+        seconds = _best_of(run_block, repeats)
+
+    return {
+        'benchmark': 'trial_loop',
+        'timing_mode': timing_mode,
+        'set_size': set_size,
+        'trials': len(block),
+        'seconds': seconds,
+        'us_per_trial': seconds / len(block) * 1e6,
+    }
+
+
+def generation_grid(quick=False):
+    """Yields keyword arguments for benchmark_generation.
+
+    Combinations that cannot produce a display (too few colors or too many stimuli for
+    max_per_quad) are skipped.
+
+    Parameters:
+    quick -- If True, a much smaller grid is used.
+    """
+    if quick:
+        grid = itertools.product([4, 8], [2.5], [2], [9], [False], [False])
+    else:
+        grid = itertools.product(
+            [2, 4, 6, 8], [1.5, 2.5], [2, None], [9, 36, 180, 360], [False, True], [False, True])
+
+    for set_size, min_distance, max_per_quad, n_colors, repeat_stim, repeat_test in grid:
+        if max_per_quad is not None and set_size / 4 > max_per_quad:
+            continue
+        if not repeat_stim and n_colors <= set_size:
+            continue
+
+        yield {
+            'set_size': set_size,
+            'min_distance': min_distance,
+            'max_per_quad': max_per_quad,
+            'n_colors': n_colors,
+            'repeat_stim_colors': repeat_stim,
+            'repeat_test_colors': repeat_test,
+        }
+
+
+def run_benchmarks(quick=False):
+    """Runs every benchmark, yielding each result as it finishes.
+
+    The trial loop benchmarks are skipped when psychopy is not installed.
+
+    Parameters:
+    quick -- If True, fewer parameter combinations and trials are used.
+    """
+    n_trials = 100 if quick else 500
+
+    for params in generation_grid(quick):
+        yield benchmark_generation(n_trials=n_trials, **params)
+
+    if importlib.util.find_spec('psychopy') is None:
+        return
+
+    for timing_mode in ['wait', 'frames']:
+        yield benchmark_trial_loop(timing_mode, n_trials=n_trials)
+
+
+def main(argv=None):
+    """Runs the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--quick', action='store_true', help='Run a small subset.')
+    parser.add_argument('--output', default=None, help='A file to write results to.')
+    args = parser.parse_args(argv)
+
+    environment = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'timestamp': time.time(),
+    }
+
+    output = sys.stdout if args.output is None else open(args.output, 'w')
+
+    try:
+        for result in run_benchmarks(args.quick):
+            result.update(environment)
+            output.write(json.dumps(result) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
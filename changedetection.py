@@ -10,6 +10,9 @@ inherited and extended. If this file is run directly the defaults at the top of
 used. To make simple changes, you can adjust any of these files. For more in depth changes you
 will need to overwrite the methods yourself.
 
+Trial generation lives in generation.py, which only depends on NumPy, so trials and schedules can
+be created without psychopy (see schedule.py).
+
 Note: this code relies on my templateexperiments module. You can get it from
 https://github.com/colinquirk/templateexperiments and either put it in the same folder as this
 code or give the path to psychopy in the preferences.
@@ -22,18 +25,28 @@ Ktask -- The class that runs the experiment.
 import os
 import sys
 import errno
+import shutil
 
 import json
-import random
-
-import numpy as np
 
 import psychopy.core
 import psychopy.event
-import psychopy.visual
 
 import template
 
+import columnar
+import coordinator
+import datawriter
+import generation
+import instrumentation
+import online
+import prefetch
+import renderer
+import responses
+import schedule
+import seeding
+import timing
+
 # Things you probably want to change
 number_of_trials_per_block = 10
 number_of_blocks = 2
@@ -44,6 +57,38 @@ stim_size = 1.5  # visual degrees, used for X and Y
 single_probe = True  # False to display all stimuli at test
 repeat_stim_colors = False  # False to make all stimuli colors unique
 repeat_test_colors = False  # False to make test colors unique from stim colors
+min_color_distance = 0  # minimum CIELAB distance between the test color and the stim colors
+
+stimulus_renderer = 'pool'  # 'elementarray' to draw all squares in a single batch
+prerender_displays = False  # True to render sample and test displays during the ITI
+
+# 'frames' to time displays by counting screen refreshes and record achieved durations and dropped
+# frames with each trial, or 'wait' to sleep after a single flip
+timing_mode = 'wait'
+
+# 'keyboard' to time responses from the test display flip with psychopy.hardware.keyboard, or
+# 'event' to use psychopy.event.waitKeys
+response_backend = 'event'
+
+stream_data = False  # True to append each trial to the data file as soon as it is finished
+columnar_output = False  # True to also save the data as memory-mappable .npy columns
+
+# 'timing' to record the time spent in each trial phase, 'cprofile' or 'tracemalloc' to also
+# profile each trial, or None to turn instrumentation off
+instrument = None
+
+# end the session once the confidence interval of K is narrower than this at every set size (with
+# at least early_stop_min_trials same and diff trials each), or None to always run every block
+early_stop_ci_width = None
+early_stop_min_trials = 20
+
+# 'host:port' of a coordinator (see coordinator.py) that assigns the subject number and schedule
+# and receives each trial's data, or None to run the station on its own
+coordinator_address = None
+
+# study seed used with the subject number to derive a random stream for each block, or None to
+# choose one at the start of each session (it is saved with the experiment info)
+seed = None
 
 keys = ['s', 'd']  # first is same
 distance_to_monitor = 90
@@ -79,6 +124,23 @@ allowed_deg_from_fix = 6
 # min_distance should be greater than stim_size
 min_distance = 2.5
 max_per_quad = 2  # int or None for totally random displays
+location_engine = 'rejection'  # 'poisson' for dense displays with large set sizes
+
+# True to store each block in a compact array (see trialblock.py) instead of a list of dicts. Trial
+# dicts are then created as each trial runs and make_trial is not called.
+compact_blocks = False
+
+# True to make each block on a background thread while the previous block, the instructions or the
+# break screen are shown
+prefetch_blocks = False
+
+# seconds making a block's locations may take before a warning is given, or None to skip timing
+generation_budget = 1
+
+# directory where valid layouts are saved and reused across sessions, or None to generate every
+# trial's locations from scratch
+layout_cache = None
+layout_pool_size = 10000
 
 colors = [
     [1, -1, -1],
@@ -142,52 +204,144 @@ questionaire_dict = {
 
 # This is the logic that runs the experiment
 # Change anything below this comment at your own risk
-class Ktask(template.BaseExperiment):
+class Ktask(generation.TrialGenerator, template.BaseExperiment):
     """The class that runs the change detection experiment.
 
     Parameters:
     allowed_deg_from_fix -- The maximum distance in visual degrees the stimuli can appear from
         fixation
-    colors -- The list of colors (list of 3 values, -1 to 1) to be used in the experiment.
+    colors -- The list of colors (list of 3 values, -1 to 1) to be used in the experiment. An
+        array such as palette.color_wheel(360) can be used for large continuous palettes.
+    compact_blocks -- If True, make_block returns a trialblock.TrialBlock, which stores the trials
+        in a NumPy structured array and creates each trial dict when it is used. The block is
+        built from arrays directly, so make_trial is not called unless a subclass overrides it.
+    columnar_output -- If True, the data is also saved in the columnar format (see columnar.py) in
+        a directory next to the CSV file, with locations and colors stored as numeric arrays. The
+        columns are written when the session ends; a resumed session rebuilds them from the CSV
+        file.
+    coordinator_address -- None, or the 'host:port' address of a coordinator.Coordinator. The
+        coordinator then assigns the subject number (replacing the one entered in the dialog) and
+        the schedule, and every trial's data is also streamed to it. The station's own data file is
+        still written.
     data_directory -- Where the data should be saved.
     delay_time -- The number of seconds between the stimuli display and test.
+    early_stop_ci_width -- If not None, K is estimated after every trial (see online.py) and the
+        session ends once the 95% confidence interval of K is narrower than this at every set
+        size. The current block is saved and post_block_hook and end_experiment_hook still run.
+    early_stop_min_trials -- The number of same and of diff trials needed at each set size before
+        the session can end early.
+    generation_budget -- The number of seconds generating the locations for a block may take. When
+        the experiment is created, each set size is checked (see locations.check_feasibility):
+        impossible displays raise a ValueError, and a warning is given if generation is likely to
+        time out or to take longer than the budget. With a layout_cache, building a pool that is
+        not saved yet is timed instead. If None, generation is not timed.
     instruct_text -- The text to be displayed to the participant at the beginning of the
         experiment.
+    instrument -- None, or 'timing' to record the time spent making each block and in each phase
+        of every trial. 'cprofile' also profiles each trial and 'tracemalloc' also records the
+        memory each trial allocates. The results are saved next to the data file when the
+        experiment quits (see instrumentation.py).
     iti_time -- The number of seconds in between a response and the next trial.
     keys -- The keys to be used for making a response. First is used for 'same' and the second is
         used for 'different'
+    layout_cache -- A directory where pools of valid layouts are saved. If not None, locations are
+        sampled from these pools (randomly rotated and reflected) instead of being generated for
+        every trial. Pools are loaded when the experiment is created, and built then if a set of
+        parameters has not been used before, so no layouts are generated during the session.
+    layout_pool_size -- The number of layouts generated for each pool in layout_cache.
+    location_engine -- How stimulus locations are generated. 'rejection' samples each location
+        uniformly. 'poisson' selects locations from a packed Poisson-disk set, which is much
+        faster for dense displays with large set sizes.
     max_per_quad -- The number of stimuli allowed in each quadrant. If None, displays are
         completely random.
+    min_color_distance -- The minimum CIELAB distance between the foil color on a change trial
+        and the stimuli colors it must differ from. Displays that leave no such foil get new
+        sample colors, and a ValueError is raised when the experiment is created if that would
+        almost always happen.
     min_distance -- The minimum distance in visual degrees between stimuli.
     number_of_blocks -- The number of blocks in the experiment.
     number_of_trials_per_block -- The number of trials within each block.
     percent_same -- A float between 0 and 1 (inclusive) describing the likelihood of a trial being
         a "same" trial.
+    prefetch_blocks -- If True, blocks are made in order on a background thread, starting before
+        the instructions, and the next block is made while the current one runs. Hooks that
+        change generation settings after setup_hook will not affect blocks already made.
+    prerender_displays -- If True, the sample and test displays are rendered off-screen during
+        the ITI so that each onset only needs a single image to be drawn.
     questionaire_dict -- Questions to be included in the dialog.
     repeat_stim_colors -- If True, a stimuli display can have repeated colors.
     repeat_test_colors -- If True, on a change trial the foil color can be one of the other colors
-        from the initial display.
+        from the initial display. It always differs from the color it replaces.
+    response_backend -- 'event' to collect responses with psychopy.event.waitKeys, or 'keyboard'
+        to use event-timestamped psychopy.hardware.keyboard input timed from the flip that shows
+        the test display. With 'keyboard' the response latency and longest poll interval are
+        saved with each trial, and a summary of them is saved to '<data file>_latency.json'.
+    seed -- The study seed. Each block's trials are generated from a random stream derived from the
+        seed, the subject number and the block number (see seeding.py), so a session can be
+        reproduced exactly. If None, a new seed is chosen. The seed is saved with the experiment
+        info, and a resumed session reads it back from the info file.
     sample_time -- The number of seconds the stimuli are on the screen for.
     set_sizes -- A list of all the set sizes. An equal number of trials will be shown for each set
         size.
     single_probe -- If True, the test display will show only a single probe. If False, all the
         stimuli will be shown.
     stim_size -- The size of the stimuli in visual angle.
+    stream_data -- If True, each trial is appended to the data file by a background thread as
+        soon as it is finished instead of being kept in memory until the end of the block.
+    stimulus_renderer -- 'pool' to draw squares with a reusable pool of Rect stimuli or
+        'elementarray' to draw them all with a single ElementArrayStim.
+    timing_mode -- 'wait' to show each display with a single flip followed by a wait, or 'frames'
+        to redraw it every frame for the closest whole number of frames. With 'frames' the
+        achieved sample and delay durations and the number of dropped frames are saved with each
+        trial.
 
     Additional keyword arguments are sent to template.BaseExperiment().
 
+    The trial generation methods are inherited from generation.TrialGenerator.
+
     Methods:
+    already_run -- Checks whether a trial was run before a resumed session was interrupted.
+    block_rng -- Returns the random number generator for a block.
     chdir -- Changes the directory to where the data will be saved.
+    check_feasibility -- Checks that the displays can be generated within the budget.
+    check_schedule -- Checks that a schedule file matches the subject and settings.
+    close_data_writer -- Writes any remaining streamed data, saves the columnar output and closes
+        the writer.
+    connect_coordinator -- Gets the subject number and schedule from the coordinator.
     display_break -- Displays a screen during the break between blocks.
     display_fixation -- Displays a fixation cross.
     display_stimuli -- Displays the stimuli.
     display_test -- Displays the test array.
     generate_locations -- Helper function that generates locations for make_trial
+    generate_location_batch -- Helper function that generates locations for many trials at once.
+    generation_settings -- Returns the settings that determine the trials.
+    get_frame_timer -- Returns the frame timer used when timing_mode is 'frames'.
+    get_keyboard_response -- Returns the keyboard used when response_backend is 'keyboard'.
+    get_layout_pool -- Returns the saved pool of layouts for a set size.
+    get_renderer -- Returns the renderer used to draw the fixation and stimuli.
     get_response -- Waits for a response from the participant.
+    iter_blocks -- Yields the blocks of the experiment.
     make_block -- Creates a block of trials to be run.
+    make_seeded_block -- Creates a block of trials from the block's own random stream.
     make_trial -- Creates a single trial.
+    open_data_writer -- Opens the data file, optionally streaming or resuming it.
+    phase -- Returns a context manager that times a phase of the experiment.
+    prepare_session -- Sets the seed, saves the experiment info and opens the data file.
+    prerender_trial -- Renders the sample and test displays of a trial off-screen.
+    quit_experiment -- Writes any remaining data and quits the experiment.
+    record_trial -- Sends a trial's data and adds it to the running estimate of K.
+    restore_seed -- Reads the seed of a resumed session from its info file.
+    run_block -- Runs the trials of a block.
+    run_blocks -- Runs every block, with a break between blocks.
     run_trial -- Runs a single trial.
     run -- Runs the entire experiment.
+    save_data -- Saves the data collected so far.
+    sample_colors -- Samples the colors for many trials at once.
+    save_instrumentation -- Saves the phase timings, profiles and response latency summary.
+    send_data -- Adds the data from a trial to the data file.
+    should_stop -- Checks whether the session can end early.
+    start_prefetch -- Starts making blocks on a background thread.
+    stop_prefetch -- Stops the background thread making blocks.
     """
 
     def __init__(self, number_of_trials_per_block=number_of_trials_per_block,
@@ -199,49 +353,92 @@ class Ktask(template.BaseExperiment):
                  iti_time=iti_time, sample_time=sample_time,
                  delay_time=delay_time, repeat_stim_colors=repeat_stim_colors,
                  repeat_test_colors=repeat_test_colors, data_directory=data_directory,
-                 questionaire_dict=questionaire_dict, **kwargs):
-
-        self.number_of_trials_per_block = number_of_trials_per_block
-        self.number_of_blocks = number_of_blocks
-        self.percent_same = percent_same
-        self.set_sizes = set_sizes
-        self.stim_size = stim_size
-
-        self.colors = colors
+                 questionaire_dict=questionaire_dict, location_engine=location_engine,
+                 layout_cache=layout_cache, layout_pool_size=layout_pool_size,
+                 stimulus_renderer=stimulus_renderer, prerender_displays=prerender_displays,
+                 timing_mode=timing_mode, stream_data=stream_data,
+                 columnar_output=columnar_output, response_backend=response_backend,
+                 instrument=instrument, seed=seed, min_color_distance=min_color_distance,
+                 generation_budget=generation_budget, compact_blocks=compact_blocks,
+                 prefetch_blocks=prefetch_blocks, early_stop_ci_width=early_stop_ci_width,
+                 early_stop_min_trials=early_stop_min_trials,
+                 coordinator_address=coordinator_address, **kwargs):
+
+        generation.TrialGenerator.__init__(
+            self, number_of_trials_per_block=number_of_trials_per_block,
+            number_of_blocks=number_of_blocks, percent_same=percent_same, set_sizes=set_sizes,
+            stim_size=stim_size, colors=colors, keys=keys,
+            allowed_deg_from_fix=allowed_deg_from_fix, min_distance=min_distance,
+            max_per_quad=max_per_quad, repeat_stim_colors=repeat_stim_colors,
+            repeat_test_colors=repeat_test_colors, location_engine=location_engine,
+            layout_cache=layout_cache, layout_pool_size=layout_pool_size, seed=seed,
+            min_color_distance=min_color_distance, generation_budget=generation_budget,
+            compact_blocks=compact_blocks)
+
+        self.seed_was_given = seed is not None
 
         self.iti_time = iti_time
         self.sample_time = sample_time
         self.delay_time = delay_time
 
-        self.keys = keys
+        self.data_directory = data_directory
+        self.instruct_text = instruct_text
+        self.questionaire_dict = questionaire_dict
 
-        self.allowed_deg_from_fix = allowed_deg_from_fix
+        self.single_probe = single_probe
 
-        self.min_distance = min_distance
+        if stimulus_renderer not in renderer.RENDERERS:
+            raise ValueError('Unknown renderer: {}'.format(stimulus_renderer))
 
-        if max_per_quad is not None and max(self.set_sizes)/4 > max_per_quad:
-            raise ValueError('Max per quad is too small.')
+        self.stimulus_renderer = stimulus_renderer
+        self.renderer = None
+        self.prerender_displays = prerender_displays
 
-        self.max_per_quad = max_per_quad
+        if timing_mode not in timing.TIMING_MODES:
+            raise ValueError('Unknown timing mode: {}'.format(timing_mode))
 
-        self.data_directory = data_directory
-        self.instruct_text = instruct_text
-        self.questionaire_dict = questionaire_dict
+        self.timing_mode = timing_mode
+        self.frame_timer = None
 
-        self.single_probe = single_probe
-        self.repeat_stim_colors = repeat_stim_colors
-        self.repeat_test_colors = repeat_test_colors
+        self.stream_data = stream_data
+        self.data_writer = None
+        self.resume_point = None
+
+        self.columnar_output = columnar_output
+        self.columnar_writer = None
 
-        self.same_trials_per_set_size = int((
-            number_of_trials_per_block / len(set_sizes)) * percent_same)
+        if response_backend not in responses.RESPONSE_BACKENDS:
+            raise ValueError('Unknown response backend: {}'.format(response_backend))
 
-        if self.same_trials_per_set_size % 1 != 0:
-            raise ValueError('Each trial type needs a whole number of trials.')
+        self.response_backend = response_backend
+        self.keyboard_response = None
+
+        self.prefetch_blocks = prefetch_blocks
+        self.prefetcher = None
+
+        self.coordinator_address = coordinator_address
+        self.coordinator_client = None
+
+        self.early_stop_ci_width = early_stop_ci_width
+        self.early_stop_min_trials = early_stop_min_trials
+        self.k_estimator = online.OnlineKEstimator(single_probe=single_probe)
+        self.stopped_early = False
+
+        if instrument is None:
+            self.instrumentation = None
         else:
-            self.diff_trials_per_set_size = (
-                number_of_trials_per_block - self.same_trials_per_set_size)
+            self.instrumentation = instrumentation.Instrumentation(instrument)
 
-        super().__init__(**kwargs)
+        template.BaseExperiment.__init__(self, **kwargs)
+
+        added_fields = []
+        if self.timing_mode == 'frames':
+            added_fields += timing.TIMING_FIELDS
+        if self.response_backend == 'keyboard':
+            added_fields += responses.RESPONSE_FIELDS
+
+        self.data_fields = self.data_fields + [
+            field for field in added_fields if field not in self.data_fields]
 
     def chdir(self):
         """Changes the directory to where the data will be saved.
@@ -255,142 +452,155 @@ class Ktask(template.BaseExperiment):
 
         os.chdir(self.data_directory)
 
-    def make_block(self):
-        """Makes a block of trials.
+    def iter_blocks(self, schedule_file=None):
+        """Yields each block of the experiment. A helper function for self.run.
+
+        Blocks are created with self.make_block, using the block's own random stream, when they are
+        requested, unless a schedule file is given, in which case they are read from the file
+        instead. If self.start_prefetch was called, blocks come from the background thread.
 
-        Returns a shuffled list of trials created by self.make_trial.
+        Parameters:
+        schedule_file -- A schedule created by schedule.compile_schedule, or None.
         """
+        if schedule_file is not None:
+            yield from schedule.iter_schedule(schedule_file)
+        elif self.prefetcher is not None:
+            yield from self.prefetcher
+        else:
+            for block_num in range(self.number_of_blocks):
+                yield self._make_numbered_block(block_num)
+
+    def _make_numbered_block(self, block_num):
+        """Makes a block from its own random stream. A helper function for self.iter_blocks."""
+        with self.phase('make_block'):
+            return self.make_seeded_block(block_num)
 
-        trial_list = []
+    def should_stop(self):
+        """Checks whether the session can end early. Called by self.run after each trial.
 
-        for set_size in self.set_sizes:
-            for _ in range(self.same_trials_per_set_size):
-                trial = self.make_trial(set_size, 'same')
-                trial_list.append(trial)
+        Returns True if early_stop_ci_width is set and K has been measured precisely enough at
+        every set size.
+        """
 
-            for _ in range(self.diff_trials_per_set_size):
-                trial = self.make_trial(set_size, 'diff')
-                trial_list.append(trial)
+        if self.early_stop_ci_width is None:
+            return False
 
-        random.shuffle(trial_list)
+        return self.k_estimator.converged(
+            self.early_stop_ci_width, self.set_sizes, self.early_stop_min_trials)
 
-        return trial_list
+    def start_prefetch(self):
+        """Starts making the blocks in order on a background thread. Called by self.run.
 
-    @staticmethod
-    def _which_quad(loc):
-        """Checks which quad a location is in.
+        Blocks are handed over through a queue holding at most one finished block.
+        """
 
-        This method is used by generate_locations to ensure the max_per_quad condition is followed.
+        self.stop_prefetch()
+        self.prefetcher = prefetch.BlockPrefetcher(
+            self._make_numbered_block, self.number_of_blocks)
 
-        Parameters:
-        loc -- A list of two values (x,y) in visual angle.
+    def stop_prefetch(self):
+        """Stops the background thread making blocks, if there is one.
         """
-        if loc[0] < 0 and loc[1] < 0:
-            return 0
-        elif loc[0] >= 0 and loc[1] < 0:
-            return 1
-        elif loc[0] < 0 and loc[1] >= 0:
-            return 2
-        else:
-            return 3
 
-    def _too_close(self, attempt, locs):
-        """Checks that an attempted location is valid.
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+            self.prefetcher = None
+
+    def connect_coordinator(self, schedule_file=None):
+        """Gets the subject number and schedule from the coordinator. Called by self.run.
 
-        This method is used by generate_locations to ensure the min_distance condition is followed.
+        Returns the schedule file to run, which is saved in the data directory unless schedule_file
+        is given.
 
         Parameters:
-        attempt -- A list of two values (x,y) in visual angle.
-        locs -- A list of previous successful attempts to be checked.
+        schedule_file -- A schedule passed to self.run, used instead of the coordinator's.
         """
-        if np.linalg.norm(np.array(attempt)) < self.min_distance:
-            return True  # Too close to center
 
-        for loc in locs:
-            if np.linalg.norm(np.array(attempt) - np.array(loc)) < self.min_distance:
-                return True  # Too close to another square
+        self.coordinator_client = coordinator.CoordinatorClient(self.coordinator_address)
+        assignment = self.coordinator_client.connect(
+            self.data_fields, self.experiment_name, self.generation_settings())
 
-        return False
+        self.experiment_info['Subject Number'] = assignment['subject']
 
-    def generate_locations(self, set_size):
-        """Creates the locations for a trial. A helper function for self.make_trial.
+        if schedule_file is None:
+            schedule_file = schedule.schedule_filename(
+                self.experiment_name, assignment['subject'])
+            with open(schedule_file, 'wb') as f:
+                f.write(assignment['schedule'])
 
-        Returns a list of acceptable locations.
+        return schedule_file
 
-        Parameters:
-        set_size -- The number of stimuli for this trial.
-        """
-        if self.max_per_quad is not None:
-            # quad boundries (x1, x2, y1, y2)
-            quad_count = [0, 0, 0, 0]
+    def check_schedule(self, schedule_file):
+        """Checks that a schedule file was compiled for the current subject and experiment.
 
-        locs = []
-        counter = 0
-        while len(locs) < set_size:
-            counter += 1
-            if counter > 1000:
-                raise ValueError('Timeout -- Cannot generate locations with given values.')
+        Every setting returned by self.generation_settings must match the ones the schedule was
+        compiled with.
 
-            attempt = [random.uniform(-self.allowed_deg_from_fix, self.allowed_deg_from_fix)
-                       for _ in range(2)]
-
-            if self._too_close(attempt, locs):
-                continue
+        Parameters:
+        schedule_file -- A schedule created by schedule.compile_schedule.
+        """
+        info = schedule.load_schedule_info(schedule_file)
 
-            if self.max_per_quad is not None:
-                quad = self._which_quad(attempt)
+        # Subject numbers such as '1' and '001' are the same subject, as in seeding.subject_key
+        if seeding.subject_key(info['subject_number']) != seeding.subject_key(
+                self.experiment_info['Subject Number']):
+            raise ValueError('Schedule was compiled for subject {}.'.format(
+                info['subject_number']))
 
-                if quad_count[quad] < self.max_per_quad:
-                    quad_count[quad] += 1
-                    locs.append(attempt)
-            else:
-                locs.append(attempt)
+        mismatches = generation.settings_mismatches(
+            info.get('settings', {}), self.generation_settings())
+        if mismatches:
+            raise ValueError('Schedule does not match the experiment settings: {}.'.format(
+                ', '.join(mismatches)))
 
-        return locs
+        self.seed = info['seed']
 
-    def make_trial(self, set_size, trial_type):
-        """Creates a single trial dict. A helper function for self.make_block.
+    def restore_seed(self, resume_file):
+        """Reads the seed of a resumed session from its info file. A helper function for self.run.
 
-        Returns the trial dict.
+        The info file saved by the interrupted session is looked for next to resume_file. A seed
+        passed to the constructor must match it.
 
         Parameters:
-        set_size -- The number of stimuli for this trial.
-        trial_type -- Whether this trial is same or different.
+        resume_file -- The data file of the session being resumed.
         """
 
-        if trial_type == 'same':
-            cresp = self.keys[0]
+        info_filename = os.path.join(
+            os.path.dirname(resume_file), '{}_info_{}.txt'.format(
+                self.experiment_name, str(self.experiment_info['Subject Number']).zfill(3)))
+
+        saved_seed = None
+        if os.path.exists(info_filename):
+            with open(info_filename) as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key == 'Seed' and value.strip():
+                        saved_seed = int(value)
+
+        if saved_seed is None:
+            if not self.seed_was_given:
+                raise ValueError(
+                    'No seed was found in {}. Pass the seed or the schedule_file of the session '
+                    'being resumed.'.format(info_filename))
+        elif self.seed_was_given and saved_seed != self.seed:
+            raise ValueError('The session being resumed used seed {}, not {}.'.format(
+                saved_seed, self.seed))
         else:
-            cresp = self.keys[1]
+            self.seed = saved_seed
 
-        test_location = random.choice(range(set_size))
+    def phase(self, name):
+        """Returns a context manager that times a phase of the experiment.
 
-        if self.repeat_stim_colors:
-            stim_colors = [random.choice(self.colors) for _ in range(set_size)]
-        else:
-            stim_colors = random.sample(self.colors, set_size)
+        When instrumentation is off, a shared context manager that does nothing is returned.
 
-        if self.repeat_test_colors:
-            test_color = random.choice(self.colors)
-            while test_color == self.colors[test_location]:
-                test_color = random.choice(self.colors)
-        else:
-            test_color = random.choice(
-                [color for color in self.colors if color not in stim_colors])
-
-        locs = self.generate_locations(set_size)
-
-        trial = {
-            'set_size': set_size,
-            'trial_type': trial_type,
-            'cresp': cresp,
-            'locations': locs,
-            'stim_colors': stim_colors,
-            'test_color': test_color,
-            'test_location': test_location,
-        }
+        Parameters:
+        name -- The name of the phase.
+        """
 
-        return trial
+        if self.instrumentation is None:
+            return instrumentation.NULL_PHASE
+
+        return self.instrumentation.phase(name)
 
     def display_break(self):
         """Displays a break screen in between blocks.
@@ -399,42 +609,92 @@ class Ktask(template.BaseExperiment):
         break_text = 'Please take a short break. Press space to continue.'
         self.display_text_screen(text=break_text, bg_color=[204, 255, 204])
 
-    def display_fixation(self, wait_time):
-        """Displays a fixation cross. A helper function for self.run_trial.
+    def get_renderer(self):
+        """Returns the StimulusRenderer for the experiment window, creating it on first use.
+        """
+
+        if self.renderer is None or self.renderer.window is not self.experiment_window:
+            self.renderer = renderer.StimulusRenderer(
+                self.experiment_window, self.stim_size, max(self.set_sizes),
+                self.stimulus_renderer)
+
+        return self.renderer
+
+    def get_frame_timer(self):
+        """Returns the timing.FrameTimer for the experiment window, creating it on first use.
+        """
+
+        if self.frame_timer is None or self.frame_timer.window is not self.experiment_window:
+            self.frame_timer = timing.FrameTimer(self.experiment_window)
+
+        return self.frame_timer
+
+    def _present(self, draw, wait_time, phase, callback=None):
+        """Presents a display for wait_time seconds. A helper function for the display methods.
 
         Parameters:
-        wait_time -- The amount of time the fixation should be displayed for.
+        draw -- A function that draws the display.
+        wait_time -- The amount of time the display should be shown for.
+        phase -- The name of the trial phase, used to record onsets with frame timing.
+        callback -- An optional function called once the display is on the screen. The time it
+            takes is counted as part of wait_time.
         """
 
-        psychopy.visual.TextStim(
-            self.experiment_window, text='+', color=[-1, -1, -1]).draw()
+        if self.timing_mode == 'frames':
+            self.get_frame_timer().present(draw, wait_time, phase, callback)
+            return
+
+        draw()
         self.experiment_window.flip()
 
-        psychopy.core.wait(wait_time)
+        onset = psychopy.core.Clock()
+
+        if callback is not None:
+            callback()
+
+        psychopy.core.wait(max(wait_time - onset.getTime(), 0))
 
-    def display_stimuli(self, coordinates, colors):
+    def display_fixation(self, wait_time, callback=None, phase='fixation'):
+        """Displays a fixation cross. A helper function for self.run_trial.
+
+        Parameters:
+        wait_time -- The amount of time the fixation should be displayed for.
+        callback -- An optional function called once the fixation is on the screen. The time it
+            takes is counted as part of wait_time.
+        phase -- The name of the trial phase the fixation belongs to.
+        """
+
+        self._present(self.get_renderer().draw_fixation, wait_time, phase, callback)
+
+    def display_stimuli(self, coordinates, colors, prerendered=None):
         """Displays the stimuli. A helper function for self.run_trial.
 
         Parameters:
         coordinates -- A list of coordinates (list of x and y value) describing where the stimuli
             should be displayed.
         colors -- A list of colors describing what should be drawn at each coordinate.
+        prerendered -- An optional display from self.prerender_trial to draw instead.
         """
 
-        psychopy.visual.TextStim(
-            self.experiment_window, text='+', color=[-1, -1, -1]).draw()
+        if prerendered is not None:
+            draw = prerendered.draw
+        else:
+            stim_renderer = self.get_renderer()
 
-        for pos, color in zip(coordinates, colors):
-            psychopy.visual.Rect(
-                self.experiment_window, height=self.stim_size,
-                width=self.stim_size, pos=pos, fillColor=color,
-                units='deg').draw()
+            def draw():
+                stim_renderer.draw_fixation()
+                stim_renderer.draw_squares(coordinates, colors)
 
-        self.experiment_window.flip()
+        self._present(draw, self.sample_time, 'sample')
+
+    def _test_array(self, trial_type, coordinates, colors, test_loc, test_color):
+        """Returns the coordinates and colors drawn in the test display."""
 
-        psychopy.core.wait(self.sample_time)
+        return generation.test_array(
+            trial_type, coordinates, colors, test_loc, test_color, self.single_probe)
 
-    def display_test(self, trial_type, coordinates, colors, test_loc, test_color):
+    def display_test(self, trial_type, coordinates, colors, test_loc, test_color,
+                     prerendered=None):
         """Displays the test array. A helper function for self.run_trial.
 
         Parameters:
@@ -443,32 +703,55 @@ class Ktask(template.BaseExperiment):
         colors -- The colors that should be drawn at each coordinate.
         test_loc -- The index of the tested stimuli.
         test_color -- The color of the tested stimuli.
+        prerendered -- An optional display from self.prerender_trial to draw instead.
         """
 
-        psychopy.visual.TextStim(
-            self.experiment_window, text='+', color=[-1, -1, -1]).draw()
+        if prerendered is not None:
+            prerendered.draw()
+        else:
+            stim_renderer = self.get_renderer()
+            stim_renderer.draw_fixation()
+            stim_renderer.draw_squares(*self._test_array(
+                trial_type, coordinates, colors, test_loc, test_color))
 
-        if self.single_probe:
-            psychopy.visual.Rect(
-                self.experiment_window, width=self.stim_size,
-                height=self.stim_size, pos=coordinates[test_loc],
-                fillColor=colors[test_loc], units='deg').draw()
+        if self.response_backend == 'keyboard':
+            self.get_keyboard_response().arm()
 
+        if self.timing_mode == 'frames':
+            self.get_frame_timer().flip('test')
         else:
-            for pos, color in zip(coordinates, colors):
-                psychopy.visual.Rect(
-                    self.experiment_window, width=self.stim_size,
-                    height=self.stim_size, pos=pos, fillColor=color,
-                    units='deg').draw()
-
-        # Draw over the test color on diff trials
-        if trial_type == 'diff':
-            psychopy.visual.Rect(
-                self.experiment_window, width=self.stim_size,
-                height=self.stim_size, pos=coordinates[test_loc],
-                fillColor=test_color, units='deg').draw()
+            self.experiment_window.flip()
 
-        self.experiment_window.flip()
+    def prerender_trial(self, trial):
+        """Renders the sample and test displays of a trial off-screen.
+
+        Returns a dict with the 'sample' and 'test' displays, to be passed to self.display_stimuli
+        and self.display_test.
+
+        Parameters:
+        trial -- The dictionary of information about a trial.
+        """
+
+        stim_renderer = self.get_renderer()
+
+        return {
+            'sample': stim_renderer.prerender(trial['locations'], trial['stim_colors']),
+            'test': stim_renderer.prerender(*self._test_array(
+                trial['trial_type'], trial['locations'], trial['stim_colors'],
+                trial['test_location'], trial['test_color'])),
+        }
+
+    def get_keyboard_response(self):
+        """Returns the responses.KeyboardResponse for the experiment window, creating it on first
+        use.
+        """
+
+        if (self.keyboard_response is None
+                or self.keyboard_response.window is not self.experiment_window):
+            self.keyboard_response = responses.KeyboardResponse(
+                self.experiment_window, self.keys + ['q'])
+
+        return self.keyboard_response
 
     def get_response(self):
         """Waits for a response from the participant. A helper function for self.run_trial.
@@ -478,6 +761,14 @@ class Ktask(template.BaseExperiment):
         Returns the pressed key and the reaction time.
         """
 
+        if self.response_backend == 'keyboard':
+            resp, rt = self.get_keyboard_response().wait()
+
+            if resp == 'q':
+                self.quit_experiment()
+
+            return resp, rt
+
         rt_timer = psychopy.core.MonotonicClock()
 
         keys = self.keys + ['q']
@@ -498,7 +789,108 @@ class Ktask(template.BaseExperiment):
         Parameters:
         data -- A dict where keys exist in data_fields and values are to be saved.
         """
-        self.update_experiment_data([data])
+        if self.data_writer is not None:
+            self.data_writer.write(data)
+        else:
+            self.update_experiment_data([data])
+
+        if self.columnar_writer is not None:
+            self.columnar_writer.append(data)
+
+        if self.coordinator_client is not None:
+            self.coordinator_client.send(data)
+
+    def open_data_writer(self, resume_file=None):
+        """Starts streaming trial data to the data file. A helper function for self.run.
+
+        Parameters:
+        resume_file -- A partially written data file to continue. If None, a new data file is
+            created with self.open_csv_data_file.
+        """
+
+        if resume_file is None:
+            self.open_csv_data_file()
+        else:
+            self.experiment_data_filename = resume_file
+            self.resume_point = datawriter.last_written_trial(resume_file)
+
+        # Resumed files are always appended to by the streaming writer
+        if self.stream_data or resume_file is not None:
+            self.data_writer = datawriter.StreamingCSVWriter(
+                self.experiment_data_filename, self.data_fields)
+
+        if self.columnar_output:
+            directory = os.path.splitext(self.experiment_data_filename)[0] + '_columns'
+
+            # Columns left by the interrupted session can be missing trials, and would be
+            # preferred over the CSV file by analysis.py if this session is interrupted too
+            if resume_file is not None and os.path.isdir(directory):
+                shutil.rmtree(directory)
+
+            self.columnar_writer = columnar.ColumnarWriter(
+                directory, self.data_fields, csv_filename=resume_file)
+
+    def already_run(self, block_num, trial_num):
+        """Checks whether a trial was already run in the session being resumed.
+
+        Parameters:
+        block_num -- The number of the block in the experiment.
+        trial_num -- The number of the trial within a block.
+        """
+
+        return self.resume_point is not None and (block_num, trial_num) <= self.resume_point
+
+    def save_data(self):
+        """Saves the data collected so far. Called at the end of each block.
+
+        When streaming, this waits for the background writer to sync the file to disk.
+        """
+
+        if self.data_writer is not None:
+            self.data_writer.flush()
+        else:
+            self.save_data_to_csv()
+
+    def close_data_writer(self):
+        """Writes any remaining streamed data, saves the columnar output and closes the data writer
+        and the connection to the coordinator.
+        """
+
+        if self.data_writer is not None:
+            self.data_writer.close()
+            self.data_writer = None
+
+        if self.columnar_writer is not None:
+            self.columnar_writer.save()
+            self.columnar_writer = None
+
+        if self.coordinator_client is not None:
+            self.coordinator_client.close()
+            self.coordinator_client = None
+
+    def save_instrumentation(self):
+        """Saves the per-trial timings, the aggregate report, any profile and the summary of
+        response latencies next to the data file.
+        """
+
+        filename_base = os.path.splitext(self.experiment_data_filename)[0]
+
+        if self.instrumentation is not None and self.instrumentation.rows:
+            self.instrumentation.save(filename_base)
+
+        if self.keyboard_response is not None and self.keyboard_response.latencies:
+            with open(filename_base + '_latency.json', 'w') as f:
+                json.dump(self.keyboard_response.latency_summary(), f, indent=2)
+
+    def quit_experiment(self):
+        """Writes any remaining streamed data, saves instrumentation and quits the experiment."""
+
+        self.stop_prefetch()
+        self.close_data_writer()
+
+        self.save_instrumentation()
+
+        super().quit_experiment()
 
     def run_trial(self, trial, block_num, trial_num):
         """Runs a single trial.
@@ -511,14 +903,30 @@ class Ktask(template.BaseExperiment):
         trial_num -- The number of the trial within a block.
         """
 
-        self.display_fixation(self.iti_time)
-        self.display_stimuli(trial['locations'], trial['stim_colors'])
-        self.display_fixation(self.delay_time)
-        self.display_test(
-            trial['trial_type'], trial['locations'], trial['stim_colors'],
-            trial['test_location'], trial['test_color'])
+        if self.timing_mode == 'frames':
+            self.get_frame_timer().start_trial()
+
+        # Render both displays while the fixation is up so that their onsets are single blits
+        prerendered = {}
+
+        def prerender():
+            prerendered.update(self.prerender_trial(trial))
+
+        callback = prerender if self.prerender_displays else None
 
-        resp, rt = self.get_response()
+        with self.phase('fixation'):
+            self.display_fixation(self.iti_time, callback, phase='iti')
+        with self.phase('sample'):
+            self.display_stimuli(
+                trial['locations'], trial['stim_colors'], prerendered.get('sample'))
+        with self.phase('delay'):
+            self.display_fixation(self.delay_time, phase='delay')
+        with self.phase('test'):
+            self.display_test(
+                trial['trial_type'], trial['locations'], trial['stim_colors'],
+                trial['test_location'], trial['test_color'], prerendered.get('test'))
+        with self.phase('response'):
+            resp, rt = self.get_response()
 
         acc = 1 if resp == trial['cresp'] else 0
 
@@ -539,11 +947,133 @@ class Ktask(template.BaseExperiment):
             'TestColors': json.dumps(trial['test_color']),
         }
 
+        if self.timing_mode == 'frames':
+            data.update(self.get_frame_timer().trial_timing())
+
+        if self.response_backend == 'keyboard':
+            data.update(self.get_keyboard_response().last_timing)
+
         return data
 
+    def prepare_session(self, schedule_file=None, resume_file=None):
+        """Sets the seed, saves the experiment info and opens the data file. A helper function for
+        self.run.
+
+        Returns the schedule file to run, which comes from the coordinator if there is one.
+
+        Parameters:
+        schedule_file -- A schedule created by schedule.compile_schedule, or None.
+        resume_file -- The data file of an interrupted session to continue, or None.
+        """
+
+        if self.coordinator_address is not None:
+            schedule_file = self.connect_coordinator(schedule_file)
+
+        if schedule_file is not None:
+            self.check_schedule(schedule_file)
+        elif resume_file is not None:
+            self.restore_seed(resume_file)
+
+        self.experiment_info['Seed'] = self.seed
+
+        # A resumed session keeps the info file it was started with
+        if resume_file is None:
+            self.save_experiment_info()
+
+        self.open_data_writer(resume_file)
+
+        return schedule_file
+
+    def run_blocks(self, schedule_file=None, pre_block_hook=None, pre_trial_hook=None,
+                   post_trial_hook=None, post_block_hook=None):
+        """Runs every block, with a break between blocks. A helper function for self.run.
+
+        Blocks come from self.iter_blocks, so they are read from schedule_file or taken from the
+        prefetcher when there is one. No more blocks are run once the session has stopped early.
+
+        Parameters:
+        schedule_file -- A schedule created by schedule.compile_schedule, or None.
+        pre_block_hook -- See self.run.
+        pre_trial_hook -- See self.run.
+        post_trial_hook -- See self.run.
+        post_block_hook -- See self.run.
+        """
+        for block_num, block in enumerate(self.iter_blocks(schedule_file)):
+            if pre_block_hook is not None:
+                tmp = pre_block_hook(self, block, block_num)
+                if tmp is not None:
+                    block = tmp
+
+            self.run_block(block, block_num, pre_trial_hook, post_trial_hook)
+            self.save_data()
+
+            if post_block_hook is not None:
+                post_block_hook(self)
+
+            if self.stopped_early:
+                break
+
+            if block_num + 1 != self.number_of_blocks:
+                self.display_break()
+
+    def run_block(self, block, block_num, pre_trial_hook=None, post_trial_hook=None):
+        """Runs the trials of a block. A helper function for self.run.
+
+        Trials already run in a resumed session are skipped. Each trial's data is sent to the data
+        file and added to the running estimate of K, and the block ends early once self.should_stop
+        allows it, setting self.stopped_early.
+
+        Parameters:
+        block -- The trials of the block.
+        block_num -- The number of the block in the experiment.
+        pre_trial_hook -- See self.run.
+        post_trial_hook -- See self.run.
+        """
+
+        for trial_num, trial in enumerate(block):
+            if self.already_run(block_num, trial_num):
+                continue
+
+            if pre_trial_hook is not None:
+                tmp = pre_trial_hook(self, trial, block_num, trial_num)
+                if tmp is not None:
+                    trial = tmp
+
+            if self.instrumentation is not None:
+                self.instrumentation.start_trial(block_num, trial_num)
+
+            data = self.run_trial(trial, block_num, trial_num)
+
+            if post_trial_hook is not None:
+                tmp = post_trial_hook(self, data)
+                if tmp is not None:
+                    data = tmp
+
+            self.record_trial(data)
+
+            if self.should_stop():
+                self.stopped_early = True
+                return
+
+    def record_trial(self, data):
+        """Sends a trial's data and adds it to the running estimate of K. A helper function for
+        self.run_block.
+
+        Parameters:
+        data -- The data from the trial.
+        """
+
+        with self.phase('send_data'):
+            self.send_data(data)
+
+        if self.instrumentation is not None:
+            self.instrumentation.end_trial()
+
+        self.k_estimator.update(data)
+
     def run(self, setup_hook=None, before_first_trial_hook=None, pre_block_hook=None,
             pre_trial_hook=None, post_trial_hook=None, post_block_hook=None,
-            end_experiment_hook=None):
+            end_experiment_hook=None, schedule_file=None, resume_file=None):
         """Runs the entire experiment.
 
         This function takes a number of hooks that allow you to alter behavior of the experiment
@@ -566,6 +1096,16 @@ class Ktask(template.BaseExperiment):
         post_block_hook -- takes self, executed at end of block before break screen (including
             last block).
         end_experiment_hook -- takes self, executed immediately before end experiment screen.
+
+        A precompiled schedule (see schedule.py) can be passed as schedule_file, in which case
+        blocks are read from it instead of being generated during the session.
+
+        An interrupted session can be continued by passing its data file as resume_file. Trials up
+        to the last one in the file are skipped and new data is appended to it. Use a schedule_file
+        to get the same trials as the interrupted session.
+
+        With a coordinator_address, the subject number and schedule come from the coordinator (see
+        coordinator.py) after the dialog is closed.
         """
 
         self.chdir()
@@ -576,50 +1116,25 @@ class Ktask(template.BaseExperiment):
             print('Experiment has been terminated.')
             sys.exit(1)
 
-        self.save_experiment_info()
-        self.open_csv_data_file()
+        schedule_file = self.prepare_session(schedule_file, resume_file)
         self.open_window(screen=0)
         self.display_text_screen('Loading...', wait_for_input=False)
 
         if setup_hook is not None:
             setup_hook(self)
 
+        # Blocks are made while the instructions are read
+        if self.prefetch_blocks and schedule_file is None:
+            self.start_prefetch()
+
         for instruction in self.instruct_text:
             self.display_text_screen(text=instruction)
 
         if before_first_trial_hook is not None:
             before_first_trial_hook(self)
 
-        for block_num in range(self.number_of_blocks):
-            block = self.make_block()
-
-            if pre_block_hook is not None:
-                tmp = pre_block_hook(self, block, block_num)
-                if tmp is not None:
-                    block = tmp
-
-            for trial_num, trial in enumerate(block):
-                if pre_trial_hook is not None:
-                    tmp = pre_trial_hook(self, trial, block_num, trial_num)
-                    if tmp is not None:
-                        trial = tmp
-
-                data = self.run_trial(trial, block_num, trial_num)
-
-                if post_trial_hook is not None:
-                    tmp = post_trial_hook(self, data)
-                    if tmp is not None:
-                        data = tmp
-
-                self.send_data(data)
-
-            self.save_data_to_csv()
-
-            if post_block_hook is not None:
-                post_block_hook(self)
-
-            if block_num + 1 != self.number_of_blocks:
-                self.display_break()
+        self.run_blocks(schedule_file, pre_block_hook, pre_trial_hook, post_trial_hook,
+                        post_block_hook)
 
         if end_experiment_hook is not None:
             end_experiment_hook(self)
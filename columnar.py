@@ -0,0 +1,177 @@
+"""Columnar binary output of trial data.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+The CSV data file stores locations and colors as JSON strings, which have to be parsed again for
+every trial by every analysis. The columnar format saves each data field as its own .npy file in a
+directory. Locations, sample colors and test colors are stored as fixed-shape float arrays with one
+row per trial: locations has shape (n_trials, width, 2) and sample colors (n_trials, width, 3),
+where width is the largest set size and unused slots hold NaN. Other fields are saved as numbers
+when every value is numeric and as strings otherwise. Each file can be memory-mapped, so loading
+display data needs no parsing at all.
+
+Classes:
+ColumnarWriter -- Collects trial rows and saves them as columns.
+
+Functions:
+load_columns -- Loads a columnar data directory.
+csv_to_columns -- Converts an existing CSV data file.
+
+Attributes:
+ARRAY_FIELDS -- Maps the JSON data fields to the number of values per stimulus.
+"""
+
+import csv
+import json
+import os
+
+import numpy as np
+
+ARRAY_FIELDS = {
+    'Locations': 2,
+    'SampleColors': 3,
+    'TestColors': 3,
+}
+
+
+def _column_name(field):
+    """Returns the file name used for a data field."""
+    return field.replace(' ', '_') + '.npy'
+
+
+def _scalar_column(values):
+    """Returns values as a float array if they are all numeric and as a string array otherwise."""
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        return np.array([str(value) for value in values])
+
+
+def _stimulus_column(values, depth):
+    """Stacks per-trial arrays of stimulus values, padding them with NaN to the same width."""
+    width = max([len(value) for value in values] + [1])
+    column = np.full((len(values), width, depth), np.nan, dtype=np.float32)
+
+    for i, value in enumerate(values):
+        column[i, :len(value)] = value
+
+    return column
+
+
+class ColumnarWriter:
+    """Collects trial rows and saves them as one .npy file per data field.
+
+    Stimulus arrays are parsed when a row is added and kept as small float arrays, so the rows held
+    in memory are much smaller than their CSV form. Columns are meant to be saved once, when all
+    the rows have been added; the CSV data file stays the record of a session in progress.
+
+    Parameters:
+    directory -- The directory the column files are saved in.
+    fieldnames -- The data fields to save.
+    csv_filename -- A CSV data file whose rows are added first, such as the file of a session that
+        is being resumed. Rows cut off by a crash are skipped.
+
+    Methods:
+    append -- Adds a trial row.
+    save -- Writes every column to disk.
+    """
+
+    def __init__(self, directory, fieldnames, csv_filename=None):
+        self.directory = directory
+        self.fieldnames = list(fieldnames)
+        self.columns = {field: [] for field in self.fieldnames}
+
+        if csv_filename is not None and os.path.exists(csv_filename):
+            with open(csv_filename, newline='') as f:
+                for row in csv.DictReader(f):
+                    if None in row.values():
+                        continue  # Cut off before the last column
+
+                    # The CSV writer saves missing values as empty strings
+                    self.append({field: value if value != '' else None
+                                 for field, value in row.items()})
+
+    def append(self, row):
+        """Adds a trial row.
+
+        Parameters:
+        row -- A dict of data fields, as sent to Ktask.send_data. Stimulus fields can be JSON
+            strings or lists.
+        """
+        for field in self.fieldnames:
+            value = row.get(field)
+
+            if field in ARRAY_FIELDS:
+                if isinstance(value, str):
+                    value = json.loads(value)
+                value = np.array(
+                    [] if value is None else value, dtype=np.float32).reshape(
+                        -1, ARRAY_FIELDS[field])
+
+            self.columns[field].append(value)
+
+    def save(self):
+        """Writes every column to disk.
+
+        Each file is written under a temporary name and then moved into place, so an interrupted
+        save leaves the previous version of the column intact.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+
+        for field, values in self.columns.items():
+            if field in ARRAY_FIELDS:
+                column = _stimulus_column(values, ARRAY_FIELDS[field])
+                if field == 'TestColors':
+                    column = column[:, 0]
+            else:
+                column = _scalar_column(values)
+
+            path = os.path.join(self.directory, _column_name(field))
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, column)
+            os.replace(tmp_path, path)
+
+        with open(os.path.join(self.directory, 'fields.json'), 'w') as f:
+            json.dump(self.fieldnames, f)
+
+
+def load_columns(directory, mmap=True):
+    """Loads a columnar data directory.
+
+    Returns a dict mapping data fields to arrays.
+
+    Parameters:
+    directory -- A directory saved by ColumnarWriter.
+    mmap -- If True, the arrays are memory-mapped instead of read into memory.
+    """
+    with open(os.path.join(directory, 'fields.json')) as f:
+        fieldnames = json.load(f)
+
+    mmap_mode = 'r' if mmap else None
+
+    return {
+        field: np.load(os.path.join(directory, _column_name(field)), mmap_mode=mmap_mode)
+        for field in fieldnames
+    }
+
+
+def csv_to_columns(csv_filename, directory=None):
+    """Converts an existing CSV data file to the columnar format.
+
+    Returns the directory the columns were saved in.
+
+    Parameters:
+    csv_filename -- A data file written by the experiment.
+    directory -- Where to save the columns. Defaults to the CSV file name with '_columns' in place
+        of '.csv'.
+    """
+    if directory is None:
+        directory = os.path.splitext(csv_filename)[0] + '_columns'
+
+    with open(csv_filename, newline='') as f:
+        fieldnames = csv.DictReader(f).fieldnames
+
+    ColumnarWriter(directory, fieldnames, csv_filename).save()
+
+    return directory
@@ -0,0 +1,436 @@
+"""A coordinator that runs many lab stations at once.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+When many stations run Ktask at the same time, each one normally picks its own subject number,
+builds its own trials and writes its own data file, which has to be collected by hand. A
+Coordinator is a single asyncio service that stations connect to over TCP. It hands each station
+the next free subject number together with a schedule compiled for that subject (see schedule.py),
+and receives the station's trial rows as they are run, writing every subject's data to one data
+directory with a datawriter.StreamingCSVWriter.
+
+Messages are JSON objects, one per line:
+
+    station -> coordinator  {'type': 'hello', 'station': name, 'fields': data fields,
+                             'experiment_name': name, 'settings': generation settings}
+    coordinator -> station  {'type': 'assign', 'subject': number, 'seed': seed,
+                             'schedule': base64 encoded .npz file}
+                         or {'type': 'error', 'message': why the station was refused}
+    station -> coordinator  {'type': 'rows', 'rows': [row, ...]}
+    coordinator -> station  {'type': 'ack', 'rows': number of rows}
+    station -> coordinator  {'type': 'done'}
+    coordinator -> station  {'type': 'done'} once the subject's data file is closed
+
+Schedules are compiled from the coordinator's own settings, so a station is refused unless its
+experiment name and every generation setting (see TrialGenerator.generation_settings) match the
+coordinator's. Data files are named like the station's own, with the subject number padded to
+three digits (ChangeDetection_002.csv).
+
+Rows are sent in batches. Each connection is handled by one coroutine that only reads the next
+batch once the last one has been handed to the writer, and a CoordinatorClient only keeps
+max_in_flight batches unacknowledged, so a slow disk or a busy coordinator slows the stations'
+background threads down instead of filling memory. Schedules are compiled in a worker thread so
+the event loop keeps serving other stations. Dozens of stations cost one coroutine and one writer
+thread each.
+
+To start a coordinator with the defaults in changedetection.py:
+
+    python coordinator.py --port 8765 --data-directory study_data --seed 1234
+
+and pass coordinator_address='host:8765' to each station's Ktask. Stations can be ordinary local
+processes (for example headless.HeadlessKtask), which is how the coordinator can be tested on a
+single machine.
+
+Classes:
+Coordinator -- Assigns subjects and schedules and collects data from stations.
+CoordinatorClient -- Connects a station to a coordinator.
+
+Functions:
+parse_address -- Splits a 'host:port' address.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import queue
+import socket
+import threading
+
+import datawriter
+import generation
+import schedule
+import seeding
+
+_CLOSE = object()
+
+
+def parse_address(address):
+    """Returns a (host, port) tuple from a 'host:port' string.
+
+    Parameters:
+    address -- The address. If it has no host, localhost is used.
+    """
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def _encode(message):
+    """Returns a message as a line of JSON."""
+    return (json.dumps(message, default=_json_default) + '\n').encode()
+
+
+def _json_default(value):
+    """Converts NumPy scalars and other values json cannot encode."""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class Coordinator:
+    """Assigns subject numbers and schedules to stations and collects their data.
+
+    Parameters:
+    data_directory -- Where data files and schedules are saved.
+    seed -- The study seed used for every schedule. If None, a new seed is chosen.
+    first_subject -- The first subject number to hand out. Numbers with a data file in
+        data_directory are skipped.
+    defaults -- The experiment script the generation settings are read from (see
+        generation.experiment_defaults). Defaults to changedetection.py.
+    batch_queue_size -- The number of rows each subject's writer may hold before the coordinator
+        stops reading from that station.
+    task_kwargs -- Keyword arguments sent to generation.TrialGenerator, replacing the defaults.
+
+    Methods:
+    serve -- Accepts stations until cancelled.
+    run -- Runs the coordinator until interrupted.
+    """
+
+    def __init__(self, data_directory, seed=None, first_subject=1, defaults=None,
+                 batch_queue_size=10000, task_kwargs=None):
+        self.data_directory = data_directory
+        self.seed = seeding.new_seed() if seed is None else seed
+        self.next_subject = first_subject
+        self.batch_queue_size = batch_queue_size
+
+        settings = generation.experiment_defaults(defaults)
+        self.exp_name = settings.pop('exp_name', 'ChangeDetection')
+        settings.update(task_kwargs or {})
+        self.generator = generation.TrialGenerator(**settings)
+        self.generation_lock = threading.Lock()
+
+        # The station name, rows received and whether it finished, by subject number
+        self.stations = {}
+
+        os.makedirs(os.path.join(data_directory, 'schedules'), exist_ok=True)
+
+    def _data_filename(self, subject_number):
+        """Returns the data file for a subject."""
+        return os.path.join(
+            self.data_directory, '{}_{}.csv'.format(self.exp_name, str(subject_number).zfill(3)))
+
+    def _assign_subject(self):
+        """Returns the next subject number without a data file. Only called on the event loop."""
+        while os.path.exists(self._data_filename(self.next_subject)):
+            self.next_subject += 1
+
+        subject_number = self.next_subject
+        self.next_subject += 1
+
+        # Claim the number right away so that no other station is given it
+        open(self._data_filename(subject_number), 'a').close()
+
+        return subject_number
+
+    def _compile(self, subject_number):
+        """Compiles a subject's schedule and returns the file's contents. Runs on a worker thread.
+        """
+        filename = schedule.schedule_filename(
+            self.exp_name, subject_number, os.path.join(self.data_directory, 'schedules'))
+
+        # The generator is shared, so schedules are compiled one at a time
+        with self.generation_lock:
+            schedule.compile_schedule(self.generator, subject_number, filename, self.seed)
+
+        with open(filename, 'rb') as f:
+            return f.read()
+
+    def _refusal(self, hello):
+        """Returns why a station cannot be given a schedule, or None if its settings match."""
+        if hello.get('experiment_name') != self.exp_name:
+            return 'The coordinator runs {}, not {}.'.format(
+                self.exp_name, hello.get('experiment_name'))
+
+        mismatches = generation.settings_mismatches(
+            hello.get('settings') or {}, self.generator.generation_settings())
+        if mismatches:
+            return 'The station\'s settings do not match the coordinator\'s: {}.'.format(
+                ', '.join(mismatches))
+
+        return None
+
+    async def _handle(self, reader, writer):
+        """Serves one station until it is done or disconnects."""
+        loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info('peername')
+        data_writer = None
+
+        try:
+            hello = json.loads(await reader.readline() or 'null')
+            if not hello or hello.get('type') != 'hello':
+                return
+
+            refusal = self._refusal(hello)
+            if refusal is not None:
+                writer.write(_encode({'type': 'error', 'message': refusal}))
+                await writer.drain()
+                return
+
+            subject_number = self._assign_subject()
+            status = {'station': hello.get('station') or str(peer), 'rows': 0, 'done': False}
+            self.stations[subject_number] = status
+
+            contents = await loop.run_in_executor(None, self._compile, subject_number)
+            writer.write(_encode({
+                'type': 'assign',
+                'subject': str(subject_number),
+                'seed': self.seed,
+                'schedule': base64.b64encode(contents).decode(),
+            }))
+            await writer.drain()
+
+            data_writer = datawriter.StreamingCSVWriter(
+                self._data_filename(subject_number), hello['fields'],
+                max_pending=self.batch_queue_size)
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                message = json.loads(line)
+
+                if message['type'] == 'done':
+                    await loop.run_in_executor(None, data_writer.close)
+                    data_writer = None
+                    status['done'] = True
+
+                    writer.write(_encode({'type': 'done'}))
+                    await writer.drain()
+                    break
+
+                # The put blocks when the writer is behind, which only stalls this station
+                rows = message['rows']
+                await loop.run_in_executor(None, _write_rows, data_writer, rows)
+                status['rows'] += len(rows)
+
+                writer.write(_encode({'type': 'ack', 'rows': len(rows)}))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if data_writer is not None:
+                await loop.run_in_executor(None, data_writer.close)
+            writer.close()
+
+    async def serve(self, host='localhost', port=8765, started=None):
+        """Accepts stations until the task is cancelled.
+
+        Parameters:
+        host -- The interface to listen on.
+        port -- The port to listen on. If 0, a free port is chosen.
+        started -- An optional function called with the (host, port) the server listens on.
+        """
+        # Batches of rows with large displays can be longer than the default line limit
+        server = await asyncio.start_server(self._handle, host, port, limit=2 ** 24)
+
+        if started is not None:
+            started(server.sockets[0].getsockname()[:2])
+
+        async with server:
+            await server.serve_forever()
+
+    def run(self, host='localhost', port=8765):
+        """Runs the coordinator until interrupted.
+
+        Parameters:
+        host -- The interface to listen on.
+        port -- The port to listen on.
+        """
+        try:
+            asyncio.run(self.serve(host, port, started=lambda address: print(
+                'Coordinating stations on {}:{} (seed {})'.format(*address, self.seed))))
+        except KeyboardInterrupt:
+            pass
+
+
+def _write_rows(data_writer, rows):
+    """Queues a batch of rows with a StreamingCSVWriter."""
+    for row in rows:
+        data_writer.write(row)
+
+
+class CoordinatorClient:
+    """Connects a station to a Coordinator and streams its trial rows from a background thread.
+
+    Parameters:
+    address -- The coordinator's 'host:port' address.
+    station -- The name of the station. Defaults to the host name.
+    batch_size -- The largest number of rows sent in one message.
+    max_in_flight -- The number of batches that may be unacknowledged before the background
+        thread waits for the coordinator.
+    max_pending -- The largest number of rows waiting to be sent. send blocks when the client
+        falls this far behind.
+    timeout -- The number of seconds to wait for the coordinator before giving up.
+
+    Methods:
+    connect -- Connects and returns the station's subject and schedule.
+    send -- Queues a trial row to be sent.
+    close -- Sends the remaining rows and disconnects.
+    """
+
+    def __init__(self, address, station=None, batch_size=20, max_in_flight=4, max_pending=10000,
+                 timeout=30):
+        self.address = parse_address(address)
+        self.station = station or socket.gethostname()
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+
+        self.pending = queue.Queue(max_pending)
+        self.error = None
+        self.socket = None
+        self.file = None
+        self.thread = None
+
+    def connect(self, fields, experiment_name, settings):
+        """Connects to the coordinator and starts the background thread.
+
+        Returns a dict with the assigned 'subject', the study 'seed' and the 'schedule' file
+        contents as bytes. Raises a ValueError if the coordinator refuses the station.
+
+        Parameters:
+        fields -- The data fields of the station's rows.
+        experiment_name -- The name of the station's experiment.
+        settings -- The station's generation settings (see TrialGenerator.generation_settings).
+        """
+        self.socket = socket.create_connection(self.address, timeout=self.timeout)
+        self.file = self.socket.makefile('rwb')
+
+        self.file.write(_encode({
+            'type': 'hello',
+            'station': self.station,
+            'fields': fields,
+            'experiment_name': experiment_name,
+            'settings': settings,
+        }))
+        self.file.flush()
+
+        try:
+            assignment = self._read('assign')
+        except ValueError:
+            self.close()
+            raise
+
+        assignment['schedule'] = base64.b64decode(assignment['schedule'])
+
+        self.thread = threading.Thread(target=self._send_rows, daemon=True)
+        self.thread.start()
+
+        return assignment
+
+    def _read(self, message_type):
+        """Reads the next message, which must be of the given type."""
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('The coordinator closed the connection.')
+
+        message = json.loads(line)
+        if message['type'] == 'error':
+            raise ValueError(message['message'])
+        if message['type'] != message_type:
+            raise ValueError('Expected a {} message from the coordinator.'.format(message_type))
+
+        return message
+
+    def _send_rows(self):
+        """Sends queued rows in batches until the client is closed. Runs on the background thread.
+        """
+        in_flight = 0
+        closing = False
+
+        try:
+            while not closing:
+                batch = [self.pending.get()]
+
+                # Send everything that has queued up since the last batch, up to batch_size rows
+                while len(batch) < self.batch_size and not self.pending.empty():
+                    batch.append(self.pending.get())
+
+                if batch[-1] is _CLOSE:
+                    closing = True
+                    batch.pop()
+
+                if batch:
+                    self.file.write(_encode({'type': 'rows', 'rows': batch}))
+                    self.file.flush()
+                    in_flight += 1
+
+                while in_flight >= self.max_in_flight or (closing and in_flight):
+                    self._read('ack')
+                    in_flight -= 1
+
+            self.file.write(_encode({'type': 'done'}))
+            self.file.flush()
+            self._read('done')
+        except Exception as e:  # Reported on the next send or close
+            self.error = e
+
+    def _check(self):
+        """Raises any error that happened on the background thread."""
+        if self.error is not None:
+            raise IOError('Could not send data to the coordinator') from self.error
+
+    def send(self, row):
+        """Queues a trial row to be sent.
+
+        Parameters:
+        row -- A dict of the data from one trial.
+        """
+        self._check()
+        self.pending.put(row)
+
+    def close(self):
+        """Sends any remaining rows, waits until the coordinator has saved them and disconnects.
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.pending.put(_CLOSE)
+            self.thread.join()
+
+        if self.socket is not None:
+            self.file.close()
+            self.socket.close()
+            self.socket = None
+
+        self._check()
+
+
+def main(argv=None):
+    """Runs a coordinator from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='localhost', help='The interface to listen on.')
+    parser.add_argument('--port', type=int, default=8765, help='The port to listen on.')
+    parser.add_argument('--data-directory', default='.', help='Where to save data and schedules.')
+    parser.add_argument('--seed', type=int, default=None, help='The study seed.')
+    parser.add_argument('--first-subject', type=int, default=1, help='The first subject number.')
+    parser.add_argument('--defaults', default=None,
+                        help='The experiment script to read settings from.')
+    args = parser.parse_args(argv)
+
+    Coordinator(args.data_directory, args.seed, args.first_subject, args.defaults).run(
+        args.host, args.port)
+
+
+if __name__ == '__main__':
+    main()
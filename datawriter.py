@@ -0,0 +1,180 @@
+"""Crash-safe streaming of trial data to a CSV file.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+By default trial data is kept in memory and written at the end of each block, so a crash loses the
+current block and memory grows with the length of the session. A StreamingCSVWriter instead hands
+each row to a background thread that appends it to the data file right away. The thread flushes
+after every batch of rows and calls fsync at most every fsync_interval seconds, so the disk work
+never happens on the thread that is presenting trials. Only rows that have not been written yet are
+kept in memory.
+
+Classes:
+StreamingCSVWriter -- Appends rows to a CSV file from a background thread.
+
+Functions:
+last_written_trial -- Returns the block and trial of the last row in a data file.
+"""
+
+import csv
+import os
+import queue
+import threading
+import time
+
+_CLOSE = object()
+
+
+class StreamingCSVWriter:
+    """Appends rows to a CSV file from a background thread.
+
+    A header is written if the file is empty or does not exist.
+
+    Parameters:
+    filename -- The CSV file to append to.
+    fieldnames -- The columns of the file.
+    fsync_interval -- The longest time in seconds between fsyncs while rows are being written.
+    max_pending -- The largest number of rows waiting to be written. write blocks when the writer
+        falls this far behind.
+
+    Methods:
+    write -- Queues a row to be written.
+    flush -- Waits until every queued row is written and synced to disk.
+    close -- Writes the remaining rows and stops the background thread.
+    """
+
+    def __init__(self, filename, fieldnames, fsync_interval=1.0, max_pending=10000):
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.fsync_interval = fsync_interval
+
+        _drop_partial_row(filename)
+
+        self.file = open(filename, 'a', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames, lineterminator='\n')
+        self.last_sync = time.monotonic()
+
+        if self.file.tell() == 0:
+            self.writer.writeheader()
+            self._sync()
+
+        self.pending = queue.Queue(max_pending)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_rows, daemon=True)
+        self.thread.start()
+
+    def _sync(self):
+        """Flushes the file and forces it to disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_sync = time.monotonic()
+
+    def _write_rows(self):
+        """Writes queued rows until the writer is closed. Runs on the background thread."""
+        while True:
+            item = self.pending.get()
+            batch = [item]
+
+            # Write everything that has queued up since the last batch in one go
+            while not self.pending.empty():
+                batch.append(self.pending.get())
+
+            try:
+                self._write_batch(batch)
+            except Exception as e:  # Reported on the next write, flush or close
+                self.error = e
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+
+            if _CLOSE in batch:
+                return
+
+    def _write_batch(self, batch):
+        """Writes a batch of rows, syncing if requested or if fsync_interval has passed."""
+        sync = False
+
+        for item in batch:
+            if isinstance(item, threading.Event):
+                sync = True
+            elif item is not _CLOSE:
+                self.writer.writerow(item)
+
+        self.file.flush()
+
+        if sync or _CLOSE in batch or time.monotonic() - self.last_sync > self.fsync_interval:
+            self._sync()
+
+        for item in batch:
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _check(self):
+        """Raises any error that happened on the background thread."""
+        if self.error is not None:
+            raise IOError('Could not write data to {}'.format(self.filename)) from self.error
+
+    def write(self, row):
+        """Queues a row to be written.
+
+        Parameters:
+        row -- A dict where keys exist in fieldnames.
+        """
+        self._check()
+        self.pending.put(row)
+
+    def flush(self):
+        """Waits until every queued row has been written and synced to disk."""
+        done = threading.Event()
+        self.pending.put(done)
+        done.wait()
+        self._check()
+
+    def close(self):
+        """Writes any remaining rows, syncs the file and stops the background thread."""
+        if self.thread.is_alive():
+            self.pending.put(_CLOSE)
+            self.thread.join()
+
+        if not self.file.closed:
+            self.file.close()
+
+        self._check()
+
+
+def _drop_partial_row(filename):
+    """Removes a row that was cut off by a crash from the end of a file."""
+    if not os.path.exists(filename):
+        return
+
+    with open(filename, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+
+def last_written_trial(filename):
+    """Returns the (block, trial) of the last numbered trial in a data file.
+
+    Returns None if the file does not exist or holds no numbered trials. Rows whose Block or Trial
+    are not numbers (such as practice trials) and rows cut off by a crash are ignored.
+
+    Parameters:
+    filename -- A CSV file written by the experiment.
+    """
+    if not os.path.exists(filename):
+        return None
+
+    last = None
+
+    with open(filename, newline='') as f:
+        for row in csv.DictReader(f):
+            if None in row.values():
+                continue  # Cut off before the last column
+
+            try:
+                last = int(row['Block']), int(row['Trial'])
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    return last
@@ -0,0 +1,602 @@
+"""Trial generation for the change detection experiment, without a display.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+TrialGenerator holds everything needed to create the trials of a session (set sizes, trial types,
+locations and colors) and only depends on NumPy. Ktask inherits from it, so its generation
+methods are the ones used during an experiment, but tools that only need trials (schedules,
+simulations, servers without a display) can use a TrialGenerator directly without importing
+psychopy:
+
+    import generation
+
+    generator = generation.TrialGenerator(**generation.experiment_defaults())
+    block = generator.make_seeded_block(block_num=0, subject_number=1)
+
+experiment_defaults reads the defaults at the top of changedetection.py without importing it, so
+edits made there are picked up without loading psychopy.
+
+Classes:
+TrialGenerator -- Creates blocks of trials.
+
+Functions:
+experiment_defaults -- Reads the generation defaults from changedetection.py.
+settings_mismatches -- Returns the generation settings that differ between two tasks.
+test_array -- Returns the coordinates and colors shown in a trial's test display.
+"""
+
+import ast
+import inspect
+import os
+import warnings
+
+import numpy as np
+
+import layouts
+import locations
+import palette
+import seeding
+import trialblock
+
+DEFAULT_COLORS = [
+    [1, -1, -1],
+    [-1,  1, -1],
+    [-1, -1,  1],
+    [1,  1, -1],
+    [1, -1,  1],
+    [-1,  1,  1],
+    [1,  1,  1],
+    [-1, -1, -1],
+    [1,  0, -1],
+]
+
+
+def experiment_defaults(filename=None):
+    """Reads the defaults set at the top of an experiment script without importing it.
+
+    Returns a dict of the values that TrialGenerator accepts, plus 'exp_name' if it is set.
+    Only values written as Python literals are read.
+
+    Parameters:
+    filename -- The experiment script. Defaults to changedetection.py next to this file.
+    """
+    if filename is None:
+        filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'changedetection.py')
+
+    with open(filename) as f:
+        tree = ast.parse(f.read(), filename)
+
+    names = set(inspect.signature(TrialGenerator).parameters) | {'exp_name'}
+    defaults = {}
+
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name) and node.targets[0].id in names):
+            try:
+                defaults[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                continue
+
+    return defaults
+
+
+def settings_mismatches(settings, other):
+    """Returns the sorted names of the generation settings that differ between two dicts.
+
+    Parameters:
+    settings -- A dict returned by TrialGenerator.generation_settings.
+    other -- Another such dict, for example one read back from a schedule.
+    """
+    return sorted(name for name in set(settings) | set(other)
+                  if settings.get(name) != other.get(name))
+
+
+def test_array(trial_type, coordinates, colors, test_loc, test_color, single_probe=True):
+    """Returns the coordinates and colors shown in a trial's test display.
+
+    Returns a tuple of (coordinates, colors). Used by Ktask.display_test and replay.py, so replayed
+    displays match the ones the participant saw.
+
+    Parameters:
+    trial_type -- Whether the trial is same or different.
+    coordinates -- A list of coordinates where stimuli were drawn.
+    colors -- The colors drawn at each coordinate in the sample display.
+    test_loc -- The index of the tested stimuli.
+    test_color -- The color of the tested stimuli.
+    single_probe -- If True, only the tested stimulus is shown.
+    """
+    # Replace the test color on diff trials
+    if trial_type == 'diff':
+        colors = list(colors)
+        colors[test_loc] = test_color
+
+    if single_probe:
+        return [coordinates[test_loc]], [colors[test_loc]]
+
+    return coordinates, colors
+
+
+def _accepts(method, name):
+    """Returns True if a method takes an argument called name."""
+    parameters = inspect.signature(method).parameters.values()
+    return any(p.name == name or p.kind == p.VAR_KEYWORD for p in parameters)
+
+
+class TrialGenerator:
+    """Creates the blocks and trials of a change detection session.
+
+    Parameters:
+    allowed_deg_from_fix -- The maximum distance in visual degrees the stimuli can appear from
+        fixation
+    colors -- The list of colors (list of 3 values, -1 to 1) to be used in the experiment.
+    compact_blocks -- If True, make_block returns a trialblock.TrialBlock built directly from
+        arrays, without calling make_trial. If a subclass overrides make_trial, the block is built
+        from its trials instead.
+    generation_budget -- The number of seconds generating the locations for a block may take.
+    keys -- The keys to be used for making a response. First is used for 'same' and the second is
+        used for 'different'
+    layout_cache -- A directory where pools of valid layouts are saved, or None. The pools are
+        loaded, and built if needed, by __init__.
+    layout_pool_size -- The number of layouts generated for each pool in layout_cache.
+    location_engine -- How stimulus locations are generated, 'rejection' or 'poisson'.
+    max_per_quad -- The number of stimuli allowed in each quadrant. If None, displays are
+        completely random.
+    min_color_distance -- The minimum CIELAB distance between the foil color on a change trial
+        and the stimuli colors it must differ from.
+    min_distance -- The minimum distance in visual degrees between stimuli.
+    number_of_blocks -- The number of blocks in the experiment.
+    number_of_trials_per_block -- The number of trials within each block.
+    percent_same -- A float between 0 and 1 (inclusive) describing the likelihood of a trial being
+        a "same" trial.
+    repeat_stim_colors -- If True, a stimuli display can have repeated colors.
+    repeat_test_colors -- If True, on a change trial the foil color can be one of the other colors
+        from the initial display. It always differs from the color it replaces.
+    seed -- The study seed. If None, a new seed is chosen.
+    set_sizes -- A list of all the set sizes. An equal number of trials will be shown for each set
+        size.
+    stim_size -- The size of the stimuli in visual angle.
+
+    See Ktask for more details on each parameter.
+
+    Methods:
+    block_rng -- Returns the random number generator for a block.
+    check_feasibility -- Checks that the displays can be generated within the budget.
+    generate_locations -- Helper function that generates locations for make_trial
+    generate_location_batch -- Helper function that generates locations for many trials at once.
+    generation_settings -- Returns the settings that determine the trials.
+    get_layout_pool -- Returns the saved pool of layouts for a set size.
+    make_block -- Creates a block of trials to be run.
+    make_seeded_block -- Creates a block of trials from the block's own random stream.
+    make_trial -- Creates a single trial.
+    sample_colors -- Samples the colors for many trials at once.
+    """
+
+    def __init__(self, number_of_trials_per_block=10, number_of_blocks=2, percent_same=0.5,
+                 set_sizes=(6,), stim_size=1.5, colors=DEFAULT_COLORS, keys=('s', 'd'),
+                 allowed_deg_from_fix=6, min_distance=2.5, max_per_quad=2,
+                 repeat_stim_colors=False, repeat_test_colors=False, location_engine='rejection',
+                 layout_cache=None, layout_pool_size=10000, seed=None, min_color_distance=0,
+                 generation_budget=1, compact_blocks=False):
+
+        self.number_of_trials_per_block = number_of_trials_per_block
+        self.number_of_blocks = number_of_blocks
+        self.percent_same = percent_same
+        self.set_sizes = list(set_sizes)
+        self.stim_size = stim_size
+
+        self.colors = colors
+        self.color_list = np.asarray(colors).tolist()
+        self.color_distances = palette.distance_matrix(colors)
+        self.min_color_distance = min_color_distance
+
+        self.keys = list(keys)
+
+        self.allowed_deg_from_fix = allowed_deg_from_fix
+
+        self.min_distance = min_distance
+
+        if max_per_quad is not None and max(self.set_sizes)/4 > max_per_quad:
+            raise ValueError('Max per quad is too small.')
+
+        self.max_per_quad = max_per_quad
+
+        if location_engine not in locations.LOCATION_ENGINES:
+            raise ValueError('Unknown location engine: {}'.format(location_engine))
+
+        self.location_engine = location_engine
+        self.layout_cache = layout_cache
+        self.layout_pool_size = layout_pool_size
+        self.layout_pools = {}
+        self.generation_budget = generation_budget
+
+        self.seed = seeding.new_seed() if seed is None else seed
+        self.rng = np.random.default_rng(self.seed)
+
+        self.repeat_stim_colors = repeat_stim_colors
+        self.repeat_test_colors = repeat_test_colors
+        self.compact_blocks = compact_blocks
+
+        self.same_trials_per_set_size = int((
+            number_of_trials_per_block / len(set_sizes)) * percent_same)
+
+        if self.same_trials_per_set_size % 1 != 0:
+            raise ValueError('Each trial type needs a whole number of trials.')
+        else:
+            self.diff_trials_per_set_size = (
+                number_of_trials_per_block - self.same_trials_per_set_size)
+
+        self.feasibility = self.check_feasibility()
+
+        # Pools are built or loaded now, so no layouts are generated while a session runs
+        if layout_cache is not None:
+            for set_size in self.set_sizes:
+                self.get_layout_pool(set_size)
+
+    def block_rng(self, block_num, subject_number=None):
+        """Returns the numpy.random.Generator for a block, derived from self.seed.
+
+        Parameters:
+        block_num -- The number of the block in the experiment.
+        subject_number -- The subject the block is for. If None, the subject number from
+            self.experiment_info (set by Ktask from the info dialog) is used.
+        """
+
+        if subject_number is None:
+            subject_number = self.experiment_info['Subject Number']
+
+        return seeding.block_rng(self.seed, subject_number, block_num)
+
+    def check_feasibility(self):
+        """Checks that displays can be generated for every set size. Called by __init__.
+
+        Returns a dict mapping each set size to the report from locations.check_feasibility, with
+        the fraction of sampled displays that leave a usable foil color added as 'foil_available'
+        (see palette.check_color_feasibility).
+        """
+
+        stacklevel = self._caller_stacklevel()
+
+        if self.min_distance < self.stim_size:
+            warnings.warn('min_distance is smaller than stim_size, so stimuli can overlap.',
+                          RuntimeWarning, stacklevel=stacklevel)
+
+        # A fixed seed keeps the check from depending on the session's random streams
+        rng = np.random.default_rng(0)
+
+        reports = {}
+
+        for set_size in self.set_sizes:
+            # With a layout cache, layouts are only generated to build a pool that is not saved yet
+            if self.layout_cache is None:
+                n_trials = self.same_trials_per_set_size + self.diff_trials_per_set_size
+            elif os.path.exists(self._layout_pool(set_size).path):
+                n_trials = None
+            else:
+                n_trials = self.layout_pool_size
+
+            reports[set_size] = locations.check_feasibility(
+                set_size, self.min_distance, self.allowed_deg_from_fix, self.max_per_quad,
+                self.location_engine, n_trials, self.generation_budget, rng,
+                stacklevel=stacklevel + 1)
+            reports[set_size]['foil_available'] = palette.check_color_feasibility(
+                self.color_distances, set_size, self.repeat_stim_colors, self.repeat_test_colors,
+                self.min_color_distance, rng)
+
+        return reports
+
+    def _caller_stacklevel(self):
+        """Returns the stacklevel that points a warning given in self.check_feasibility at the
+        code that created the task, however many __init__ methods of subclasses are in between.
+        """
+        frame = inspect.currentframe().f_back
+        stacklevel = 1
+
+        while frame is not None and frame.f_locals.get('self') is self:
+            frame = frame.f_back
+            stacklevel += 1
+
+        return stacklevel
+
+    def generation_settings(self):
+        """Returns the settings that determine the trials as a dict of JSON values.
+
+        Schedules store these settings, and a station running a schedule or connecting to a
+        coordinator must have the same ones (see Ktask.check_schedule). The seed is not included.
+        """
+
+        return {
+            'number_of_trials_per_block': self.number_of_trials_per_block,
+            'number_of_blocks': self.number_of_blocks,
+            'percent_same': self.percent_same,
+            'set_sizes': list(self.set_sizes),
+            'colors': self.color_list,
+            'keys': list(self.keys),
+            'allowed_deg_from_fix': self.allowed_deg_from_fix,
+            'min_distance': self.min_distance,
+            'max_per_quad': self.max_per_quad,
+            'min_color_distance': self.min_color_distance,
+            'repeat_stim_colors': self.repeat_stim_colors,
+            'repeat_test_colors': self.repeat_test_colors,
+            'location_engine': self.location_engine,
+            'layout_pool_size': self.layout_pool_size if self.layout_cache is not None else None,
+        }
+
+    def make_seeded_block(self, block_num, subject_number=None, seed=None):
+        """Makes a block of trials from the block's own random stream.
+
+        The stream comes from seeding.block_rng, so the block only depends on the seed, the subject
+        and the block number. Subclasses that override make_block without an rng argument are
+        still supported: self.rng is set to the block's stream while their make_block runs.
+
+        Parameters:
+        block_num -- The number of the block in the experiment.
+        subject_number -- The subject the block is for. If None, the subject number from
+            self.experiment_info is used.
+        seed -- The study seed. If None, self.seed is used.
+        """
+
+        if subject_number is None:
+            subject_number = self.experiment_info['Subject Number']
+
+        rng = seeding.block_rng(self.seed if seed is None else seed, subject_number, block_num)
+
+        if _accepts(self.make_block, 'rng'):
+            return self.make_block(rng)
+
+        saved_rng, self.rng = self.rng, rng
+        try:
+            return self.make_block()
+        finally:
+            self.rng = saved_rng
+
+    def make_block(self, rng=None):
+        """Makes a block of trials.
+
+        Returns a shuffled list of trials created by self.make_trial. If self.compact_blocks is
+        True, a trialblock.TrialBlock holding the same trials is returned instead.
+
+        Subclasses that override make_trial(self, set_size, trial_type) without the later
+        arguments are still supported: their make_trial is called once per trial with self.rng set
+        to rng, so it makes its own locations and colors.
+
+        Parameters:
+        rng -- The numpy.random.Generator every random choice in the block is made with, usually
+            from self.block_rng. If None, self.rng is used. Overrides may leave it out, as
+            make_seeded_block sets self.rng instead.
+        """
+
+        if rng is None:
+            rng = self.rng
+
+        overridden = type(self).make_trial is not TrialGenerator.make_trial
+
+        if self.compact_blocks and not overridden:
+            return self._make_compact_block(rng)
+
+        if not _accepts(self.make_trial, 'color_sample'):
+            saved_rng, self.rng = self.rng, rng
+            try:
+                trial_list = [self.make_trial(set_size, trial_type)
+                              for set_size in self.set_sizes
+                              for trial_type in self._trial_types()]
+            finally:
+                self.rng = saved_rng
+        else:
+            trial_list = self._make_trials(rng)
+
+        trial_list = [trial_list[i] for i in rng.permutation(len(trial_list))]
+
+        if self.compact_blocks:
+            return trialblock.TrialBlock.from_trials(trial_list, self.colors, self.keys)
+
+        return trial_list
+
+    def _trial_types(self):
+        """Returns the trial type of every trial of one set size, in the order they are made."""
+        return ['same'] * self.same_trials_per_set_size + ['diff'] * self.diff_trials_per_set_size
+
+    def _make_trials(self, rng):
+        """Makes the trials of a block with batches of locations and colors, before shuffling. A
+        helper function for self.make_block.
+        """
+        trial_list = []
+
+        for set_size in self.set_sizes:
+            n_trials = self.same_trials_per_set_size + self.diff_trials_per_set_size
+            locs = self._block_locations(n_trials, set_size, rng)
+            color_samples = list(zip(*self.sample_colors(n_trials, set_size, rng)))
+
+            for trial_type in self._trial_types():
+                trial_list.append(self.make_trial(
+                    set_size, trial_type, locs=locs.pop(), rng=rng,
+                    color_sample=color_samples.pop()))
+
+        return trial_list
+
+    def _make_compact_block(self, rng):
+        """Makes a block as a trialblock.TrialBlock. A helper function for self.make_block.
+
+        The same random draws are made in the same order as the list version, so both hold the
+        same trials.
+        """
+
+        n_trials = self.same_trials_per_set_size + self.diff_trials_per_set_size
+        width = max(self.set_sizes)
+        data = np.zeros(n_trials * len(self.set_sizes), dtype=trialblock.trial_dtype(width))
+
+        trial_types = np.repeat([0, 1], [self.same_trials_per_set_size,
+                                         self.diff_trials_per_set_size])
+
+        for i, set_size in enumerate(self.set_sizes):
+            locs = np.asarray(self._block_locations(n_trials, set_size, rng), dtype=float)
+            test_locations, stim_indices, test_indices = self.sample_colors(
+                n_trials, set_size, rng)
+
+            # The list version pops from the end of each batch
+            rows = data[i * n_trials:(i + 1) * n_trials]
+            rows['set_size'] = set_size
+            rows['trial_type'] = trial_types
+            rows['test_location'] = test_locations[::-1]
+            rows['locations'] = np.nan
+            rows['locations'][:, :set_size] = locs[::-1]
+            rows['stim_color_indices'] = -1
+            rows['stim_color_indices'][:, :set_size] = stim_indices[::-1]
+            rows['test_color_index'] = test_indices[::-1]
+
+        block = trialblock.TrialBlock(data, self.colors, self.keys)
+        block.shuffle(rng)
+
+        return block
+
+    def _block_locations(self, n_trials, set_size, rng):
+        """Returns the locations for the trials of one set size. A helper function for
+        self.make_block.
+
+        If a subclass overrides generate_locations, it is called once per trial so the override is
+        used. Otherwise the locations are generated in a single batch.
+        """
+        if type(self).generate_locations is not TrialGenerator.generate_locations:
+            return [self._generate_locations(set_size, rng) for _ in range(n_trials)]
+
+        return self.generate_location_batch(n_trials, set_size, rng)
+
+    def _generate_locations(self, set_size, rng):
+        """Calls self.generate_locations, without rng for overrides written before it was added.
+        """
+        if _accepts(self.generate_locations, 'rng'):
+            return self.generate_locations(set_size, rng=rng)
+
+        return self.generate_locations(set_size)
+
+    def generate_locations(self, set_size, rng=None):
+        """Creates the locations for a trial. A helper function for self.make_trial.
+
+        Returns a list of acceptable locations.
+
+        Subclasses can override this to change how displays are laid out. make_block then calls it
+        for every trial instead of generating each set size's locations in one batch, so the
+        override is always used. Overrides may leave out the rng argument, but should then make
+        their own random choices reproducible.
+
+        Parameters:
+        set_size -- The number of stimuli for this trial.
+        rng -- The numpy.random.Generator to use. If None, self.rng is used.
+        """
+        return self.generate_location_batch(1, set_size, rng)[0]
+
+    def generate_location_batch(self, n_trials, set_size, rng=None):
+        """Creates the locations for many trials at once. A helper function for self.make_block.
+
+        Returns a list containing a list of acceptable locations for each trial.
+
+        Parameters:
+        n_trials -- The number of trials to create locations for.
+        set_size -- The number of stimuli for each trial.
+        rng -- The numpy.random.Generator to use. If None, self.rng is used.
+        """
+        return self._location_array(n_trials, set_size, rng).tolist()
+
+    def _location_array(self, n_trials, set_size, rng=None):
+        """Returns the locations for many trials as an array with shape (n_trials, set_size, 2).
+        """
+        if rng is None:
+            rng = self.rng
+
+        if self.layout_cache is not None:
+            return self.get_layout_pool(set_size).sample(n_trials, rng)
+
+        generate = locations.LOCATION_ENGINES[self.location_engine]
+
+        return generate(
+            n_trials, set_size, self.min_distance, self.allowed_deg_from_fix,
+            self.max_per_quad, rng=rng)
+
+    def _layout_pool(self, set_size):
+        """Returns a layouts.LayoutPool for a set size, without loading it."""
+        return layouts.LayoutPool(
+            self.layout_cache, set_size, self.min_distance, self.allowed_deg_from_fix,
+            self.max_per_quad, self.location_engine, self.layout_pool_size)
+
+    def get_layout_pool(self, set_size):
+        """Returns the layouts.LayoutPool for a set size, loading it on first use.
+
+        __init__ loads the pool of every set size, building any that are not saved yet.
+
+        Parameters:
+        set_size -- The number of stimuli in each layout.
+        """
+        if set_size not in self.layout_pools:
+            pool = self._layout_pool(set_size)
+            # Pools are built from a seed derived from their parameters so every station that
+            # builds one gets the same layouts
+            pool.load(np.random.default_rng(int(pool.key, 16)))
+            self.layout_pools[set_size] = pool
+
+        return self.layout_pools[set_size]
+
+    def sample_colors(self, n_trials, set_size, rng=None):
+        """Samples the test location, stimuli colors and foil color for many trials at once.
+
+        Returns a tuple of arrays (test_locations, stim_indices, test_indices), where colors are
+        indices into self.colors. See palette.sample_colors.
+
+        Parameters:
+        n_trials -- The number of trials to sample.
+        set_size -- The number of stimuli for each trial.
+        rng -- The numpy.random.Generator to use. If None, self.rng is used.
+        """
+        if rng is None:
+            rng = self.rng
+
+        return palette.sample_colors(
+            self.color_distances, n_trials, set_size, rng, self.repeat_stim_colors,
+            self.repeat_test_colors, self.min_color_distance)
+
+    def make_trial(self, set_size, trial_type, locs=None, rng=None, color_sample=None):
+        """Creates a single trial dict. A helper function for self.make_block.
+
+        Returns the trial dict.
+
+        Parameters:
+        set_size -- The number of stimuli for this trial.
+        trial_type -- Whether this trial is same or different.
+        locs -- Optional pre-generated locations for this trial. If None, self.generate_locations
+            is called.
+        rng -- The numpy.random.Generator to use. If None, self.rng is used.
+        color_sample -- Optional pre-sampled (test_location, stim_indices, test_index) for this
+            trial, from self.sample_colors. If None, self.sample_colors is called.
+        """
+
+        if rng is None:
+            rng = self.rng
+
+        if trial_type == 'same':
+            cresp = self.keys[0]
+        else:
+            cresp = self.keys[1]
+
+        if color_sample is None:
+            color_sample = [values[0] for values in self.sample_colors(1, set_size, rng)]
+
+        test_location, stim_indices, test_index = color_sample
+
+        stim_indices = stim_indices.tolist()
+        stim_colors = [self.color_list[i] for i in stim_indices]
+        test_color = self.color_list[test_index]
+
+        if locs is None:
+            locs = self._generate_locations(set_size, rng)
+
+        trial = {
+            'set_size': set_size,
+            'trial_type': trial_type,
+            'cresp': cresp,
+            'locations': locs,
+            'stim_colors': stim_colors,
+            'test_color': test_color,
+            'test_location': int(test_location),
+            'stim_color_indices': stim_indices,
+            'test_color_index': int(test_index),
+        }
+
+        return trial
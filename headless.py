@@ -0,0 +1,195 @@
+"""A headless version of the change detection experiment with a simulated participant.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+HeadlessKtask runs the full Ktask.run pipeline (hooks, trial generation, display timing, data
+files) without opening a window, showing a dialog or waiting for a keyboard. The window is replaced
+by a NullWindow that only keeps track of flips, nothing is drawn, and responses come from an
+observer.SimulatedObserver. This makes it possible to benchmark and profile the trial loop on
+machines without a display.
+
+By default the NullWindow runs on a simulated clock and no waits are performed, so a session runs
+as fast as the code allows. Pass realtime=True to keep the normal display durations.
+
+Classes:
+NullWindow -- Stands in for the psychopy window.
+NullRenderer -- Stands in for renderer.StimulusRenderer.
+HeadlessKtask -- A Ktask that uses the classes above and an observer.SimulatedObserver.
+
+Attributes:
+SimulatedObserver -- observer.SimulatedObserver, which can still be imported from here.
+"""
+
+import math
+import time
+
+import changedetection
+import observer
+
+# SimulatedObserver lived here before it moved to observer.py
+SimulatedObserver = observer.SimulatedObserver
+
+
+class NullWindow:
+    """Stands in for a psychopy window. Nothing is drawn.
+
+    Parameters:
+    frame_rate -- The refresh rate to simulate.
+    realtime -- If True, flip waits until the next frame like a real window. If False, flip
+        returns immediately and time advances by one frame on a simulated clock.
+
+    Methods:
+    flip -- Returns the time of the next frame.
+    callOnFlip -- Does nothing, as no responses are collected from a keyboard.
+    getActualFrameRate -- Returns the simulated refresh rate.
+    clearBuffer -- Does nothing.
+    close -- Marks the window as closed.
+    """
+
+    def __init__(self, frame_rate=60, realtime=False):
+        self.frame_rate = frame_rate
+        self.monitorFramePeriod = 1.0 / frame_rate
+        self.realtime = realtime
+        self.closed = False
+
+        self.n_flips = 0
+        self.last_flip = time.perf_counter() if realtime else 0.0
+
+    def flip(self):
+        """Returns the time of the next frame, waiting for it if realtime is True."""
+        self.n_flips += 1
+        self.last_flip += self.monitorFramePeriod
+
+        if self.realtime:
+            now = time.perf_counter()
+            if now < self.last_flip:
+                time.sleep(self.last_flip - now)
+            else:
+                # A late flip lands on the next frame, like it would on a real window
+                self.last_flip += math.ceil(
+                    (now - self.last_flip) / self.monitorFramePeriod) * self.monitorFramePeriod
+
+        return self.last_flip
+
+    def callOnFlip(self, function, *args, **kwargs):
+        """Does nothing. Keyboard responses are armed this way, but the observer responds instead.
+        """
+
+    def getActualFrameRate(self):
+        """Returns the simulated refresh rate."""
+        return self.frame_rate
+
+    def clearBuffer(self):
+        """Does nothing, as nothing is drawn."""
+
+    def close(self):
+        """Marks the window as closed."""
+        self.closed = True
+
+
+class _NullDisplay:
+    """A prerendered display that draws nothing."""
+
+    def draw(self):
+        pass
+
+
+class NullRenderer:
+    """Stands in for renderer.StimulusRenderer. Nothing is drawn.
+
+    Parameters:
+    window -- The NullWindow being drawn to.
+    """
+
+    def __init__(self, window):
+        self.window = window
+
+    def draw_fixation(self):
+        pass
+
+    def draw_squares(self, coordinates, colors):
+        pass
+
+    def prerender(self, coordinates, colors):
+        return _NullDisplay()
+
+
+class HeadlessKtask(changedetection.Ktask):
+    """A Ktask that runs without a display, dialog or participant.
+
+    Parameters:
+    observer -- The SimulatedObserver that responds to trials. If None, one is created with the
+        experiment keys.
+    experiment_info -- The values the info dialog would have returned. 'Subject Number' defaults
+        to '0'.
+    frame_rate -- The refresh rate of the NullWindow.
+    realtime -- If True, displays are shown for their normal durations.
+
+    All other arguments are sent to Ktask(). experiment_name and data_fields default to those in
+    changedetection.py.
+    """
+
+    def __init__(self, observer=None, experiment_info=None, frame_rate=60, realtime=False,
+                 **kwargs):
+        kwargs.setdefault('experiment_name', changedetection.exp_name)
+        kwargs.setdefault('data_fields', changedetection.data_fields)
+
+        super().__init__(**kwargs)
+
+        self.observer = SimulatedObserver(keys=self.keys) if observer is None else observer
+        self.headless_info = {'Subject Number': '0'}
+        self.headless_info.update(experiment_info or {})
+        self.frame_rate = frame_rate
+        self.realtime = realtime
+        self.current_trial = None
+
+    def get_experiment_info_from_dialog(self, additional_fields_dict=None):
+        """Uses the experiment_info given to the constructor instead of showing a dialog."""
+        self.experiment_info = dict(self.headless_info)
+        return True
+
+    def open_window(self, **kwargs):
+        """Opens a NullWindow."""
+        self.experiment_window = NullWindow(self.frame_rate, self.realtime)
+
+    def display_text_screen(self, *args, **kwargs):
+        """Skips text screens, which would otherwise wait for a key press."""
+
+    def get_renderer(self):
+        """Returns a NullRenderer."""
+        if self.renderer is None or self.renderer.window is not self.experiment_window:
+            self.renderer = NullRenderer(self.experiment_window)
+
+        return self.renderer
+
+    def _present(self, draw, wait_time, phase, callback=None):
+        """Presents a display, skipping the wait unless realtime is True."""
+        if self.realtime or self.timing_mode == 'frames':
+            super()._present(draw, wait_time, phase, callback)
+            return
+
+        draw()
+        self.experiment_window.flip()
+
+        if callback is not None:
+            callback()
+
+    def run_trial(self, trial, block_num, trial_num):
+        """Runs a single trial, keeping track of it so the observer can respond."""
+        self.current_trial = trial
+        return super().run_trial(trial, block_num, trial_num)
+
+    def get_response(self):
+        """Returns the observer's response to the current trial."""
+        return self.observer.respond(self.current_trial)
+
+    def quit_experiment(self):
+        """Closes the data writer, saves instrumentation and closes the window without exiting
+        Python.
+        """
+        self.stop_prefetch()
+        self.close_data_writer()
+        self.save_instrumentation()
+
+        if self.experiment_window is not None:
+            self.experiment_window.close()
@@ -0,0 +1,184 @@
+"""Incremental ingest of session files into a consolidated study store.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+The data directory collects a data file and an experiment info file for every session. Rather than
+re-reading every file for each analysis, ingest keeps a store directory with a manifest recording
+the path, size, modification time and SHA-1 hash of every file it has ingested. Files whose size
+and modification time have not changed are skipped without being read, and files whose contents
+have not changed are only re-stat'ed, so a nightly run costs time proportional to the new data.
+
+Data files are converted to the columnar format (see columnar.py) and saved in the store's
+segments directory, one segment per session. A changed session replaces its segment. Other files
+(such as experiment info files) are copied to the store's info directory. analysis.py can be run
+directly on the segments directory:
+
+    python ingest.py ~/Desktop/ChangeDetection/Data study_store
+    python analysis.py study_store/segments --output k_summary.csv
+
+Functions:
+file_hash -- Returns the SHA-1 hash of a file.
+load_manifest -- Loads a store's manifest.
+ingest -- Ingests new and changed files from a data directory.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+
+import columnar
+
+MANIFEST_NAME = 'manifest.json'
+DATA_FIELDS = {'SetSize', 'TrialType'}
+
+
+def file_hash(filename, chunk_size=1 << 20):
+    """Returns the SHA-1 hex digest of a file, reading it in chunks.
+
+    Parameters:
+    filename -- The file to hash.
+    chunk_size -- The number of bytes read at a time.
+    """
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(store_directory):
+    """Returns the manifest of a store, mapping relative paths to file records.
+
+    Parameters:
+    store_directory -- The store created by ingest.
+    """
+    path = os.path.join(store_directory, MANIFEST_NAME)
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(store_directory, manifest):
+    """Saves the manifest under a temporary name and moves it into place."""
+    path = os.path.join(store_directory, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _is_data_file(filename):
+    """Checks whether a file is a CSV data file written by the experiment."""
+    if not filename.endswith('.csv'):
+        return False
+
+    with open(filename, newline='') as f:
+        header = next(csv.reader(f), [])
+
+    return DATA_FIELDS <= set(header)
+
+
+def _store_name(relpath):
+    """Returns the name a file is stored under, flattening any subdirectories."""
+    return relpath.replace(os.sep, '__')
+
+
+def _ingest_file(filename, relpath, store_directory):
+    """Saves one new or changed file in the store. Returns where it was stored."""
+    name = _store_name(relpath)
+
+    if _is_data_file(filename):
+        segment = os.path.join('segments', os.path.splitext(name)[0] + '_columns')
+        tmp_segment = os.path.join(store_directory, segment + '.tmp')
+        shutil.rmtree(tmp_segment, ignore_errors=True)
+        columnar.csv_to_columns(filename, tmp_segment)
+
+        # Swap in the new segment only once it is complete
+        shutil.rmtree(os.path.join(store_directory, segment), ignore_errors=True)
+        os.replace(tmp_segment, os.path.join(store_directory, segment))
+        return segment
+
+    stored = os.path.join('info', name)
+    shutil.copy2(filename, os.path.join(store_directory, stored))
+    return stored
+
+
+def _walk(data_directory):
+    """Yields the relative path of every regular, non-hidden file in a directory."""
+    for root, dirs, files in os.walk(data_directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and not d.endswith('_columns'))
+        for name in sorted(files):
+            if not name.startswith('.'):
+                yield os.path.relpath(os.path.join(root, name), data_directory)
+
+
+def ingest(data_directory, store_directory):
+    """Ingests new and changed files from a data directory into a store.
+
+    Returns a dict listing the 'new', 'changed' and 'unchanged' relative paths.
+
+    Parameters:
+    data_directory -- The directory sessions are saved in.
+    store_directory -- The store to update. It is created if needed.
+    """
+    for subdirectory in ['segments', 'info']:
+        os.makedirs(os.path.join(store_directory, subdirectory), exist_ok=True)
+
+    manifest = load_manifest(store_directory)
+    report = {'new': [], 'changed': [], 'unchanged': []}
+
+    for relpath in _walk(data_directory):
+        filename = os.path.join(data_directory, relpath)
+        stat = os.stat(filename)
+        record = manifest.get(relpath)
+
+        if record is not None and (record['size'], record['mtime']) == (
+                stat.st_size, stat.st_mtime):
+            report['unchanged'].append(relpath)
+            continue
+
+        digest = file_hash(filename)
+
+        if record is not None and record['sha1'] == digest:
+            record['mtime'] = stat.st_mtime  # Touched but not modified
+            report['unchanged'].append(relpath)
+            continue
+
+        report['new' if record is None else 'changed'].append(relpath)
+        manifest[relpath] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': digest,
+            'stored': _ingest_file(filename, relpath, store_directory),
+        }
+
+        # Saving after each file means an interrupted run only repeats the file it was on
+        _save_manifest(store_directory, manifest)
+
+    _save_manifest(store_directory, manifest)
+
+    return report
+
+
+def main(argv=None):
+    """Ingests a data directory from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('data_directory', help='The directory sessions are saved in.')
+    parser.add_argument('store_directory', help='The store to update.')
+    args = parser.parse_args(argv)
+
+    report = ingest(args.data_directory, args.store_directory)
+
+    print('{} new, {} changed, {} unchanged'.format(
+        len(report['new']), len(report['changed']), len(report['unchanged'])))
+
+
+if __name__ == '__main__':
+    main()
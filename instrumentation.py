@@ -0,0 +1,169 @@
+"""Per-phase timing and optional profiling of the experiment loop.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+An Instrumentation object records the wall time spent in each phase of every trial (fixation,
+sample, delay, test draw, response wait and data write) as well as the time taken to make each
+block. Trials can additionally be run under cProfile, to see which functions the time is spent in,
+or tracemalloc, to see how much memory each trial allocates. At the end of the session the
+per-trial rows, an aggregate report and any profile are saved next to the data file.
+
+When instrumentation is turned off Ktask uses NULL_PHASE, a shared context manager that does
+nothing, so the phases cost a single function call.
+
+Classes:
+Instrumentation -- Records phase timings and profiles.
+
+Attributes:
+INSTRUMENT_MODES -- The available modes: 'timing', 'cprofile' and 'tracemalloc'.
+NULL_PHASE -- A context manager that records nothing.
+"""
+
+import contextlib
+import cProfile
+import csv
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+import numpy as np
+
+INSTRUMENT_MODES = ['timing', 'cprofile', 'tracemalloc']
+PHASES = ['fixation', 'sample', 'delay', 'test', 'response', 'send_data']
+
+NULL_PHASE = contextlib.nullcontext()
+
+
+class Instrumentation:
+    """Records the time spent in each phase of every trial.
+
+    Parameters:
+    mode -- 'timing' to only time phases, 'cprofile' to also profile each trial, or 'tracemalloc'
+        to also record the memory allocated by each trial.
+
+    Methods:
+    phase -- A context manager that times a phase.
+    start_trial -- Starts recording a trial.
+    end_trial -- Finishes recording a trial.
+    report -- Returns aggregate statistics for every phase.
+    save -- Saves the trial rows, the report and any profile.
+    """
+
+    def __init__(self, mode='timing'):
+        if mode not in INSTRUMENT_MODES:
+            raise ValueError('Unknown instrumentation mode: {}'.format(mode))
+
+        self.mode = mode
+        self.rows = []
+        self.block_times = []
+        self.current = None
+
+        self.profile = cProfile.Profile() if mode == 'cprofile' else None
+
+        if mode == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times the code run inside the with statement.
+
+        make_block is recorded per block, and every other phase is added to the current trial.
+
+        Parameters:
+        name -- The name of the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+
+            if name == 'make_block':
+                self.block_times.append(elapsed)
+            elif self.current is not None:
+                self.current[name] = self.current.get(name, 0) + elapsed
+
+    def start_trial(self, block_num, trial_num):
+        """Starts recording a trial.
+
+        Parameters:
+        block_num -- The number of the block in the experiment.
+        trial_num -- The number of the trial within a block.
+        """
+        self.current = {'Block': block_num, 'Trial': trial_num}
+
+        if self.mode == 'tracemalloc':
+            tracemalloc.reset_peak()
+            self.current['_memory_start'] = tracemalloc.get_traced_memory()[0]
+        elif self.profile is not None:
+            self.profile.enable()
+
+        self.current['_start'] = time.perf_counter()
+
+    def end_trial(self):
+        """Finishes recording the current trial."""
+        total = (time.perf_counter() - self.current.pop('_start')) * 1000
+
+        if self.profile is not None:
+            self.profile.disable()
+        elif self.mode == 'tracemalloc':
+            current, peak = tracemalloc.get_traced_memory()
+            start = self.current.pop('_memory_start')
+            self.current['AllocatedKB'] = (current - start) / 1024
+            self.current['PeakKB'] = (peak - start) / 1024
+
+        self.current['total'] = total
+        self.rows.append(self.current)
+        self.current = None
+
+    def report(self):
+        """Returns a dict of statistics (in ms) for make_block and every trial phase."""
+        report = {'trials': len(self.rows), 'mode': self.mode}
+
+        columns = {'make_block': self.block_times}
+        for name in PHASES + ['total']:
+            columns[name] = [row.get(name, 0) for row in self.rows]
+
+        for name, values in columns.items():
+            if not values:
+                continue
+            values = np.array(values)
+            report[name] = {
+                'mean': float(values.mean()),
+                'median': float(np.median(values)),
+                'p95': float(np.percentile(values, 95)),
+                'max': float(values.max()),
+                'total': float(values.sum()),
+            }
+
+        if self.profile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(20)
+            report['profile'] = stream.getvalue()
+
+        return report
+
+    def save(self, filename_base):
+        """Saves the per-trial rows, the aggregate report and any profile.
+
+        Files are named filename_base + '_timing.csv', '_timing_report.json' and '_profile.prof'.
+
+        Parameters:
+        filename_base -- The start of each file name, usually the data file without '.csv'.
+        """
+        fields = ['Block', 'Trial'] + PHASES + ['total']
+        if self.mode == 'tracemalloc':
+            fields += ['AllocatedKB', 'PeakKB']
+
+        with open(filename_base + '_timing.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields, restval=0, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+        with open(filename_base + '_timing_report.json', 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+        if self.profile is not None:
+            self.profile.dump_stats(filename_base + '_profile.prof')
@@ -0,0 +1,132 @@
+"""A persistent pool of pre-validated stimulus layouts.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Valid layouts only depend on the set size and the location constraints (min_distance,
+allowed_deg_from_fix, max_per_quad and the location engine), so they can be generated once and
+reused across trials and sessions. A LayoutPool stores layouts in a .npy file named after a hash of
+those parameters and the pool size, and memory-maps it when loaded. Sampled layouts are randomly
+rotated by a multiple of 90 degrees and reflected, which keeps every constraint satisfied while
+multiplying the number of distinct displays by eight.
+
+Classes:
+LayoutPool -- A pool of layouts for one set of parameters.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import locations
+
+
+class LayoutPool:
+    """A pool of valid layouts for one set size and set of location constraints.
+
+    The pool is built with locations.LOCATION_ENGINES the first time it is needed and saved in
+    cache_directory. Later pools with the same parameters load the saved file instead.
+
+    Parameters:
+    cache_directory -- The directory the pool file is stored in.
+    set_size -- The number of stimuli in each layout.
+    min_distance -- The minimum distance in visual degrees between stimuli and from fixation.
+    allowed_deg_from_fix -- The maximum distance in visual degrees on each axis from fixation.
+    max_per_quad -- The number of stimuli allowed in each quadrant, or None.
+    location_engine -- The name of the engine used to build the pool.
+    pool_size -- The number of layouts generated when building the pool.
+
+    Methods:
+    load -- Loads the pool from disk, building it first if needed.
+    build -- Generates the pool and saves it to disk.
+    sample -- Returns randomly chosen and transformed layouts.
+    """
+
+    def __init__(self, cache_directory, set_size, min_distance, allowed_deg_from_fix,
+                 max_per_quad=None, location_engine='rejection', pool_size=10000):
+        self.cache_directory = cache_directory
+        self.set_size = set_size
+        self.min_distance = min_distance
+        self.allowed_deg_from_fix = allowed_deg_from_fix
+        self.max_per_quad = max_per_quad
+        self.location_engine = location_engine
+        self.pool_size = pool_size
+
+        self.layouts = None
+
+    @property
+    def key(self):
+        """A hash of the parameters that determine which layouts are in the pool."""
+        params = json.dumps([
+            self.set_size, self.min_distance, self.allowed_deg_from_fix, self.max_per_quad,
+            self.location_engine, self.pool_size,
+        ])
+        return hashlib.sha1(params.encode('utf-8')).hexdigest()[:16]
+
+    @property
+    def path(self):
+        """The file the pool is stored in."""
+        return os.path.join(self.cache_directory, 'layouts_{}.npy'.format(self.key))
+
+    def load(self, rng=None):
+        """Memory-maps the pool from disk, building it first if the file does not exist.
+
+        Returns the array of layouts with shape (pool_size, set_size, 2).
+
+        Parameters:
+        rng -- A numpy.random.Generator used if the pool needs to be built.
+        """
+        if not os.path.exists(self.path):
+            self.build(rng)
+
+        self.layouts = np.load(self.path, mmap_mode='r')
+        return self.layouts
+
+    def build(self, rng=None):
+        """Generates pool_size layouts and saves them to disk.
+
+        The file is written under a temporary name and then moved into place so that a partially
+        written pool is never loaded.
+
+        Parameters:
+        rng -- A numpy.random.Generator. If None, a new unseeded generator is used.
+        """
+        generate = locations.LOCATION_ENGINES[self.location_engine]
+        layouts = generate(
+            self.pool_size, self.set_size, self.min_distance, self.allowed_deg_from_fix,
+            self.max_per_quad, rng=rng)
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+        tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, layouts)
+        os.replace(tmp_path, self.path)
+
+    def sample(self, n_trials, rng=None, transform=True):
+        """Chooses layouts from the pool.
+
+        Returns an array with shape (n_trials, set_size, 2).
+
+        Parameters:
+        n_trials -- The number of layouts to return.
+        rng -- A numpy.random.Generator. If None, a new unseeded generator is used.
+        transform -- If True, each layout is randomly rotated by a multiple of 90 degrees and
+            reflected.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+
+        if self.layouts is None:
+            self.load(rng)
+
+        layouts = np.array(self.layouts[rng.integers(len(self.layouts), size=n_trials)])
+
+        if transform:
+            # Swapping axes and flipping the sign of each axis covers all 8 symmetries of a square
+            swap = rng.random(n_trials) < 0.5
+            layouts[swap] = layouts[swap][..., ::-1]
+            layouts *= rng.choice([-1, 1], size=(n_trials, 1, 2))
+
+        return layouts
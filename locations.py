@@ -0,0 +1,455 @@
+"""Location generation for the change detection experiment.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Stimulus locations are drawn uniformly from a square of +/- allowed_deg_from_fix visual degrees
+and rejected if they fall within min_distance of fixation or of an already accepted location, or
+if their quadrant already holds max_per_quad stimuli. This module performs that rejection
+sampling with NumPy, advancing every requested trial at once, so that many displays can be
+created in a single call. It only depends on NumPy so it can be used without a display.
+
+Dense displays (large set sizes relative to the available area) rarely succeed with pure
+rejection sampling. For those, poisson_disk_batch builds a packed Poisson-disk point set with
+Bridson's algorithm, using a grid hash so each candidate is only compared with its neighbors,
+and then chooses set_size of its points while respecting max_per_quad. Any subset of a
+Poisson-disk set already satisfies min_distance, so this runs in time close to linear in the
+number of points. Displays made this way are more evenly spread than rejection sampled ones.
+
+check_feasibility estimates whether a configuration can be generated, and how long it will take,
+before any trials are made. An upper bound on how many stimuli can be packed into the allowed
+area rules out impossible configurations. Filling a small sample of displays gives the acceptance
+rate of candidate locations as each stimulus is placed, and so the expected number of candidates
+each display needs, as well as how often a display runs out of the sampler's attempts before it
+is filled.
+Timing a few displays gives the expected time to make a block.
+
+Functions:
+which_quad -- Returns the quadrant index of each location.
+generate_location_batch -- Generates locations for many trials at once.
+poisson_disk_locations -- Generates the locations for a single dense display.
+poisson_disk_batch -- Generates dense display locations for many trials.
+packing_bound -- Returns the most stimuli that could fit in a display.
+estimate_acceptance -- Estimates how often candidate locations are accepted.
+check_feasibility -- Estimates whether, and how quickly, displays can be generated.
+
+Attributes:
+LOCATION_ENGINES -- Maps engine names to batch generation functions. All share the signature of
+    generate_location_batch.
+"""
+
+import time
+import warnings
+
+import numpy as np
+
+
+def which_quad(locs):
+    """Returns the quadrant index (0-3) of each location.
+
+    Quadrants are numbered 0 (x < 0, y < 0), 1 (x >= 0, y < 0), 2 (x < 0, y >= 0) and
+    3 (x >= 0, y >= 0).
+
+    Parameters:
+    locs -- An array-like whose last axis holds (x, y) values in visual angle.
+    """
+    locs = np.asarray(locs)
+    return (locs[..., 0] >= 0).astype(int) + 2 * (locs[..., 1] >= 0)
+
+
+def generate_location_batch(n_trials, set_size, min_distance, allowed_deg_from_fix,
+                            max_per_quad=None, rng=None, max_attempts=1000):
+    """Creates the locations for many trials at once.
+
+    Each trial is filled by the same sequential rejection sampling as a single display, but every
+    unfinished trial is given a candidate location on each step so the distance and quadrant
+    checks are done with array operations across trials.
+
+    Returns an array with shape (n_trials, set_size, 2).
+
+    Parameters:
+    n_trials -- The number of displays to generate.
+    set_size -- The number of stimuli in each display.
+    min_distance -- The minimum distance in visual degrees between stimuli and from fixation.
+    allowed_deg_from_fix -- The maximum distance in visual degrees on each axis from fixation.
+    max_per_quad -- The number of stimuli allowed in each quadrant, or None.
+    rng -- A numpy.random.Generator. If None, a new unseeded generator is used.
+    max_attempts -- The number of candidate locations a single trial may draw before giving up.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    locs = np.full((n_trials, set_size, 2), np.nan)
+    counts = np.zeros(n_trials, dtype=int)
+    quad_counts = np.zeros((n_trials, 4), dtype=int)
+    attempts = np.zeros(n_trials, dtype=int)
+    min_sq = min_distance ** 2
+
+    while True:
+        active = np.flatnonzero(counts < set_size)
+        if active.size == 0:
+            return locs
+
+        # Drawing several steps of candidates at once keeps the number of rng calls low
+        candidates = rng.uniform(
+            -allowed_deg_from_fix, allowed_deg_from_fix, size=(set_size, active.size, 2))
+
+        for attempt in candidates:
+            is_open = counts[active] < set_size
+            attempts[active] += is_open
+
+            if (attempts[active] > max_attempts).any():
+                raise ValueError('Timeout -- Cannot generate locations with given values.')
+
+            ok = is_open & ((attempt ** 2).sum(axis=1) >= min_sq)  # Not too close to center
+
+            # Unfilled slots are NaN and never compare as too close
+            dist_sq = ((locs[active] - attempt[:, np.newaxis, :]) ** 2).sum(axis=2)
+            ok &= ~(dist_sq < min_sq).any(axis=1)
+
+            if max_per_quad is not None:
+                quads = which_quad(attempt)
+                ok &= quad_counts[active, quads] < max_per_quad
+                quad_counts[active[ok], quads[ok]] += 1
+
+            accepted = active[ok]
+            locs[accepted, counts[accepted]] = attempt[ok]
+            counts[accepted] += 1
+
+
+def _poisson_disk_points(min_distance, allowed_deg_from_fix, rng, k=30):
+    """Creates a packed Poisson-disk point set using Bridson's algorithm.
+
+    Returns an array of points, none of which are within min_distance of each other or of
+    fixation.
+
+    Parameters:
+    min_distance -- The minimum distance in visual degrees between points and from fixation.
+    allowed_deg_from_fix -- The maximum distance in visual degrees on each axis from fixation.
+    rng -- A numpy.random.Generator.
+    k -- The number of candidates tried around an active point before it is retired.
+    """
+    bound = allowed_deg_from_fix
+    min_sq = min_distance ** 2
+
+    # Each grid cell holds at most one point. Candidates lie within 2 * min_distance of their
+    # center, so only points stored within 3 * min_distance of it can conflict with them.
+    cell_size = min_distance / np.sqrt(2)
+    n_cells = int(np.ceil(2 * bound / cell_size)) + 1
+    reach = int(np.ceil(3 * min_distance / cell_size))
+    grid = np.full((n_cells, n_cells), -1, dtype=int)
+    points = np.empty((n_cells * n_cells, 2))
+
+    start = rng.uniform(-bound, bound, size=2)
+    while (start ** 2).sum() < min_sq:
+        start = rng.uniform(-bound, bound, size=2)
+    points[0] = start
+    grid[tuple(((start + bound) // cell_size).astype(int))] = 0
+    n_points = 1
+    active = [0]
+
+    while active:
+        index = rng.integers(len(active))
+        center = points[active[index]]
+
+        radii = min_distance * np.sqrt(rng.uniform(1, 4, size=k))  # Uniform over the annulus
+        angles = rng.uniform(0, 2 * np.pi, size=k)
+        candidates = center + np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])
+
+        i, j = ((center + bound) // cell_size).astype(int)
+        neighbors = grid[max(i - reach, 0):i + reach + 1, max(j - reach, 0):j + reach + 1]
+        neighbors = points[neighbors[neighbors >= 0]]
+
+        dist_sq = ((candidates[:, np.newaxis, :] - neighbors) ** 2).sum(axis=2)
+        ok = ((np.abs(candidates).max(axis=1) <= bound)
+              & ((candidates ** 2).sum(axis=1) >= min_sq)
+              & (dist_sq >= min_sq).all(axis=1))
+
+        if ok.any():
+            point = candidates[ok.argmax()]
+            points[n_points] = point
+            grid[tuple(((point + bound) // cell_size).astype(int))] = n_points
+            active.append(n_points)
+            n_points += 1
+        else:
+            active[index] = active[-1]
+            active.pop()
+
+    return points[:n_points]
+
+
+def poisson_disk_locations(set_size, min_distance, allowed_deg_from_fix, max_per_quad=None,
+                           rng=None, max_attempts=100):
+    """Creates the locations for a single display from a Poisson-disk point set.
+
+    Returns an array with shape (set_size, 2).
+
+    Parameters:
+    set_size -- The number of stimuli in the display.
+    min_distance -- The minimum distance in visual degrees between stimuli and from fixation.
+    allowed_deg_from_fix -- The maximum distance in visual degrees on each axis from fixation.
+    max_per_quad -- The number of stimuli allowed in each quadrant, or None.
+    rng -- A numpy.random.Generator. If None, a new unseeded generator is used.
+    max_attempts -- The number of point sets that may be built before giving up.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    for _ in range(max_attempts):
+        points = rng.permutation(_poisson_disk_points(min_distance, allowed_deg_from_fix, rng))
+
+        if max_per_quad is not None:
+            # Keep each point only if fewer than max_per_quad earlier points share its quadrant
+            quads = which_quad(points)
+            rank = np.empty(len(points), dtype=int)
+            for quad in range(4):
+                in_quad = quads == quad
+                rank[in_quad] = np.arange(in_quad.sum())
+            points = points[rank < max_per_quad]
+
+        if len(points) >= set_size:
+            return points[:set_size]
+
+    raise ValueError('Timeout -- Cannot generate locations with given values.')
+
+
+def poisson_disk_batch(n_trials, set_size, min_distance, allowed_deg_from_fix,
+                       max_per_quad=None, rng=None, max_attempts=100):
+    """Creates the locations for many trials from Poisson-disk point sets.
+
+    Returns an array with shape (n_trials, set_size, 2).
+
+    Parameters:
+    n_trials -- The number of displays to generate.
+    set_size -- The number of stimuli in each display.
+    min_distance -- The minimum distance in visual degrees between stimuli and from fixation.
+    allowed_deg_from_fix -- The maximum distance in visual degrees on each axis from fixation.
+    max_per_quad -- The number of stimuli allowed in each quadrant, or None.
+    rng -- A numpy.random.Generator. If None, a new unseeded generator is used.
+    max_attempts -- The number of point sets a single trial may build before giving up.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    locs = np.empty((n_trials, set_size, 2))
+    for trial in range(n_trials):
+        locs[trial] = poisson_disk_locations(
+            set_size, min_distance, allowed_deg_from_fix, max_per_quad, rng, max_attempts)
+
+    return locs
+
+
+LOCATION_ENGINES = {
+    'rejection': generate_location_batch,
+    'poisson': poisson_disk_batch,
+}
+
+
+def _oler_bound(area, perimeter, min_distance):
+    """Returns the most points with min_distance between them that fit in a convex region.
+
+    This is Oler's inequality: n <= 2 * area / (sqrt(3) * d^2) + perimeter / (2 * d) + 1.
+    """
+    return (2 * area / (np.sqrt(3) * min_distance ** 2) + perimeter / (2 * min_distance) + 1)
+
+
+def packing_bound(min_distance, allowed_deg_from_fix, max_per_quad=None):
+    """Returns an upper bound on the number of stimuli that can fit in a display.
+
+    Fixation counts as one of the points that must be min_distance apart. No display with more
+    stimuli than the bound exists, although displays close to it are very hard to find.
+
+    Parameters:
+    min_distance -- The minimum distance in visual degrees between stimuli and from fixation.
+    allowed_deg_from_fix -- The maximum distance in visual degrees on each axis from fixation.
+    max_per_quad -- The number of stimuli allowed in each quadrant, or None.
+    """
+    side = allowed_deg_from_fix
+
+    # Each quadrant is a square with fixation in one corner
+    per_quad = int(_oler_bound(side ** 2, 4 * side, min_distance)) - 1
+    if max_per_quad is not None:
+        per_quad = min(per_quad, max_per_quad)
+
+    whole = int(_oler_bound(4 * side ** 2, 8 * side, min_distance)) - 1
+
+    return min(whole, 4 * per_quad)
+
+
+def _acceptable(candidates, locs, quad_counts, min_sq, max_per_quad):
+    """Returns which of each display's candidates could be placed. A helper function for
+    estimate_acceptance.
+    """
+    ok = (candidates ** 2).sum(axis=2) >= min_sq
+
+    # Compared with one placed stimulus at a time to keep the arrays small
+    for placed in range(locs.shape[1]):
+        ok &= ((candidates - locs[:, np.newaxis, placed]) ** 2).sum(axis=2) >= min_sq
+
+    if max_per_quad is not None:
+        quads = which_quad(candidates)
+        ok &= np.take_along_axis(quad_counts, quads, axis=1) < max_per_quad
+
+    return ok
+
+
+def estimate_acceptance(set_size, min_distance, allowed_deg_from_fix, max_per_quad=None,
+                        rng=None, n_samples=200, max_attempts=1000, chunk_size=100):
+    """Estimates the chance that a candidate location is accepted as each stimulus is placed.
+
+    A sample of displays is filled one stimulus at a time, as generate_location_batch does. At
+    each step candidates are drawn for every display and the fraction that would be accepted is
+    recorded. Each display places its first accepted candidate and uses up the
+    candidates drawn before it, as the sampler does. A display with no accepted candidate among
+    the attempts it has left would time out, and is dropped.
+
+    Returns a tuple of (rates, completed): an array of set_size acceptance rates, which are 0
+    after every display has been dropped, and the fraction of displays that were completed
+    within max_attempts.
+
+    Parameters:
+    set_size -- The number of stimuli in each display.
+    min_distance -- The minimum distance in visual degrees between stimuli and from fixation.
+    allowed_deg_from_fix -- The maximum distance in visual degrees on each axis from fixation.
+    max_per_quad -- The number of stimuli allowed in each quadrant, or None.
+    rng -- A numpy.random.Generator. If None, a new unseeded generator is used.
+    n_samples -- The number of displays filled.
+    max_attempts -- The number of candidates a display may draw, as in generate_location_batch.
+    chunk_size -- The number of candidates drawn for a display at once. The acceptance rates are
+        measured on the first chunk of each step.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    min_sq = min_distance ** 2
+    locs = np.empty((n_samples, 0, 2))
+    quad_counts = np.zeros((n_samples, 4), dtype=int)
+    attempts = np.zeros(n_samples, dtype=int)
+    rates = np.zeros(set_size)
+
+    for step in range(set_size):
+        chosen = np.full((len(locs), 2), np.nan)
+        waiting = np.arange(len(locs))
+
+        # Candidates are drawn in chunks, and only for displays that have not placed one yet
+        for start in range(0, max_attempts, chunk_size):
+            candidates = rng.uniform(
+                -allowed_deg_from_fix, allowed_deg_from_fix, size=(len(waiting), chunk_size, 2))
+            ok = _acceptable(candidates, locs[waiting], quad_counts[waiting], min_sq,
+                             max_per_quad)
+
+            if start == 0:
+                rates[step] = ok.mean()
+
+            # Only the attempts a display has left can be used
+            ok &= start + np.arange(chunk_size) < (max_attempts - attempts[waiting])[:, None]
+
+            found = ok.any(axis=1)
+            first = ok[found].argmax(axis=1)
+            chosen[waiting[found]] = candidates[found, first]
+            attempts[waiting[found]] += start + first + 1
+
+            waiting = waiting[~found]
+            if not waiting.size:
+                break
+
+        keep = ~np.isnan(chosen[:, 0])
+        if not keep.any():
+            return rates, 0.0
+
+        # Place the first accepted candidate, as the rejection sampler would
+        chosen = chosen[keep]
+        locs = np.concatenate([locs[keep], chosen[:, np.newaxis]], axis=1)
+        attempts = attempts[keep]
+        quad_counts = quad_counts[keep]
+        quad_counts[np.arange(len(chosen)), which_quad(chosen)] += 1
+
+    return rates, len(locs) / n_samples
+
+
+def check_feasibility(set_size, min_distance, allowed_deg_from_fix, max_per_quad=None,
+                      location_engine='rejection', n_trials=None, budget=None, rng=None,
+                      max_attempts=1000, n_probe=10, stacklevel=2):
+    """Checks that displays can be generated and estimates how long it will take.
+
+    Raises a ValueError if the set size is above packing_bound, or if the rejection sampler would
+    almost never complete a display. Warns with a RuntimeWarning if n_trials displays are likely
+    to time out or are expected to take longer than budget.
+
+    Returns a dict with the 'packing_bound', and for the rejection sampler the 'expected_attempts'
+    per display and the fraction of displays 'completed' within max_attempts, and the expected
+    'seconds' to make n_trials displays (None if not timed).
+
+    Parameters:
+    set_size -- The number of stimuli in each display.
+    min_distance -- The minimum distance in visual degrees between stimuli and from fixation.
+    allowed_deg_from_fix -- The maximum distance in visual degrees on each axis from fixation.
+    max_per_quad -- The number of stimuli allowed in each quadrant, or None.
+    location_engine -- The key in LOCATION_ENGINES used to generate displays.
+    n_trials -- The number of displays made at once, usually the trials per set size in a block.
+        If None, generation is not timed.
+    budget -- The number of seconds making n_trials displays may take before a warning is
+        given. If None, generation is not timed.
+    rng -- A numpy.random.Generator. If None, a new unseeded generator is used.
+    max_attempts -- The number of candidates the rejection sampler may draw for one display.
+    n_probe -- The number of displays generated to time the engine.
+    stacklevel -- Passed to warnings.warn. Callers raise it so warnings point at their caller.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    bound = packing_bound(min_distance, allowed_deg_from_fix, max_per_quad)
+    if set_size > bound:
+        raise ValueError(
+            'At most {} stimuli can fit in a display with these values, set size {} is '
+            'impossible.'.format(bound, set_size))
+
+    report = {'packing_bound': bound, 'expected_attempts': None, 'completed': None,
+              'seconds': None}
+
+    if location_engine == 'rejection':
+        rates, completed = estimate_acceptance(
+            set_size, min_distance, allowed_deg_from_fix, max_per_quad, rng,
+            max_attempts=max_attempts)
+
+        if 0 < completed < 1:
+            # One failure in the first sample is mostly noise, so a larger one is taken
+            rates, completed = estimate_acceptance(
+                set_size, min_distance, allowed_deg_from_fix, max_per_quad, rng,
+                n_samples=2000, max_attempts=max_attempts)
+
+        with np.errstate(divide='ignore'):
+            expected_attempts = float((1 / rates).sum())
+        report.update(expected_attempts=expected_attempts, completed=completed)
+
+        if completed == 0 or expected_attempts > max_attempts:
+            raise ValueError(
+                'Displays of set size {} can almost never be completed with these values. Lower '
+                "min_distance or the set size, or use the 'poisson' location engine.".format(
+                    set_size))
+
+        if n_trials is not None and completed ** n_trials < 0.99:
+            # The failure rate is reported, as the completion rate rounds to 100%
+            warnings.warn(
+                '{:.2g}% of sampled displays of set size {} ran out of attempts, so making {} of '
+                'them has a {:.0%} chance of timing out.'.format(
+                    100 * (1 - completed), set_size, n_trials, 1 - completed ** n_trials),
+                RuntimeWarning, stacklevel=stacklevel)
+            return report
+
+    if n_trials is None or budget is None:
+        return report
+
+    generate = LOCATION_ENGINES[location_engine]
+    n_probe = min(n_probe, n_trials)
+
+    start = time.perf_counter()
+    generate(n_probe, set_size, min_distance, allowed_deg_from_fix, max_per_quad, rng=rng)
+    report['seconds'] = (time.perf_counter() - start) * n_trials / n_probe
+
+    if report['seconds'] > budget:
+        warnings.warn(
+            'Making {} displays of set size {} is expected to take {:.2f} seconds, more than the '
+            'budget of {} seconds.'.format(n_trials, set_size, report['seconds'], budget),
+            RuntimeWarning, stacklevel=stacklevel)
+
+    return report
@@ -0,0 +1,79 @@
+"""A simulated participant for headless sessions and simulations.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+SimulatedObserver answers change detection trials according to a slot model of working memory. It
+only depends on NumPy, so simulations of many subjects (see simulate.py) do not need psychopy.
+headless.HeadlessKtask uses it to respond during a full session.
+
+Classes:
+SimulatedObserver -- Responds to trials according to a slot model of working memory.
+"""
+
+import numpy as np
+
+
+class SimulatedObserver:
+    """Responds to trials according to a slot model of working memory.
+
+    The tested item is remembered with probability min(k / set_size, 1). A remembered item is
+    always responded to correctly. Otherwise the observer guesses 'different' with probability
+    guess_rate. Reaction times are drawn from a normal distribution.
+
+    Parameters:
+    k -- The number of items the observer can remember.
+    guess_rate -- The probability of responding 'different' when the tested item was not
+        remembered.
+    keys -- The 'same' and 'different' response keys.
+    rt_mean -- The mean reaction time in milliseconds.
+    rt_sd -- The standard deviation of reaction times in milliseconds.
+    rng -- A numpy.random.Generator. If None, a new unseeded generator is used.
+
+    Methods:
+    respond -- Returns a response key and reaction time for a trial.
+    accuracy -- Returns the accuracy of responses to many trials at once.
+    """
+
+    def __init__(self, k=3, guess_rate=0.5, keys=('s', 'd'), rt_mean=700, rt_sd=150, rng=None):
+        self.k = k
+        self.guess_rate = guess_rate
+        self.keys = keys
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+        self.rng = np.random.default_rng() if rng is None else rng
+
+    def respond(self, trial):
+        """Returns a response key and reaction time (in ms) for a trial.
+
+        Parameters:
+        trial -- The trial dict created by Ktask.make_trial.
+        """
+        if self.rng.random() < min(self.k / trial['set_size'], 1):
+            resp = trial['cresp']
+        elif self.rng.random() < self.guess_rate:
+            resp = self.keys[1]
+        else:
+            resp = self.keys[0]
+
+        rt = max(self.rng.normal(self.rt_mean, self.rt_sd), 100.0)
+
+        return resp, rt
+
+    def accuracy(self, set_sizes, diff):
+        """Returns the accuracy (1 or 0) of responses to many trials at once.
+
+        Responses follow the same model as respond, without reaction times.
+
+        Parameters:
+        set_sizes -- An array with the set size of each trial.
+        diff -- A boolean array that is True for diff trials.
+        """
+        set_sizes = np.asarray(set_sizes)
+        diff = np.asarray(diff, dtype=bool)
+
+        remembered = self.rng.random(set_sizes.shape) < np.minimum(self.k / set_sizes, 1)
+        guessed_diff = self.rng.random(set_sizes.shape) < self.guess_rate
+
+        responded_diff = np.where(remembered, diff, guessed_diff)
+
+        return (responded_diff == diff).astype(int)
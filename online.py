@@ -0,0 +1,160 @@
+"""Running estimates of K that are updated after every trial.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+An OnlineKEstimator keeps the number of same and diff trials, hits and false alarms at each set
+size, so adding a trial and reading the current estimate both take constant time no matter how
+long the session has run. K is computed as in analysis.py, and its standard error comes from the
+binomial variance of the hit and false alarm rates (the delta method for Pashler's K):
+
+Var(Cowan's K) = N^2 * (H(1 - H) / n_diff + F(1 - F) / n_same)
+
+This makes it possible to stop a session once K is measured precisely enough, instead of always
+running every block. See Ktask's early_stop_ci_width.
+
+Classes:
+OnlineKEstimator -- Keeps running hit and false alarm counts and estimates K.
+"""
+
+import math
+import statistics
+
+
+class _Counts:
+    """The running counts for one set size."""
+
+    __slots__ = ['n_same', 'n_diff', 'hits', 'false_alarms']
+
+    def __init__(self):
+        self.n_same = 0
+        self.n_diff = 0
+        self.hits = 0
+        self.false_alarms = 0
+
+
+class OnlineKEstimator:
+    """Keeps running hit and false alarm counts and estimates K at each set size.
+
+    Parameters:
+    single_probe -- If True, Cowan's K is used for the confidence interval. If False, Pashler's K.
+    confidence -- The coverage of the confidence intervals.
+
+    Methods:
+    update -- Adds a trial.
+    estimate -- Returns the current estimates for a set size.
+    estimates -- Returns the current estimates for every set size.
+    ci_width -- Returns the width of the confidence interval of K for a set size.
+    converged -- Checks whether every set size has been measured precisely enough.
+    """
+
+    def __init__(self, single_probe=True, confidence=0.95):
+        self.single_probe = single_probe
+        self.confidence = confidence
+        self.z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+
+        self.counts = {}
+        self.n_trials = 0
+
+    def update(self, data):
+        """Adds a trial.
+
+        Parameters:
+        data -- The dict returned by Ktask.run_trial. Only 'TrialType', 'SetSize' and 'ACC' are
+            used. Trials without a numeric accuracy are ignored.
+        """
+        try:
+            acc = int(data['ACC'])
+        except (TypeError, ValueError):
+            return
+
+        counts = self.counts.get(data['SetSize'])
+        if counts is None:
+            counts = self.counts[data['SetSize']] = _Counts()
+
+        if data['TrialType'] == 'diff':
+            counts.n_diff += 1
+            counts.hits += acc
+        else:
+            counts.n_same += 1
+            counts.false_alarms += 1 - acc
+
+        self.n_trials += 1
+
+    def estimate(self, set_size):
+        """Returns the current estimates for a set size.
+
+        Returns a dict with 'SetSize', 'NSame', 'NDiff', 'HitRate', 'FalseAlarmRate', 'CowanK',
+        'PashlerK', 'SE' and 'CIWidth', where SE and CIWidth are for the K selected by
+        single_probe. Values that cannot be computed yet are NaN.
+
+        Parameters:
+        set_size -- The set size to estimate K for.
+        """
+        counts = self.counts.get(set_size, _Counts())
+        nan = float('nan')
+
+        hit_rate = counts.hits / counts.n_diff if counts.n_diff else nan
+        false_alarm_rate = counts.false_alarms / counts.n_same if counts.n_same else nan
+
+        cowan_k = set_size * (hit_rate - false_alarm_rate)
+        pashler_k = cowan_k / (1 - false_alarm_rate) if false_alarm_rate != 1 else nan
+
+        if counts.n_diff and counts.n_same:
+            var_h = hit_rate * (1 - hit_rate) / counts.n_diff
+            var_f = false_alarm_rate * (1 - false_alarm_rate) / counts.n_same
+
+            if self.single_probe:
+                se = set_size * math.sqrt(var_h + var_f)
+            elif false_alarm_rate != 1:
+                d_h = set_size / (1 - false_alarm_rate)
+                d_f = set_size * (hit_rate - 1) / (1 - false_alarm_rate) ** 2
+                se = math.sqrt(d_h ** 2 * var_h + d_f ** 2 * var_f)
+            else:
+                se = nan
+        else:
+            se = nan
+
+        return {
+            'SetSize': set_size,
+            'NSame': counts.n_same,
+            'NDiff': counts.n_diff,
+            'HitRate': hit_rate,
+            'FalseAlarmRate': false_alarm_rate,
+            'CowanK': cowan_k,
+            'PashlerK': pashler_k,
+            'SE': se,
+            'CIWidth': 2 * self.z * se,
+        }
+
+    def estimates(self):
+        """Returns the current estimates for every set size seen so far, sorted by set size."""
+        return [self.estimate(set_size) for set_size in sorted(self.counts)]
+
+    def ci_width(self, set_size):
+        """Returns the width of the confidence interval of K for a set size (NaN if unknown).
+
+        Parameters:
+        set_size -- The set size.
+        """
+        return self.estimate(set_size)['CIWidth']
+
+    def converged(self, target_width, set_sizes, min_trials=0):
+        """Checks whether every set size has been measured precisely enough.
+
+        The binomial standard error is 0 when a rate is exactly 0 or 1, which is common early in a
+        session, so min_trials should be large enough to avoid stopping on a lucky start.
+
+        Parameters:
+        target_width -- The largest confidence interval width allowed.
+        set_sizes -- The set sizes that must all be measured.
+        min_trials -- The smallest number of same and of diff trials needed at each set size.
+        """
+        for set_size in set_sizes:
+            estimate = self.estimate(set_size)
+
+            if min(estimate['NSame'], estimate['NDiff']) < max(min_trials, 1):
+                return False
+            if not estimate['CIWidth'] <= target_width:  # False for NaN
+                return False
+
+        return True
@@ -0,0 +1,218 @@
+"""Color palettes, perceptual color distances and index-based color sampling.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Colors are handled as indices into a palette array of psychopy RGB colors (-1 to 1). Distances
+between every pair of palette colors are computed once, in CIELAB, so requiring a minimum
+perceptual separation between the sample colors and the foil only costs an array lookup per trial.
+Sampling works on many trials at once, which keeps large continuous palettes (such as a 360 step
+color wheel) as fast as the default nine colors. A display whose sample colors leave no foil far
+enough away is given new sample colors, and check_color_feasibility rejects settings where that
+would almost always happen before a session starts.
+
+Functions:
+color_wheel -- Returns evenly spaced colors from a circle in CIELAB space.
+rgb_to_lab -- Converts psychopy RGB colors to CIELAB.
+distance_matrix -- Returns the CIELAB distance between every pair of palette colors.
+sample_colors -- Samples the test location, sample colors and foil of many trials.
+check_color_feasibility -- Checks that displays with a usable foil can be sampled.
+"""
+
+import numpy as np
+
+# sRGB (D65) to CIE XYZ
+_RGB_TO_XYZ = np.array([
+    [0.4124564, 0.3575761, 0.1804375],
+    [0.2126729, 0.7151522, 0.0721750],
+    [0.0193339, 0.1191920, 0.9503041],
+])
+_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+
+def _lab_to_rgb(lab):
+    """Converts CIELAB colors to psychopy RGB, clipping colors outside the sRGB gamut."""
+    lab = np.asarray(lab, dtype=float)
+    fy = (lab[..., 0] + 16) / 116
+    f = np.stack([fy + lab[..., 1] / 500, fy, fy - lab[..., 2] / 200], axis=-1)
+
+    xyz = np.where(f > 6 / 29, f ** 3, 3 * (6 / 29) ** 2 * (f - 4 / 29)) * _WHITE
+    linear = xyz @ np.linalg.inv(_RGB_TO_XYZ).T
+
+    linear = np.clip(linear, 0, 1)
+    srgb = np.where(linear > 0.0031308, 1.055 * linear ** (1 / 2.4) - 0.055, 12.92 * linear)
+
+    return srgb * 2 - 1
+
+
+def rgb_to_lab(colors):
+    """Converts psychopy RGB colors (-1 to 1) to CIELAB.
+
+    Returns an array with the same shape as colors.
+
+    Parameters:
+    colors -- An array-like of RGB colors with 3 values in the last dimension.
+    """
+    srgb = (np.asarray(colors, dtype=float) + 1) / 2
+    linear = np.where(srgb > 0.04045, ((srgb + 0.055) / 1.055) ** 2.4, srgb / 12.92)
+
+    f = (linear @ _RGB_TO_XYZ.T) / _WHITE
+    f = np.where(f > (6 / 29) ** 3, np.cbrt(f), f / (3 * (6 / 29) ** 2) + 4 / 29)
+
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2]),
+    ], axis=-1)
+
+
+def color_wheel(n_steps=360, lightness=70, center=(20, 38), radius=60):
+    """Returns evenly spaced colors from a circle in CIELAB space.
+
+    The defaults give the color wheel commonly used in continuous report tasks.
+
+    Returns an (n_steps, 3) array of psychopy RGB colors.
+
+    Parameters:
+    n_steps -- The number of colors.
+    lightness -- The L* value of every color.
+    center -- The a* and b* values at the center of the circle.
+    radius -- The radius of the circle.
+    """
+    angles = 2 * np.pi * np.arange(n_steps) / n_steps
+    lab = np.column_stack([
+        np.full(n_steps, float(lightness)),
+        center[0] + radius * np.cos(angles),
+        center[1] + radius * np.sin(angles),
+    ])
+
+    return _lab_to_rgb(lab)
+
+
+def distance_matrix(colors):
+    """Returns the CIELAB (delta E 1976) distance between every pair of colors.
+
+    Parameters:
+    colors -- An (n_colors, 3) array-like of psychopy RGB colors.
+    """
+    lab = rgb_to_lab(colors)
+    return np.linalg.norm(lab[:, None] - lab[None], axis=-1)
+
+
+def _sample_displays(n_colors, n_trials, set_size, rng, repeat_stim_colors):
+    """Samples the test locations and sample colors of many trials."""
+    test_locations = rng.integers(set_size, size=n_trials)
+
+    if repeat_stim_colors:
+        stim_indices = rng.integers(n_colors, size=(n_trials, set_size))
+    else:
+        if set_size > n_colors:
+            raise ValueError('Not enough colors for a set size of {}.'.format(set_size))
+        # Sorting random keys gives an independent permutation of the palette for every trial
+        stim_indices = rng.random((n_trials, n_colors)).argsort(axis=1)[:, :set_size]
+
+    return test_locations, stim_indices
+
+
+def _allowed_foils(distances, test_locations, stim_indices, repeat_test_colors, min_distance):
+    """Returns a (n_trials, n_colors) boolean array of the colors each trial's foil can be."""
+    if repeat_test_colors:
+        compared = stim_indices[np.arange(len(stim_indices)), test_locations][:, None]
+    else:
+        compared = stim_indices
+
+    # Identical colors have a distance of 0, so the compared colors are never allowed
+    compared_distances = distances[compared]
+    return ((compared_distances >= min_distance) & (compared_distances > 0)).all(axis=1)
+
+
+def sample_colors(distances, n_trials, set_size, rng, repeat_stim_colors=False,
+                  repeat_test_colors=False, min_distance=0, max_attempts=1000):
+    """Samples the test location, sample colors and foil color of many trials at once.
+
+    Returns a tuple of (test_locations, stim_indices, foil_indices) with shapes (n_trials,),
+    (n_trials, set_size) and (n_trials,). Colors are indices into the palette.
+
+    Trials whose sample colors leave no foil at least min_distance away are sampled again, so a
+    ValueError is only raised if that keeps happening for max_attempts tries.
+
+    Parameters:
+    distances -- The palette's distance matrix from distance_matrix.
+    n_trials -- The number of trials to sample.
+    set_size -- The number of sample colors in each trial.
+    rng -- A numpy.random.Generator.
+    repeat_stim_colors -- If True, a trial's sample colors can repeat.
+    repeat_test_colors -- If True, the foil only has to differ from the tested sample color
+        instead of from every sample color.
+    min_distance -- The smallest CIELAB distance allowed between the foil and the sample colors
+        it has to differ from.
+    max_attempts -- The number of times a trial's sample colors may be drawn.
+    """
+    n_colors = len(distances)
+
+    test_locations, stim_indices = _sample_displays(
+        n_colors, n_trials, set_size, rng, repeat_stim_colors)
+    allowed = _allowed_foils(
+        distances, test_locations, stim_indices, repeat_test_colors, min_distance)
+
+    failed = np.flatnonzero(~allowed.any(axis=1))
+    attempts = 1
+
+    while len(failed):
+        if attempts == max_attempts:
+            raise ValueError('No foil color is far enough from the sample colors of {} trials '
+                             'after {} attempts.'.format(len(failed), max_attempts))
+
+        test_locations[failed], stim_indices[failed] = _sample_displays(
+            n_colors, len(failed), set_size, rng, repeat_stim_colors)
+        allowed[failed] = _allowed_foils(
+            distances, test_locations[failed], stim_indices[failed], repeat_test_colors,
+            min_distance)
+
+        failed = failed[~allowed[failed].any(axis=1)]
+        attempts += 1
+
+    # A random key per color, with the disallowed colors pushed below every allowed one
+    keys = rng.random((n_trials, n_colors))
+    keys[~allowed] = -1
+    foil_indices = keys.argmax(axis=1)
+
+    return test_locations, stim_indices, foil_indices
+
+
+def check_color_feasibility(distances, set_size, repeat_stim_colors=False,
+                            repeat_test_colors=False, min_distance=0, rng=None, n_probe=1000,
+                            max_attempts=1000):
+    """Checks that sample colors with a usable foil can be drawn for a set size.
+
+    Raises a ValueError if there are not enough colors, or if so few sampled displays leave a foil
+    at least min_distance away that sample_colors would usually give up.
+
+    Returns the fraction of sampled displays that have a usable foil.
+
+    Parameters:
+    distances -- The palette's distance matrix from distance_matrix.
+    set_size -- The number of sample colors in each display.
+    repeat_stim_colors -- As in sample_colors.
+    repeat_test_colors -- As in sample_colors.
+    min_distance -- As in sample_colors.
+    rng -- A numpy.random.Generator. If None, a new unseeded generator is used.
+    n_probe -- The number of displays sampled.
+    max_attempts -- The number of times sample_colors may draw a trial's sample colors.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    test_locations, stim_indices = _sample_displays(
+        len(distances), n_probe, set_size, rng, repeat_stim_colors)
+    allowed = _allowed_foils(
+        distances, test_locations, stim_indices, repeat_test_colors, min_distance)
+
+    usable = float(allowed.any(axis=1).mean())
+
+    if usable * max_attempts < 1:
+        raise ValueError(
+            'Displays of set size {} almost never leave a foil color at least {} from the sample '
+            'colors. Lower min_color_distance or the set size, or use more colors.'.format(
+                set_size, min_distance))
+
+    return usable
@@ -0,0 +1,97 @@
+"""Background generation of upcoming blocks.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Without prefetching, each block is made when the previous one ends, so slow generation (dense
+displays, large set sizes) shows up as a pause right after the participant ends a break. A
+BlockPrefetcher makes the blocks in order on a worker thread, starting as soon as it is created,
+and hands them over through a bounded queue. While one block is running the next one is made and
+waits in the queue, so no more than max_ahead finished blocks are ever held in memory.
+
+Generation is mostly NumPy work, which releases the GIL for much of the time it takes, so the
+presentation loop keeps running while the worker makes blocks.
+
+Classes:
+BlockPrefetcher -- Makes blocks on a worker thread.
+"""
+
+import queue
+import threading
+
+_DONE = object()
+
+
+class BlockPrefetcher:
+    """Makes blocks on a worker thread and yields them in order.
+
+    Iterating over the prefetcher yields each block as it is needed, waiting for it if it is not
+    finished yet. An exception raised while making a block is raised again when that block is
+    requested.
+
+    Parameters:
+    make_block -- A function that takes a block number and returns the block.
+    n_blocks -- The number of blocks to make.
+    max_ahead -- The number of finished blocks that may wait in the queue.
+
+    Methods:
+    close -- Stops the worker thread.
+    """
+
+    def __init__(self, make_block, n_blocks, max_ahead=1):
+        self.make_block = make_block
+        self.n_blocks = n_blocks
+
+        self._queue = queue.Queue(maxsize=max_ahead)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='BlockPrefetcher', daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        """Puts an item in the queue, giving up if the prefetcher is closed."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        """Makes every block in order. Runs on the worker thread."""
+        for block_num in range(self.n_blocks):
+            if self._stop.is_set():
+                return
+
+            try:
+                item = self.make_block(block_num)
+            except BaseException as e:
+                self._put(e)
+                return
+
+            if not self._put(item):
+                return
+
+        self._put(_DONE)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+
+            yield item
+
+    def close(self):
+        """Stops the worker thread and discards any blocks that were not used."""
+        self._stop.set()
+
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+        self._thread.join()
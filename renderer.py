@@ -0,0 +1,126 @@
+"""Reusable stimuli for drawing change detection displays.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Creating psychopy stimuli is slow compared to drawing them, so the renderer creates the fixation
+cross and the squares once and only updates their positions and colors on each trial. Squares can
+either be a pool of Rect stimuli, which look exactly like the squares drawn by earlier versions of
+the experiment, or a single ElementArrayStim that draws every square in one call.
+
+Displays can also be rendered ahead of time into a BufferImageStim, so presenting them only
+requires drawing a single image regardless of the set size.
+
+Classes:
+StimulusRenderer -- Draws the fixation cross and the square stimuli.
+"""
+
+import numpy as np
+
+import psychopy.visual
+
+RENDERERS = ['pool', 'elementarray']
+
+
+class StimulusRenderer:
+    """Draws the fixation cross and the square stimuli with stimuli created once.
+
+    Parameters:
+    window -- The psychopy window to draw to.
+    stim_size -- The size of the squares in visual angle.
+    n_stimuli -- The largest number of squares that will be drawn at once. The renderer grows if
+        more are requested.
+    renderer -- 'pool' to draw squares with a pool of Rect stimuli or 'elementarray' to draw them
+        all with a single ElementArrayStim.
+
+    Methods:
+    draw_fixation -- Draws the fixation cross.
+    draw_squares -- Draws squares at the given coordinates.
+    prerender -- Renders a display off-screen for later presentation.
+    """
+
+    def __init__(self, window, stim_size, n_stimuli, renderer='pool'):
+        if renderer not in RENDERERS:
+            raise ValueError('Unknown renderer: {}'.format(renderer))
+
+        self.window = window
+        self.stim_size = stim_size
+        self.renderer = renderer
+
+        self.fixation = psychopy.visual.TextStim(window, text='+', color=[-1, -1, -1])
+
+        self.n_stimuli = 0
+        self.rects = []
+        self.element_array = None
+        self._grow(n_stimuli)
+
+    def _grow(self, n_stimuli):
+        """Makes sure at least n_stimuli squares can be drawn."""
+        if n_stimuli <= self.n_stimuli:
+            return
+
+        if self.renderer == 'pool':
+            self.rects.extend(
+                psychopy.visual.Rect(
+                    self.window, width=self.stim_size, height=self.stim_size, units='deg')
+                for _ in range(n_stimuli - self.n_stimuli))
+        else:
+            self.element_array = psychopy.visual.ElementArrayStim(
+                self.window, units='deg', nElements=n_stimuli, sizes=self.stim_size,
+                xys=np.zeros((n_stimuli, 2)), colors=np.zeros((n_stimuli, 3)),
+                colorSpace='rgb', opacities=0, elementTex=None, elementMask=None)
+
+        self.n_stimuli = n_stimuli
+
+    def draw_fixation(self):
+        """Draws the fixation cross."""
+        self.fixation.draw()
+
+    def draw_squares(self, coordinates, colors):
+        """Draws a square at each coordinate.
+
+        Parameters:
+        coordinates -- A list of coordinates (list of x and y value) in visual angle.
+        colors -- A list of colors describing what should be drawn at each coordinate.
+        """
+        self._grow(len(coordinates))
+
+        if self.renderer == 'pool':
+            for rect, pos, color in zip(self.rects, coordinates, colors):
+                rect.pos = pos
+                rect.fillColor = color
+                rect.draw()
+        else:
+            n = len(coordinates)
+
+            xys = np.zeros((self.n_stimuli, 2))
+            xys[:n] = coordinates
+            element_colors = np.zeros((self.n_stimuli, 3))
+            element_colors[:n] = colors
+            opacities = np.zeros(self.n_stimuli)
+            opacities[:n] = 1
+
+            self.element_array.xys = xys
+            self.element_array.colors = element_colors
+            self.element_array.opacities = opacities
+            self.element_array.draw()
+
+    def prerender(self, coordinates, colors):
+        """Renders the fixation cross and squares off-screen.
+
+        The display is drawn to the back buffer, captured, and the back buffer is cleared again,
+        so this can be called while another display is on the screen.
+
+        Returns a BufferImageStim that draws the whole display.
+
+        Parameters:
+        coordinates -- A list of coordinates (list of x and y value) in visual angle.
+        colors -- A list of colors describing what should be drawn at each coordinate.
+        """
+        self.window.clearBuffer()
+        self.draw_fixation()
+        self.draw_squares(coordinates, colors)
+
+        display = psychopy.visual.BufferImageStim(self.window, buffer='back')
+        self.window.clearBuffer()
+
+        return display
@@ -0,0 +1,421 @@
+"""Renders the displays of recorded trials to image files without a display.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Each trial's sample and test displays are rebuilt from the Locations, SampleColors, TestColors,
+TrialType and LocationTested fields of a data file, with the same geometry the experiment uses:
+squares of stim_size visual degrees centered on each location, and a test display chosen with
+generation.test_array, so single probe and whole display tests are replayed as they were shown.
+Degrees are converted to pixels with pixels_per_degree, with the fixation at the center of the
+image and positive y pointing up as in psychopy. The fixation cross is drawn as a black cross
+rather than the psychopy text stimulus, so its size is only approximate.
+
+Images are drawn with NumPy and saved as PNG files with the standard library, so neither psychopy
+nor an image library is needed. Contact sheets are drawn and compressed one row of trials at a
+time, so a whole session never has to fit in memory. Data files are rendered in parallel across a
+process pool. To render every session in a data directory, with one contact sheet per session:
+
+    python replay.py ~/Desktop/ChangeDetection/Data --output-dir replays --contact-sheet
+
+Functions:
+read_displays -- Reads the display fields of a data file.
+render_display -- Draws a display as an RGB image array.
+trial_images -- Draws the sample and test displays of one trial.
+contact_sheet -- Arranges images in a grid.
+contact_sheet_rows -- Yields a grid of images one row at a time.
+write_png -- Saves an RGB image array as a PNG file.
+write_png_rows -- Saves an RGB image given one band of rows at a time as a PNG file.
+render_file -- Renders every trial of one data file.
+render_files -- Renders many data files in parallel.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import functools
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import analysis
+import columnar
+import generation
+
+FIXATION_SIZE = 0.5  # visual degrees
+
+
+def _stack(values, depth):
+    """Stacks per-trial lists of stimulus values, padding them with NaN to the same width."""
+    width = max([len(value) for value in values] + [1])
+    stacked = np.full((len(values), width, depth), np.nan)
+
+    for i, value in enumerate(values):
+        if len(value):
+            stacked[i, :len(value)] = value
+
+    return stacked
+
+
+def read_displays(filename):
+    """Reads the fields needed to rebuild each trial's displays from a data file.
+
+    Returns a dict with 'Block' and 'Trial' label arrays (strings, so practice trials with a Block
+    such as 'practice' are kept), 'TrialType' and 'LocationTested' arrays, 'Locations'
+    (n_trials, width, 2) and 'SampleColors' (n_trials, width, 3) arrays padded with NaN, and a
+    'TestColors' (n_trials, 3) array. Returns None if the file is not a data file.
+
+    Parameters:
+    filename -- A CSV data file or a columnar data directory.
+    """
+    fields = ['Block', 'Trial', 'TrialType', 'LocationTested', 'Locations', 'SampleColors',
+              'TestColors']
+
+    if os.path.isdir(filename):
+        data = columnar.load_columns(filename, mmap=False)
+        if not set(fields) <= set(data):
+            return None
+
+        # ColumnarWriter saves test colors with shape (n_trials, 3)
+        test_colors = np.asarray(data['TestColors'], dtype=float).reshape(-1, 3)
+
+        locations = np.asarray(data['Locations'], dtype=float)
+        sample_colors = np.asarray(data['SampleColors'], dtype=float)
+    else:
+        with open(filename, newline='') as f:
+            reader = csv.DictReader(f)
+            if not set(fields) <= set(reader.fieldnames or []):
+                return None
+            rows = [row for row in reader if None not in row.values()]  # Skip rows cut off
+
+        data = {field: [row[field] for row in rows] for field in fields}
+        locations = _stack([json.loads(value) for value in data['Locations']], 2)
+        sample_colors = _stack([json.loads(value) for value in data['SampleColors']], 3)
+        test_colors = np.array([json.loads(value) for value in data['TestColors']],
+                               dtype=float).reshape(-1, 3)
+
+    return {
+        'Block': analysis._as_labels(data['Block']),
+        'Trial': analysis._as_labels(data['Trial']),
+        'TrialType': np.asarray(data['TrialType']).astype(str),
+        'LocationTested': np.asarray(data['LocationTested'], dtype=float).astype(int),
+        'Locations': locations,
+        'SampleColors': sample_colors,
+        'TestColors': test_colors,
+    }
+
+
+def _to_pixels(colors):
+    """Converts psychopy RGB colors (-1 to 1) to 8 bit values."""
+    return np.round((np.clip(np.asarray(colors, dtype=float), -1, 1) + 1) * 127.5).astype(np.uint8)
+
+
+def render_display(coordinates, colors, stim_size=1.5, pixels_per_degree=30, extent=7.5,
+                   background=(0, 0, 0), fixation=True):
+    """Draws the fixation cross and squares of a display.
+
+    Returns an (height, width, 3) uint8 RGB image.
+
+    Parameters:
+    coordinates -- A list of coordinates (list of x and y value) in visual degrees.
+    colors -- The psychopy RGB color of each square.
+    stim_size -- The size of the squares in visual degrees.
+    pixels_per_degree -- The number of image pixels per visual degree.
+    extent -- The distance in visual degrees from the center to each edge of the image.
+    background -- The psychopy RGB color of the window.
+    fixation -- If True, the fixation cross is drawn.
+    """
+    size = int(round(2 * extent * pixels_per_degree))
+    center = size / 2
+    image = np.empty((size, size, 3), dtype=np.uint8)
+    image[:] = _to_pixels(background)
+
+    if fixation:
+        half = FIXATION_SIZE * pixels_per_degree / 2
+        stroke = max(pixels_per_degree * FIXATION_SIZE / 8, 1) / 2
+        long_axis = slice(int(round(center - half)), int(round(center + half)))
+        short_axis = slice(int(round(center - stroke)), int(round(center + stroke)))
+        image[long_axis, short_axis] = 0
+        image[short_axis, long_axis] = 0
+
+    half = stim_size * pixels_per_degree / 2
+
+    for (x, y), color in zip(coordinates, colors):
+        if np.isnan(x) or np.isnan(y):
+            continue
+
+        col = center + x * pixels_per_degree
+        row = center - y * pixels_per_degree  # Rows count down from the top
+
+        top, bottom = int(round(row - half)), int(round(row + half))
+        left, right = int(round(col - half)), int(round(col + half))
+        image[max(top, 0):max(bottom, 0), max(left, 0):max(right, 0)] = _to_pixels(color)
+
+    return image
+
+
+def trial_images(trial_type, coordinates, colors, test_loc, test_color, single_probe=True,
+                 **kwargs):
+    """Draws the sample and test displays of one trial.
+
+    Returns a tuple of (sample, test) RGB image arrays.
+
+    Parameters:
+    trial_type -- Whether the trial is same or different.
+    coordinates -- A list of coordinates where stimuli were drawn.
+    colors -- The colors drawn at each coordinate in the sample display.
+    test_loc -- The index of the tested stimuli.
+    test_color -- The color of the tested stimuli.
+    single_probe -- If True, only the tested stimulus is drawn in the test display.
+    Additional keyword arguments are sent to render_display.
+    """
+    sample = render_display(coordinates, colors, **kwargs)
+    test = render_display(*generation.test_array(
+        trial_type, coordinates, colors, test_loc, test_color, single_probe), **kwargs)
+
+    return sample, test
+
+
+def contact_sheet(images, columns=8, padding=4, background=255):
+    """Arranges equally sized images in a grid, left to right and then top to bottom.
+
+    Returns an RGB image array.
+
+    Parameters:
+    images -- A list of (height, width, 3) uint8 images.
+    columns -- The number of images in each row.
+    padding -- The number of pixels between images.
+    background -- The gray level between images.
+    """
+    return np.concatenate(list(contact_sheet_rows(images, len(images), columns, padding,
+                                                  background)))
+
+
+def contact_sheet_rows(images, n_images, columns=8, padding=4, background=255):
+    """Yields the rows of a contact sheet, one band of rows for each row of images.
+
+    Each band holds the padding above a row of images and the images themselves, and the last band
+    is the padding below the grid. Stacking the bands gives the same image as contact_sheet, but
+    only one row of images is held in memory when images is a generator.
+
+    Parameters:
+    images -- An iterable of equally sized (height, width, 3) uint8 images.
+    n_images -- The number of images, which sets the width of the sheet when there are fewer
+        images than columns.
+    columns -- The number of images in each row.
+    padding -- The number of pixels between images.
+    background -- The gray level between images.
+    """
+    columns = min(columns, n_images)
+    band = None
+    sheet_width = 0
+
+    for i, image in enumerate(images):
+        height, width = image.shape[:2]
+        column = i % columns
+
+        if column == 0:
+            sheet_width = columns * (width + padding) + padding
+            band = np.full((height + padding, sheet_width, 3), background, dtype=np.uint8)
+
+        left = padding + column * (width + padding)
+        band[padding:, left:left + width] = image
+
+        if column == columns - 1:
+            yield band
+            band = None
+
+    if band is not None:
+        yield band
+
+    yield np.full((padding, sheet_width, 3), background, dtype=np.uint8)
+
+
+def _png_chunk(chunk_type, data):
+    """Returns a PNG chunk with its length and checksum."""
+    return (struct.pack('>I', len(data)) + chunk_type + data
+            + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def _png_header(width, height):
+    """Returns the IHDR chunk of an 8 bit RGB PNG file."""
+    return _png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+
+def write_png(filename, image, compression=6):
+    """Saves an RGB image array as an 8 bit PNG file.
+
+    Parameters:
+    filename -- Where to save the image.
+    image -- An (height, width, 3) uint8 array.
+    compression -- The zlib compression level, 0 to 9.
+    """
+    write_png_rows(filename, [image], compression)
+
+
+def write_png_rows(filename, bands, compression=6):
+    """Saves an RGB image given as bands of rows as an 8 bit PNG file.
+
+    Each band is compressed and written as soon as it is received, so only one band is held in
+    memory. The image height is filled into the header once every band has been written.
+
+    Parameters:
+    filename -- Where to save the image.
+    bands -- An iterable of (rows, width, 3) uint8 arrays, from the top of the image down, all
+        with the same width.
+    compression -- The zlib compression level, 0 to 9.
+    """
+    compressor = zlib.compressobj(compression)
+    width = None
+    height = 0
+
+    with open(filename, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        header_position = f.tell()
+        f.write(_png_header(0, 0))
+
+        for band in bands:
+            band = np.ascontiguousarray(band, dtype=np.uint8)
+            if width is None:
+                width = band.shape[1]
+            elif band.shape[1] != width:
+                raise ValueError('Every band of a PNG image must have the same width.')
+
+            # Every row starts with a filter type byte, 0 for no filtering
+            rows = np.zeros((len(band), width * 3 + 1), dtype=np.uint8)
+            rows[:, 1:] = band.reshape(len(band), width * 3)
+            height += len(band)
+
+            data = compressor.compress(rows.tobytes())
+            if data:
+                f.write(_png_chunk(b'IDAT', data))
+
+        f.write(_png_chunk(b'IDAT', compressor.flush()))
+        f.write(_png_chunk(b'IEND', b''))
+
+        f.seek(header_position)
+        f.write(_png_header(width or 0, height))
+
+
+def render_file(filename, output_dir, stim_size=1.5, single_probe=True, pixels_per_degree=30,
+                extent=7.5, background=(0, 0, 0), sheet=False, columns=4):
+    """Renders the sample and test displays of every trial in a data file.
+
+    Images are named after the data file, block and trial, for example
+    'ChangeDetection_1_b0_t3_sample.png'. With sheet, a single contact sheet is saved instead,
+    with each trial's sample and test displays side by side in trial order.
+
+    Returns a list of the files saved, which is empty if filename is not a data file.
+
+    Parameters:
+    filename -- A CSV data file or a columnar data directory.
+    output_dir -- The directory the images are saved in.
+    stim_size -- The size of the squares in visual degrees.
+    single_probe -- If True, only the tested stimulus is drawn in the test display.
+    pixels_per_degree -- The number of image pixels per visual degree.
+    extent -- The distance in visual degrees from the center to each edge of each display.
+    background -- The psychopy RGB color of the window.
+    sheet -- If True, a contact sheet is saved instead of one image per display.
+    columns -- The number of trials in each row of the contact sheet.
+    """
+    displays = read_displays(filename)
+    if displays is None or not len(displays['Trial']):
+        return []
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    name = os.path.splitext(os.path.basename(os.path.normpath(filename)))[0]
+    render_kwargs = {'stim_size': stim_size, 'pixels_per_degree': pixels_per_degree,
+                     'extent': extent, 'background': background}
+
+    n_trials = len(displays['Trial'])
+    images = (image for i in range(n_trials)
+              for image in _recorded_trial_images(displays, i, single_probe, render_kwargs))
+
+    if sheet:
+        # Trials are drawn as each row of the sheet is written
+        sheet_filename = os.path.join(output_dir, name + '_sheet.png')
+        write_png_rows(sheet_filename, contact_sheet_rows(images, 2 * n_trials, 2 * columns))
+        return [sheet_filename]
+
+    saved = []
+
+    for i in range(n_trials):
+        base = os.path.join(output_dir, '{}_b{}_t{}'.format(
+            name, displays['Block'][i], displays['Trial'][i]))
+        for display in ['sample', 'test']:
+            write_png('{}_{}.png'.format(base, display), next(images))
+            saved.append('{}_{}.png'.format(base, display))
+
+    return saved
+
+
+def _recorded_trial_images(displays, i, single_probe, render_kwargs):
+    """Draws the sample and test displays of trial i of read_displays' output."""
+    present = ~np.isnan(displays['Locations'][i, :, 0])
+
+    return trial_images(
+        displays['TrialType'][i], displays['Locations'][i][present].tolist(),
+        displays['SampleColors'][i][present].tolist(), displays['LocationTested'][i],
+        displays['TestColors'][i].tolist(), single_probe, **render_kwargs)
+
+
+def render_files(filenames, output_dir, processes=None, **kwargs):
+    """Renders many data files in parallel across a process pool.
+
+    Returns a list of the files saved.
+
+    Parameters:
+    filenames -- CSV data files or columnar data directories. Files that are not data files
+        (such as experiment info files) are skipped.
+    output_dir -- The directory the images are saved in.
+    processes -- The number of worker processes. If None, one per CPU is used.
+    Additional keyword arguments are sent to render_file.
+    """
+    workers = processes or os.cpu_count() or 1
+    render = functools.partial(render_file, output_dir=output_dir, **kwargs)
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        return [saved for file_saved in executor.map(render, filenames) for saved in file_saved]
+
+
+def main(argv=None):
+    """Renders data files from the command line."""
+    defaults = generation.experiment_defaults()
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='+', help='Data files or directories of data files.')
+    parser.add_argument('--output-dir', default='replays', help='Where to save the images.')
+    parser.add_argument('--stim-size', type=float, default=defaults.get('stim_size', 1.5),
+                        help='Size of the squares in visual degrees.')
+    parser.add_argument('--whole-display', action='store_true',
+                        help='Draw every stimulus at test instead of only the tested one.')
+    parser.add_argument('--pixels-per-degree', type=float, default=30,
+                        help='Image pixels per visual degree.')
+    parser.add_argument('--contact-sheet', action='store_true',
+                        help='Save one contact sheet per data file instead of one image per '
+                             'display.')
+    parser.add_argument('--columns', type=int, default=4, help='Trials per contact sheet row.')
+    parser.add_argument('--processes', type=int, default=None, help='Worker processes to use.')
+    args = parser.parse_args(argv)
+
+    extent = defaults.get('allowed_deg_from_fix', 6) + args.stim_size
+
+    filenames = []
+    for path in args.paths:
+        if os.path.isdir(path) and not os.path.exists(os.path.join(path, 'fields.json')):
+            filenames.extend(analysis.find_data_files(path))
+        else:
+            filenames.append(path)
+
+    saved = render_files(
+        filenames, args.output_dir, args.processes, stim_size=args.stim_size,
+        single_probe=not args.whole_display, pixels_per_degree=args.pixels_per_degree,
+        extent=extent, sheet=args.contact_sheet, columns=args.columns)
+    print('Saved {} images to {}'.format(len(saved), args.output_dir))
+
+
+if __name__ == '__main__':
+    main()
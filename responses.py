@@ -0,0 +1,106 @@
+"""Low-latency, event-timestamped response collection.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+psychopy.event.waitKeys timestamps a key press when the event loop gets around to polling for it,
+and the clock it is compared with is started after the test display has already been flipped. A
+KeyboardResponse instead uses psychopy.hardware.keyboard, whose backends timestamp key presses when
+they happen, and resets its clock on the flip that shows the test display, so reaction times are
+measured from the actual test onset.
+
+Each response also records how long it took to be noticed after the key press (ResponseLatency)
+and the longest gap between polls while waiting (PollInterval). These are saved with the trial and
+summarized over the session so the precision of the reaction times can be checked.
+
+Classes:
+KeyboardResponse -- Collects responses with psychopy.hardware.keyboard.
+
+Attributes:
+RESPONSE_BACKENDS -- The available response backends. 'event' uses psychopy.event.waitKeys and
+    'keyboard' uses a KeyboardResponse.
+RESPONSE_FIELDS -- The data fields added to each trial by the 'keyboard' backend.
+"""
+
+import time
+
+import numpy as np
+
+import psychopy.hardware.keyboard
+
+RESPONSE_BACKENDS = ['event', 'keyboard']
+RESPONSE_FIELDS = ['ResponseLatency', 'PollInterval']
+
+
+class KeyboardResponse:
+    """Collects key presses timed from the onset of the test display.
+
+    Parameters:
+    window -- The psychopy window the test display is flipped on.
+    keys -- The keys that count as a response.
+
+    Methods:
+    arm -- Resets the response clock on the next flip.
+    wait -- Waits for a response.
+    latency_summary -- Summarizes the polling latencies of every response so far.
+    """
+
+    def __init__(self, window, keys):
+        self.window = window
+        self.keys = keys
+        self.keyboard = psychopy.hardware.keyboard.Keyboard()
+
+        self.last_timing = {}
+        self.latencies = []
+        self.poll_intervals = []
+
+    def arm(self):
+        """Resets the response clock and clears old key presses on the next window flip."""
+        self.window.callOnFlip(self.keyboard.clock.reset)
+        self.window.callOnFlip(self.keyboard.clearEvents, eventType='keyboard')
+
+    def wait(self):
+        """Polls the keyboard until one of the keys is pressed.
+
+        Returns the key name and the reaction time in milliseconds from the armed flip.
+        """
+        clock = self.keyboard.clock
+        last_poll = clock.getTime()
+        longest_interval = 0.0
+
+        while True:
+            pressed = self.keyboard.getKeys(keyList=self.keys, waitRelease=False)
+            now = clock.getTime()
+
+            longest_interval = max(longest_interval, now - last_poll)
+            last_poll = now
+
+            if pressed:
+                key = pressed[0]
+                break
+
+            time.sleep(0)  # Give other threads a chance to run without giving up the CPU
+
+        self.last_timing = {
+            'ResponseLatency': (now - key.rt) * 1000,
+            'PollInterval': longest_interval * 1000,
+        }
+        self.latencies.append(self.last_timing['ResponseLatency'])
+        self.poll_intervals.append(self.last_timing['PollInterval'])
+
+        return key.name, key.rt * 1000
+
+    def latency_summary(self):
+        """Returns the number of responses and the mean, 95th percentile and maximum (in ms) of
+        the response latencies and poll intervals.
+        """
+        summary = {'responses': len(self.latencies)}
+
+        for name, values in [('latency', self.latencies), ('poll_interval', self.poll_intervals)]:
+            values = np.array(values) if values else np.array([np.nan])
+            summary.update({
+                name + '_mean': float(np.mean(values)),
+                name + '_p95': float(np.percentile(values, 95)),
+                name + '_max': float(np.max(values)),
+            })
+
+        return summary
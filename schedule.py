@@ -0,0 +1,197 @@
+"""Compiles full session schedules ahead of time and streams them back during a session.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+A schedule holds every block and trial of a session (set sizes, trial types, locations, colors and
+test locations) so that no trials need to be generated while the participant is waiting. Each block
+is generated from its own random stream, derived from a study seed, the subject number and the
+block number (see seeding.py), so the same subject gets the same schedule on any lab station and
+the schedule matches a session run live with the same seed. Schedules are saved as compressed .npz
+files with one array per trial field; locations and color indices are padded with NaN up to the
+largest set size. Colors are stored as indices into the task's colors, which are saved with the
+schedule, so trials read back with exactly the color values a live session uses. The task's
+generation settings are saved as well, and Ktask.check_schedule refuses a schedule compiled with
+different ones.
+
+To compile schedules for subjects 1 through 20 with the defaults in changedetection.py:
+
+    python schedule.py 1-20 --seed 1234 --directory schedules
+
+The defaults are read from changedetection.py without importing it, and trials are made with
+generation.TrialGenerator, so compiling schedules only needs NumPy and works without a display.
+
+Then pass the file to Ktask.run with the schedule_file argument.
+
+Functions:
+compile_schedule -- Generates every block for a subject and saves it.
+load_schedule_info -- Returns the metadata stored with a schedule.
+iter_schedule -- Yields the blocks of a saved schedule.
+schedule_filename -- Returns the name a subject's schedule is saved under.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+
+import generation
+import seeding
+
+TRIAL_TYPES = ['same', 'diff']
+
+
+def _pad(values, width, depth):
+    """Returns values as a float array padded with NaN to shape (width, depth)."""
+    padded = np.full((width, depth), np.nan)
+    padded[:len(values)] = np.reshape(values, (-1, depth))
+    return padded
+
+
+def compile_schedule(task, subject_number, filename, seed=None):
+    """Generates every block of a session with task.make_seeded_block and saves it.
+
+    Each block is made from its stream for the given study seed, so task.seed is not used or
+    changed.
+
+    Returns the study seed.
+
+    Parameters:
+    task -- The generation.TrialGenerator or Ktask (or subclass) whose make_block creates the
+        trials.
+    subject_number -- The subject the schedule is for.
+    filename -- Where the .npz file is saved.
+    seed -- The study seed. If None, a random seed is chosen and stored in the file.
+    """
+    if seed is None:
+        seed = seeding.new_seed()
+
+    blocks = [task.make_seeded_block(block_num, subject_number, seed)
+              for block_num in range(task.number_of_blocks)]
+    trials = [trial for block in blocks for trial in block]
+    width = max(trial['set_size'] for trial in trials)
+
+    info = {
+        'subject_number': str(subject_number),
+        'seed': seed,
+        'number_of_blocks': task.number_of_blocks,
+        'keys': task.keys,
+        'colors': np.asarray(task.colors).tolist(),
+        'settings': task.generation_settings(),
+    }
+
+    np.savez_compressed(
+        filename,
+        info=np.array(json.dumps(info)),
+        block=np.repeat(np.arange(len(blocks)), [len(block) for block in blocks]),
+        set_size=np.array([trial['set_size'] for trial in trials]),
+        trial_type=np.array([TRIAL_TYPES.index(trial['trial_type']) for trial in trials]),
+        test_location=np.array([trial['test_location'] for trial in trials]),
+        locations=np.array([_pad(trial['locations'], width, 2) for trial in trials]),
+        stim_color_index=np.array([_pad(trial['stim_color_indices'], width, 1)[:, 0]
+                                   for trial in trials]),
+        test_color_index=np.array([trial['test_color_index'] for trial in trials]),
+    )
+
+    return seed
+
+
+def schedule_filename(exp_name, subject_number, directory='.'):
+    """Returns the file a subject's schedule is saved in, named like the experiment's data files
+    with the subject number padded to three digits (ChangeDetection_001_schedule.npz).
+
+    Parameters:
+    exp_name -- The name of the experiment.
+    subject_number -- The subject the schedule is for.
+    directory -- The directory the schedule is saved in.
+    """
+    return os.path.join(directory, '{}_{}_schedule.npz'.format(
+        exp_name, str(subject_number).zfill(3)))
+
+
+def load_schedule_info(filename):
+    """Returns the metadata dict stored with a schedule.
+
+    Parameters:
+    filename -- The .npz file created by compile_schedule.
+    """
+    with np.load(filename) as schedule:
+        return json.loads(str(schedule['info']))
+
+
+def iter_schedule(filename):
+    """Yields each block of a saved schedule as a list of trial dicts.
+
+    Trials have the same keys as those created by Ktask.make_trial. Trial dicts are only created
+    for a block when it is requested.
+
+    Parameters:
+    filename -- The .npz file created by compile_schedule.
+    """
+    with np.load(filename) as schedule:
+        info = json.loads(str(schedule['info']))
+        fields = {name: schedule[name] for name in schedule.files if name != 'info'}
+
+    starts = np.flatnonzero(np.diff(fields['block'], prepend=-1))
+    stops = np.append(starts[1:], len(fields['block']))
+
+    for start, stop in zip(starts, stops):
+        block = []
+
+        for i in range(start, stop):
+            set_size = int(fields['set_size'][i])
+            trial_type = TRIAL_TYPES[fields['trial_type'][i]]
+            color_indices = fields['stim_color_index'][i, :set_size].astype(int).tolist()
+            test_color_index = int(fields['test_color_index'][i])
+
+            block.append({
+                'set_size': set_size,
+                'trial_type': trial_type,
+                'cresp': info['keys'][TRIAL_TYPES.index(trial_type)],
+                'locations': fields['locations'][i, :set_size].tolist(),
+                'stim_colors': [info['colors'][index] for index in color_indices],
+                'test_color': info['colors'][test_color_index],
+                'test_location': int(fields['test_location'][i]),
+                'stim_color_indices': color_indices,
+                'test_color_index': test_color_index,
+            })
+
+        yield block
+
+
+def _parse_subjects(values):
+    """Expands subject arguments like '3' or '1-20' into a list of subject numbers."""
+    subjects = []
+    for value in values:
+        first, _, last = value.partition('-')
+        subjects.extend(range(int(first), int(last or first) + 1))
+    return subjects
+
+
+def main(argv=None):
+    """Compiles schedules from the command line using the defaults in changedetection.py."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('subjects', nargs='+', help="Subject numbers or ranges like '1-20'.")
+    parser.add_argument('--seed', type=int, default=None, help='The study seed.')
+    parser.add_argument('--directory', default='.', help='Where schedules are saved.')
+    parser.add_argument('--defaults', default=None,
+                        help='The experiment script to read defaults from (changedetection.py).')
+    args = parser.parse_args(argv)
+
+    defaults = generation.experiment_defaults(args.defaults)
+    exp_name = defaults.pop('exp_name', 'ChangeDetection')
+    task = generation.TrialGenerator(**defaults)
+
+    if args.seed is None:
+        args.seed = seeding.new_seed()
+
+    os.makedirs(args.directory, exist_ok=True)
+
+    for subject_number in _parse_subjects(args.subjects):
+        filename = schedule_filename(exp_name, subject_number, args.directory)
+        compile_schedule(task, subject_number, filename, args.seed)
+        print('Saved {}'.format(filename))
+
+
+if __name__ == '__main__':
+    main()
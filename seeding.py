@@ -0,0 +1,72 @@
+"""Seeded random number streams for subjects and blocks.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Every block of a session gets its own numpy.random.Generator, derived with a SeedSequence from the
+study seed, the subject number and the block number. A block's trials therefore depend only on
+those three numbers: blocks can be generated in any order, in separate worker processes, or
+regenerated later on demand, and the results are identical.
+
+Subject numbers are usually whole numbers, but IDs such as 'S01' are entered in some labs. These
+are hashed into the spawn key, so they get their own reproducible streams too.
+
+Functions:
+new_seed -- Returns a fresh random study seed.
+subject_key -- Returns the spawn key entry for a subject number or ID.
+block_seed_sequence -- Returns the SeedSequence for a subject's block.
+block_rng -- Returns the Generator for a subject's block.
+"""
+
+import hashlib
+
+import numpy as np
+
+# Hashed IDs start here so they never collide with a numeric subject number
+_HASHED_ID_OFFSET = 2 ** 64
+
+
+def new_seed():
+    """Returns a fresh random study seed drawn from the operating system's entropy."""
+    return int(np.random.SeedSequence().generate_state(1)[0])
+
+
+def subject_key(subject_number):
+    """Returns the non-negative integer used for a subject in a spawn key.
+
+    Subject numbers like 12 or '012' are used as numbers. Any other ID is hashed, so 'S01' always
+    gets the same key, which differs from the key of every numeric subject number.
+
+    Parameters:
+    subject_number -- The subject number or ID.
+    """
+    text = str(subject_number).strip()
+
+    if text.isdigit():
+        return int(text)
+
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return _HASHED_ID_OFFSET + int.from_bytes(digest[:8], 'big')
+
+
+def block_seed_sequence(seed, subject_number, block_num):
+    """Returns the SeedSequence for one block of one subject.
+
+    Streams for different subjects and blocks are statistically independent.
+
+    Parameters:
+    seed -- The study seed.
+    subject_number -- The subject number or ID (see subject_key).
+    block_num -- The number of the block in the experiment.
+    """
+    return np.random.SeedSequence(seed, spawn_key=(subject_key(subject_number), int(block_num)))
+
+
+def block_rng(seed, subject_number, block_num):
+    """Returns a numpy.random.Generator for one block of one subject.
+
+    Parameters:
+    seed -- The study seed.
+    subject_number -- The subject number or ID (see subject_key).
+    block_num -- The number of the block in the experiment.
+    """
+    return np.random.default_rng(block_seed_sequence(seed, subject_number, block_num))
@@ -0,0 +1,244 @@
+"""Monte-Carlo simulation of whole sessions for design and power analysis.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Each virtual subject gets a full session generated by generation.TrialGenerator, with the same
+per-block random streams as a real session (see seeding.py), so any setting that changes the trials
+is simulated as well. Settings default to those in changedetection.py, and psychopy is not needed.
+Blocks are made as compact arrays (see trialblock.py) so that large simulations stay fast and
+small. The trials are answered by an observer.SimulatedObserver: a slot model that remembers
+min(k / set size, 1) of the items and guesses otherwise. A guessing observer is a
+slot model with k=0. K is then estimated from the simulated responses with analysis.estimate_k.
+
+Subjects are simulated in chunks across a process pool. For each design (trials per block) and
+set size the report gives the mean, standard deviation and root mean squared error of the K
+estimates, so the number of trials needed for stable estimates can be read off directly:
+
+    python simulate.py --subjects 2000 --trials 20 40 80 160 --set-sizes 4 6 8 --k 3
+
+Functions:
+simulate_subjects -- Simulates a group of subjects and returns their K estimates.
+simulate_design -- Simulates many subjects for one design in parallel and summarizes the estimates.
+simulate_designs -- Simulates designs with different numbers of trials per block.
+write_report -- Saves report rows as a CSV file.
+
+Attributes:
+REPORT_FIELDS -- The fields of each report row.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import os
+
+import numpy as np
+
+import analysis
+import generation
+import observer
+import seeding
+import trialblock
+
+REPORT_FIELDS = [
+    'TrialsPerBlock', 'SetSize', 'Trials', 'Subjects', 'TrueK', 'CowanMean', 'CowanSD',
+    'CowanRMSE', 'PashlerMean', 'PashlerSD', 'PashlerRMSE',
+]
+
+
+def _observer_rng(seed, subject_number):
+    """Returns the observer's Generator for a subject, independent of the subject's block streams.
+    """
+    return np.random.default_rng(
+        np.random.SeedSequence(seed, spawn_key=(seeding.subject_key(subject_number),)))
+
+
+def _task_settings(task_kwargs):
+    """Returns the TrialGenerator settings: the defaults in changedetection.py and task_kwargs."""
+    settings = generation.experiment_defaults()
+    settings.pop('exp_name', None)
+    settings.update(task_kwargs or {})
+    return settings
+
+
+def simulate_subjects(subject_numbers, seed, k=3, k_sd=0, guess_rate=0.5, task_kwargs=None):
+    """Simulates a session for each subject and estimates K at each set size.
+
+    Returns a list of analysis.estimate_k rows (one per subject and set size), each with the
+    subject's true capacity added as 'TrueK'.
+
+    Parameters:
+    subject_numbers -- The subjects to simulate.
+    seed -- The study seed. Sessions and responses are derived from it and the subject number.
+    k -- The mean capacity of the observers.
+    k_sd -- The standard deviation of capacity across observers. Capacities are drawn from a normal
+        distribution and clipped at 0.
+    guess_rate -- The probability of guessing 'different' when the tested item was not remembered.
+    task_kwargs -- Keyword arguments sent to generation.TrialGenerator, replacing the defaults in
+        changedetection.py. compact_blocks is always True.
+    """
+    settings = _task_settings(task_kwargs)
+    settings.update(seed=seed, compact_blocks=True)
+    task = generation.TrialGenerator(**settings)
+
+    trial_sets = []
+    true_k = {}
+
+    for subject_number in subject_numbers:
+        rng = _observer_rng(seed, subject_number)
+        subject = observer.SimulatedObserver(
+            k=max(rng.normal(k, k_sd), 0), guess_rate=guess_rate, keys=task.keys, rng=rng)
+        true_k[str(subject_number)] = subject.k
+
+        for block_num in range(task.number_of_blocks):
+            block = task.make_seeded_block(block_num, subject_number)
+
+            set_sizes = block.data['set_size'].astype(int)
+            diff = block.data['trial_type'] == trialblock.TRIAL_TYPES.index('diff')
+
+            trial_sets.append({
+                'Subject': np.full(len(block), str(subject_number)),
+                'Block': np.full(len(block), str(block_num)),
+                'SetSize': set_sizes,
+                'Diff': diff,
+                'ACC': subject.accuracy(set_sizes, diff),
+            })
+
+    trials = {field: np.concatenate([trial_set[field] for trial_set in trial_sets])
+              for field in trial_sets[0]}
+    rows = analysis.estimate_k(trials, ('Subject', 'SetSize'))
+
+    for row in rows:
+        row['TrueK'] = min(true_k[row['Subject']], row['SetSize'])
+
+    return rows
+
+
+def _summarize(rows, trials_per_block):
+    """Returns a report row for each set size from the estimates of many subjects."""
+    report = []
+
+    for set_size in sorted({row['SetSize'] for row in rows}):
+        group = [row for row in rows if row['SetSize'] == set_size]
+        true_k = np.array([row['TrueK'] for row in group])
+
+        summary = {
+            'TrialsPerBlock': trials_per_block,
+            'SetSize': set_size,
+            'Trials': float(np.mean([row['NSame'] + row['NDiff'] for row in group])),
+            'Subjects': len(group),
+            'TrueK': float(true_k.mean()),
+        }
+
+        for name, field in [('Cowan', 'CowanK'), ('Pashler', 'PashlerK')]:
+            estimates = np.array([row[field] for row in group], dtype=float)
+            summary.update({
+                name + 'Mean': float(np.nanmean(estimates)),
+                name + 'SD': float(np.nanstd(estimates, ddof=1)),
+                name + 'RMSE': float(np.sqrt(np.nanmean((estimates - true_k) ** 2))),
+            })
+
+        report.append(summary)
+
+    return report
+
+
+def simulate_design(n_subjects, seed, k=3, k_sd=0, guess_rate=0.5, processes=None,
+                    **task_kwargs):
+    """Simulates many subjects for one design across a process pool.
+
+    Returns a list of report rows (dicts with the keys in REPORT_FIELDS), one per set size.
+
+    Parameters:
+    n_subjects -- The number of virtual subjects.
+    seed -- The study seed.
+    k -- The mean capacity of the observers.
+    k_sd -- The standard deviation of capacity across observers.
+    guess_rate -- The probability of guessing 'different' when the tested item was not remembered.
+    processes -- The number of worker processes. If None, one per CPU is used.
+    Additional keyword arguments are sent to generation.TrialGenerator (for example set_sizes,
+    number_of_trials_per_block, number_of_blocks and percent_same).
+    """
+    workers = processes or os.cpu_count() or 1
+    chunks = np.array_split(np.arange(n_subjects), min(4 * workers, n_subjects))
+
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(simulate_subjects, chunk.tolist(), seed, k, k_sd, guess_rate,
+                            task_kwargs)
+            for chunk in chunks
+        ]
+        rows = [row for future in futures for row in future.result()]
+
+    return _summarize(rows, _task_settings(task_kwargs)['number_of_trials_per_block'])
+
+
+def simulate_designs(trial_counts, n_subjects, seed=None, **kwargs):
+    """Simulates designs with different numbers of trials per block.
+
+    Returns the report rows of every design, showing how the spread of the estimates shrinks as
+    trials are added.
+
+    Parameters:
+    trial_counts -- The numbers of trials per block to simulate.
+    n_subjects -- The number of virtual subjects for each design.
+    seed -- The study seed. If None, a new seed is chosen.
+    Additional keyword arguments are sent to simulate_design.
+    """
+    if seed is None:
+        seed = seeding.new_seed()
+
+    report = []
+    for trials in trial_counts:
+        report.extend(simulate_design(
+            n_subjects, seed, number_of_trials_per_block=trials, **kwargs))
+
+    return report
+
+
+def write_report(rows, filename):
+    """Saves report rows as a CSV file.
+
+    Parameters:
+    rows -- The rows returned by simulate_design or simulate_designs.
+    filename -- Where to save the table.
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    """Runs a simulation from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--subjects', type=int, default=1000, help='Virtual subjects per design.')
+    parser.add_argument('--trials', type=int, nargs='+', default=[20, 40, 80, 160],
+                        help='Numbers of trials per block to simulate.')
+    parser.add_argument('--blocks', type=int, default=1, help='Blocks per session.')
+    parser.add_argument('--set-sizes', type=int, nargs='+', default=[6], help='Set sizes.')
+    parser.add_argument('--percent-same', type=float, default=0.5, help='Proportion same trials.')
+    parser.add_argument('--k', type=float, default=3, help='Mean observer capacity.')
+    parser.add_argument('--k-sd', type=float, default=0, help='SD of capacity across observers.')
+    parser.add_argument('--guess-rate', type=float, default=0.5, help="P('different') guesses.")
+    parser.add_argument('--seed', type=int, default=None, help='The study seed.')
+    parser.add_argument('--processes', type=int, default=None, help='Worker processes to use.')
+    parser.add_argument('--output', default=None, help='Where to save the report as a CSV file.')
+    args = parser.parse_args(argv)
+
+    report = simulate_designs(
+        args.trials, args.subjects, args.seed, k=args.k, k_sd=args.k_sd,
+        guess_rate=args.guess_rate, processes=args.processes, set_sizes=args.set_sizes,
+        number_of_blocks=args.blocks, percent_same=args.percent_same)
+
+    if args.output is not None:
+        write_report(report, args.output)
+
+    print(('{:>14} {:>8} {:>7} {:>6} {:>9} {:>9} {:>9}').format(
+        'TrialsPerBlock', 'SetSize', 'Trials', 'TrueK', 'CowanMean', 'CowanSD', 'CowanRMSE'))
+    for row in report:
+        print('{TrialsPerBlock:>14} {SetSize:>8} {Trials:>7.1f} {TrueK:>6.2f} {CowanMean:>9.3f} '
+              '{CowanSD:>9.3f} {CowanRMSE:>9.3f}'.format(**row))
+
+
+if __name__ == '__main__':
+    main()
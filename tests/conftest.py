@@ -0,0 +1,29 @@
+"""Shared setup for the tests.
+
+The experiment's modules are flat files in the repository root, so the root is added to the import
+path. Tests that run a Ktask need psychopy and the templateexperiments module (template.py) and are
+skipped when either is missing; everything else only needs NumPy.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def headless(tmp_path, monkeypatch):
+    """Returns the headless module, with the working directory restored after the test.
+
+    Ktask.run changes into its data directory, so tests should pass a data_directory inside
+    tmp_path.
+    """
+    pytest.importorskip('psychopy')
+    pytest.importorskip('template')
+
+    import headless
+
+    monkeypatch.chdir(tmp_path)
+    return headless
@@ -0,0 +1,68 @@
+import csv
+
+import numpy as np
+import pytest
+
+import analysis
+
+FIELDS = ['Subject', 'Block', 'Trial', 'SetSize', 'TrialType', 'ACC']
+
+
+def write_rows(filename, rows):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(FIELDS)
+        writer.writerows(rows)
+
+
+def session_rows(block, subject='1'):
+    """Set size 4: 3 of 4 hits and 1 of 4 false alarms. Set size 6: no errors."""
+    trials = ([(4, 'diff', acc) for acc in [1, 1, 1, 0]]
+              + [(4, 'same', acc) for acc in [0, 1, 1, 1]]
+              + [(6, 'diff', 1), (6, 'diff', 1), (6, 'same', 1), (6, 'same', 1)])
+    return [[subject, block, i, set_size, trial_type, acc]
+            for i, (set_size, trial_type, acc) in enumerate(trials)]
+
+
+def test_k_estimates():
+    cowan_k, pashler_k = analysis.k_estimates([4, 6, 4], [0.75, 1.0, 0.5], [0.25, 0.0, 1.0])
+
+    np.testing.assert_allclose(cowan_k, [2.0, 6.0, -2.0])  # N * (H - F)
+    np.testing.assert_allclose(pashler_k, [2 / 0.75, 6.0, np.nan])  # N * (H - F) / (1 - F)
+
+
+def test_estimate_k(tmp_path):
+    filename = str(tmp_path / 'ChangeDetection_001.csv')
+    write_rows(filename, session_rows(0))
+
+    rows = analysis.estimate_k(analysis.read_trials(filename))
+
+    assert [(row['Subject'], row['Block'], row['SetSize']) for row in rows] == [
+        ('1', '0', 4), ('1', '0', 6)]
+    assert (rows[0]['NSame'], rows[0]['NDiff']) == (4, 4)
+    assert rows[0]['HitRate'] == 0.75
+    assert rows[0]['FalseAlarmRate'] == 0.25
+    assert rows[0]['CowanK'] == pytest.approx(2.0)
+    assert rows[0]['PashlerK'] == pytest.approx(2 / 0.75)
+    assert (rows[1]['CowanK'], rows[1]['PashlerK']) == (6.0, 6.0)
+
+
+def test_practice_trials_are_left_out(tmp_path):
+    filename = str(tmp_path / 'ChangeDetection_001.csv')
+
+    # A practice block answered at chance would pull the subject's K down
+    practice = [['1', 'practice', i, 4, trial_type, i % 2]
+                for i, trial_type in enumerate(['diff', 'same'] * 4)]
+    write_rows(filename, practice + session_rows(0) + session_rows(1))
+
+    rows = analysis.summarize([filename], processes=1)
+    overall = [row for row in rows if row['Block'] == 'all' and row['SetSize'] == 4]
+
+    assert sorted({row['Block'] for row in rows}) == ['0', '1', 'all']
+    assert overall[0]['NDiff'] == 8
+    assert overall[0]['CowanK'] == pytest.approx(2.0)
+
+    included = analysis.summarize([filename], processes=1, include_practice=True)
+    assert 'practice' in {row['Block'] for row in included}
+    assert [row['NDiff'] for row in included
+            if row['Block'] == 'all' and row['SetSize'] == 4] == [12]
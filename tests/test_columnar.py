@@ -0,0 +1,57 @@
+import csv
+import json
+
+import numpy as np
+
+import columnar
+
+FIELDS = ['Block', 'Trial', 'RT', 'TrialType', 'Locations', 'SampleColors', 'TestColors']
+
+
+def make_row(trial, set_size):
+    return {
+        'Block': 0,
+        'Trial': trial,
+        'RT': None if trial == 0 else 500.0 + trial,
+        'TrialType': 'same',
+        'Locations': json.dumps([[trial, -trial]] * set_size),
+        'SampleColors': json.dumps([[1, -1, 1]] * set_size),
+        'TestColors': json.dumps([-1, -1, -1]),
+    }
+
+
+def write_csv(filename, rows):
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_csv_to_columns(tmp_path):
+    filename = str(tmp_path / 'data.csv')
+    write_csv(filename, [make_row(0, 2), make_row(1, 4)])
+
+    data = columnar.load_columns(columnar.csv_to_columns(filename))
+
+    np.testing.assert_array_equal(data['Trial'], [0, 1])
+    assert np.isnan(data['RT'][0]) and data['RT'][1] == 501
+    assert data['Locations'].shape == (2, 4, 2)
+    assert np.isnan(data['Locations'][0, 2:]).all()
+    np.testing.assert_array_equal(data['TestColors'], [[-1, -1, -1]] * 2)
+
+
+def test_writer_continues_a_csv_file(tmp_path):
+    filename = str(tmp_path / 'data.csv')
+    write_csv(filename, [make_row(0, 2), make_row(1, 2)])
+
+    # A row cut off by a crash
+    with open(filename, 'a') as f:
+        f.write('0,2,502.0')
+
+    writer = columnar.ColumnarWriter(str(tmp_path / 'columns'), FIELDS, filename)
+    writer.append(make_row(2, 2))
+    writer.save()
+
+    data = columnar.load_columns(str(tmp_path / 'columns'))
+    np.testing.assert_array_equal(data['Trial'], [0, 1, 2])
+    np.testing.assert_array_equal(data['Locations'][2], [[2, -2], [2, -2]])
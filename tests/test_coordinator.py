@@ -0,0 +1,113 @@
+"""Runs a coordinator and its stations as separate local processes."""
+
+import concurrent.futures
+import csv
+import os
+import subprocess
+import sys
+
+import pytest
+
+import coordinator
+import generation
+import schedule
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIELDS = ['Subject', 'Block', 'Trial', 'SetSize', 'TrialType']
+
+
+@pytest.fixture
+def coordinator_address(tmp_path):
+    """Starts `python coordinator.py` on a free port and returns its address."""
+    process = subprocess.Popen(
+        [sys.executable, '-u', os.path.join(ROOT, 'coordinator.py'), '--port', '0', '--seed',
+         '1234', '--data-directory', str(tmp_path / 'study')],
+        stdout=subprocess.PIPE, universal_newlines=True)
+
+    try:
+        # Coordinating stations on host:port (seed 1234)
+        yield process.stdout.readline().split()[3]
+    finally:
+        process.terminate()
+        process.wait()
+        process.stdout.close()
+
+
+def run_station(address, station, directory, task_kwargs=None):
+    """Runs a schedule from the coordinator without psychopy and returns the rows it sent."""
+    settings = generation.experiment_defaults()
+    exp_name = settings.pop('exp_name')
+    settings.update(task_kwargs or {})
+    generator = generation.TrialGenerator(**settings)
+
+    client = coordinator.CoordinatorClient(address, station=station, batch_size=3,
+                                           max_in_flight=2)
+    assignment = client.connect(FIELDS, exp_name, generator.generation_settings())
+
+    schedule_file = os.path.join(directory, '{}.npz'.format(station))
+    with open(schedule_file, 'wb') as f:
+        f.write(assignment['schedule'])
+
+    rows = []
+    for block_num, block in enumerate(schedule.iter_schedule(schedule_file)):
+        for trial_num, trial in enumerate(block):
+            rows.append({'Subject': assignment['subject'], 'Block': block_num,
+                         'Trial': trial_num, 'SetSize': trial['set_size'],
+                         'TrialType': trial['trial_type']})
+            client.send(rows[-1])
+
+    client.close()
+    return [{field: str(row[field]) for field in FIELDS} for row in rows]
+
+
+def read_rows(filename):
+    with open(filename, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_stations_in_separate_processes(coordinator_address, tmp_path):
+    with concurrent.futures.ProcessPoolExecutor(4) as executor:
+        futures = [executor.submit(run_station, coordinator_address, 'station{}'.format(i),
+                                   str(tmp_path)) for i in range(4)]
+        sent = [future.result() for future in futures]
+
+    assert sorted(rows[0]['Subject'] for rows in sent) == ['1', '2', '3', '4']
+
+    for rows in sent:
+        subject = rows[0]['Subject']
+        saved = read_rows(str(tmp_path / 'study' / 'ChangeDetection_00{}.csv'.format(subject)))
+
+        assert len(rows) == 20
+        assert saved == rows
+
+        # Every station ran the schedule of its own subject
+        settings = generation.experiment_defaults()
+        settings.pop('exp_name')
+        expected = str(tmp_path / 'expected.npz')
+        schedule.compile_schedule(generation.TrialGenerator(**settings), subject, expected, 1234)
+
+        trials = [trial for block in schedule.iter_schedule(expected) for trial in block]
+        assert [(row['SetSize'], row['TrialType']) for row in saved] == [
+            (str(trial['set_size']), trial['trial_type']) for trial in trials]
+
+
+def test_station_with_other_settings_is_refused(coordinator_address, tmp_path):
+    with pytest.raises(ValueError, match='number_of_trials_per_block, percent_same'):
+        run_station(coordinator_address, 'station', str(tmp_path),
+                    {'number_of_trials_per_block': 4, 'percent_same': 0.25})
+
+    # The refused station was not given a subject number
+    assert run_station(coordinator_address, 'station', str(tmp_path))[0]['Subject'] == '1'
+    assert not os.path.exists(str(tmp_path / 'study' / 'ChangeDetection_002.csv'))
+
+
+def test_headless_station(coordinator_address, headless, tmp_path):
+    task = headless.HeadlessKtask(
+        data_directory=str(tmp_path / 'station'), coordinator_address=coordinator_address,
+        stream_data=True)
+    task.run()
+
+    # The coordinator's copy has the same name and rows as the station's own data file
+    station_rows = read_rows(str(tmp_path / 'station' / 'ChangeDetection_001.csv'))
+    assert len(station_rows) == 20
+    assert read_rows(str(tmp_path / 'study' / 'ChangeDetection_001.csv')) == station_rows
@@ -0,0 +1,36 @@
+import csv
+import time
+
+import datawriter
+
+
+def read_rows(filename):
+    with open(filename, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_writes_after_the_fsync_interval_to_a_file_with_a_header(tmp_path):
+    filename = str(tmp_path / 'data.csv')
+
+    # The experiment writes the header before the writer is opened
+    with open(filename, 'w') as f:
+        f.write('Block,Trial\n')
+
+    writer = datawriter.StreamingCSVWriter(filename, ['Block', 'Trial'], fsync_interval=0.01)
+    writer.write({'Block': 0, 'Trial': 0})
+    time.sleep(0.05)
+    writer.write({'Block': 0, 'Trial': 1})
+    time.sleep(0.05)
+    writer.close()
+
+    assert read_rows(filename) == [{'Block': '0', 'Trial': '0'}, {'Block': '0', 'Trial': '1'}]
+
+
+def test_last_written_trial_skips_practice_and_cut_off_rows(tmp_path):
+    filename = str(tmp_path / 'data.csv')
+
+    with open(filename, 'w') as f:
+        f.write('Block,Trial,ACC\npractice,0,1\n0,0,1\n0,1,0\n0,2')
+
+    assert datawriter.last_written_trial(filename) == (0, 1)
+    assert datawriter.last_written_trial(str(tmp_path / 'missing.csv')) is None
@@ -0,0 +1,79 @@
+import generation
+
+
+class FixedLayout(generation.TrialGenerator):
+    """Overrides generate_locations with the signature it had before batch generation."""
+
+    def generate_locations(self, set_size):
+        return [[float(i) + 3, 3.0] for i in range(set_size)]
+
+
+def test_overridden_generate_locations_is_used():
+    generator = FixedLayout(set_sizes=[2, 4], number_of_trials_per_block=8, seed=1)
+    block = generator.make_block(generator.block_rng(0, subject_number=1))
+
+    for trial in block:
+        assert trial['locations'] == [[float(i) + 3, 3.0] for i in range(trial['set_size'])]
+
+
+def test_overridden_generate_locations_is_used_by_compact_blocks():
+    generator = FixedLayout(set_sizes=[2], number_of_trials_per_block=4, seed=1,
+                            compact_blocks=True)
+    block = generator.make_block(generator.block_rng(0, subject_number=1))
+
+    assert [trial['locations'] for trial in block] == [[[3.0, 3.0], [4.0, 3.0]]] * 4
+
+
+class LabeledTrials(generation.TrialGenerator):
+    """Overrides make_trial with the signature it had before batch generation."""
+
+    def make_trial(self, set_size, trial_type):
+        trial = super().make_trial(set_size, trial_type)
+        trial['label'] = 'custom'
+        return trial
+
+
+def test_overridden_make_trial_is_used():
+    generator = LabeledTrials(set_sizes=[2, 4], number_of_trials_per_block=8, seed=1)
+    block = generator.make_block(generator.block_rng(0, subject_number=1))
+    again = generator.make_block(generator.block_rng(0, subject_number=1))
+
+    plain = generation.TrialGenerator(set_sizes=[2, 4], number_of_trials_per_block=8, seed=1)
+    expected = plain.make_block(plain.block_rng(0, subject_number=1))
+
+    assert all(trial['label'] == 'custom' for trial in block)
+    assert sorted((trial['set_size'], trial['trial_type']) for trial in block) == sorted(
+        (trial['set_size'], trial['trial_type']) for trial in expected)
+    assert block == again
+
+
+def test_overridden_make_trial_is_used_by_compact_blocks():
+    generator = LabeledTrials(set_sizes=[2], number_of_trials_per_block=4, seed=1,
+                              compact_blocks=True)
+    listed = LabeledTrials(set_sizes=[2], number_of_trials_per_block=4, seed=1)
+
+    block = generator.make_block(generator.block_rng(0, subject_number=1))
+
+    assert block.tolist() == listed.make_block(listed.block_rng(0, subject_number=1))
+    assert [trial['label'] for trial in block] == ['custom'] * 4
+
+
+def test_compact_blocks_match_list_blocks():
+    kwargs = {'set_sizes': [3, 6], 'number_of_trials_per_block': 20, 'seed': 5}
+    listed = generation.TrialGenerator(**kwargs)
+    compact = generation.TrialGenerator(compact_blocks=True, **kwargs)
+
+    expected = listed.make_block(listed.block_rng(1, subject_number=2))
+    actual = compact.make_block(compact.block_rng(1, subject_number=2)).tolist()
+
+    assert actual == expected
+
+
+def test_test_array_single_probe_and_whole_display():
+    coordinates = [[0, 1], [2, 3], [4, 5]]
+    colors = [[1, 1, 1], [-1, -1, -1], [1, -1, -1]]
+
+    assert generation.test_array('diff', coordinates, colors, 1, [0, 0, 0]) == (
+        [[2, 3]], [[0, 0, 0]])
+    assert generation.test_array('same', coordinates, colors, 1, [0, 0, 0], False) == (
+        coordinates, colors)
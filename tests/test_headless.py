@@ -0,0 +1,35 @@
+import csv
+import json
+
+
+def test_keyboard_backend_runs_headless(headless, tmp_path):
+    task = headless.HeadlessKtask(
+        data_directory=str(tmp_path), number_of_trials_per_block=4, number_of_blocks=2,
+        set_sizes=[4], response_backend='keyboard', experiment_info={'Subject Number': '1'})
+
+    def record_latencies(task):
+        task.get_keyboard_response().latencies.extend([1.0, 3.0])
+
+    task.run(end_experiment_hook=record_latencies)
+
+    with open(str(tmp_path / 'ChangeDetection_001.csv'), newline='') as f:
+        assert len(list(csv.DictReader(f))) == 8
+
+    with open(str(tmp_path / 'ChangeDetection_001_latency.json')) as f:
+        summary = json.load(f)
+
+    assert summary['responses'] == 2
+    assert summary['latency_mean'] == 2.0
+
+
+def test_subclass_make_block_without_rng(headless, tmp_path):
+    class Task(headless.HeadlessKtask):
+        def make_block(self):
+            return super().make_block()[:2]
+
+    task = Task(data_directory=str(tmp_path), number_of_trials_per_block=4, number_of_blocks=2,
+                set_sizes=[4], experiment_info={'Subject Number': 'S01'})
+    task.run()
+
+    with open(str(tmp_path / 'ChangeDetection_S01.csv'), newline='') as f:
+        assert len(list(csv.DictReader(f))) == 4
@@ -0,0 +1,44 @@
+import os
+
+import analysis
+import ingest
+
+HEADER = 'Subject,Block,Trial,SetSize,TrialType,ACC\n'
+
+
+def write_session(directory, n_trials):
+    with open(os.path.join(directory, 'ChangeDetection_001.csv'), 'w') as f:
+        f.write(HEADER)
+        for trial in range(n_trials):
+            f.write('1,0,{},4,{},1\n'.format(trial, ['same', 'diff'][trial % 2]))
+
+
+def test_only_new_and_changed_files_are_ingested(tmp_path):
+    data = tmp_path / 'data'
+    store = str(tmp_path / 'store')
+    data.mkdir()
+    write_session(str(data), 4)
+    (data / 'ChangeDetection_info_001.txt').write_text('Seed: 1\n')
+
+    report = ingest.ingest(str(data), store)
+
+    assert report['new'] == ['ChangeDetection_001.csv', 'ChangeDetection_info_001.txt']
+    segment = os.path.join(store, ingest.load_manifest(store)['ChangeDetection_001.csv']['stored'])
+    assert len(analysis.read_trials(segment)['ACC']) == 4
+    assert (tmp_path / 'store' / 'info' / 'ChangeDetection_info_001.txt').exists()
+
+    # A touched file with the same contents is not ingested again
+    info = str(data / 'ChangeDetection_info_001.txt')
+    os.utime(info, (1, 1))
+    report = ingest.ingest(str(data), store)
+
+    assert report['unchanged'] == ['ChangeDetection_001.csv', 'ChangeDetection_info_001.txt']
+    assert ingest.load_manifest(store)['ChangeDetection_info_001.txt']['mtime'] == 1
+
+    write_session(str(data), 6)
+    report = ingest.ingest(str(data), store)
+
+    assert report['changed'] == ['ChangeDetection_001.csv']
+    assert len(analysis.read_trials(segment)['ACC']) == 6
+    assert analysis.summarize([segment], processes=1) == analysis.summarize(
+        [str(data / 'ChangeDetection_001.csv')], processes=1)
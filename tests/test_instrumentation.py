@@ -0,0 +1,78 @@
+import csv
+import json
+import time
+import tracemalloc
+
+import pytest
+
+import instrumentation
+
+
+def test_phases_are_timed_per_trial(tmp_path):
+    instrument = instrumentation.Instrumentation('timing')
+
+    with instrument.phase('make_block'):
+        time.sleep(0.01)
+
+    for trial_num in range(2):
+        instrument.start_trial(0, trial_num)
+        for _ in range(2):  # Repeated phases are added up
+            with instrument.phase('sample'):
+                time.sleep(0.01)
+        instrument.end_trial()
+
+    report = instrument.report()
+
+    assert report['trials'] == 2
+    assert report['make_block']['total'] >= 10
+    assert report['sample']['median'] >= 20
+    assert report['total']['mean'] >= report['sample']['mean']
+    assert report['fixation']['max'] == 0
+
+    instrument.save(str(tmp_path / 'session'))
+
+    with open(str(tmp_path / 'session_timing.csv'), newline='') as f:
+        rows = list(csv.DictReader(f))
+    with open(str(tmp_path / 'session_timing_report.json')) as f:
+        saved = json.load(f)
+
+    assert [(row['Block'], row['Trial']) for row in rows] == [('0', '0'), ('0', '1')]
+    assert float(rows[0]['sample']) >= 20
+    assert saved['trials'] == 2
+
+
+def test_tracemalloc_records_allocations():
+    instrument = instrumentation.Instrumentation('tracemalloc')
+
+    try:
+        instrument.start_trial(0, 0)
+        data = bytearray(512 * 1024)
+        instrument.end_trial()
+    finally:
+        tracemalloc.stop()
+
+    assert len(data) == 512 * 1024
+    assert instrument.rows[0]['AllocatedKB'] >= 500
+    assert instrument.rows[0]['PeakKB'] >= instrument.rows[0]['AllocatedKB']
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        instrumentation.Instrumentation('perf')
+
+
+def test_profiled_session_saves_every_trial(headless, tmp_path):
+    task = headless.HeadlessKtask(
+        data_directory=str(tmp_path), number_of_trials_per_block=4, number_of_blocks=2,
+        set_sizes=[4], instrument='cprofile', experiment_info={'Subject Number': '1'})
+    task.run()
+
+    with open(str(tmp_path / 'ChangeDetection_001_timing.csv'), newline='') as f:
+        rows = list(csv.DictReader(f))
+    with open(str(tmp_path / 'ChangeDetection_001_timing_report.json')) as f:
+        report = json.load(f)
+
+    assert len(rows) == 8
+    assert len(task.instrumentation.block_times) == 2
+    assert 'run_trial' in report['profile']
+    assert (tmp_path / 'ChangeDetection_001_profile.prof').exists()
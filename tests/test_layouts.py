@@ -0,0 +1,44 @@
+import numpy as np
+
+import generation
+import layouts
+import locations
+
+
+def test_pool_size_is_part_of_the_key(tmp_path):
+    small = layouts.LayoutPool(tmp_path, 4, 2.5, 6, pool_size=20)
+    large = layouts.LayoutPool(tmp_path, 4, 2.5, 6, pool_size=50)
+
+    assert small.key != large.key
+    assert len(small.load(np.random.default_rng(1))) == 20
+    assert len(large.load(np.random.default_rng(1))) == 50
+
+
+def test_pool_is_reused(tmp_path):
+    pool = layouts.LayoutPool(tmp_path, 4, 2.5, 6, pool_size=20)
+    first = np.array(pool.load(np.random.default_rng(1)))
+
+    again = layouts.LayoutPool(tmp_path, 4, 2.5, 6, pool_size=20)
+    np.testing.assert_array_equal(again.load(np.random.default_rng(2)), first)
+
+    sampled = again.sample(5, np.random.default_rng(3))
+    assert sampled.shape == (5, 4, 2)
+
+
+def test_pools_are_ready_when_the_generator_is_created(tmp_path, monkeypatch):
+    kwargs = {'set_sizes': [4, 6], 'number_of_trials_per_block': 8, 'layout_cache': str(tmp_path),
+              'layout_pool_size': 30, 'seed': 1}
+    generator = generation.TrialGenerator(**kwargs)
+
+    # Building the pools was timed, and they are loaded before any block is made
+    assert all(report['seconds'] is not None for report in generator.feasibility.values())
+    assert sorted(generator.layout_pools) == [4, 6]
+    assert len(list(tmp_path.glob('layouts_*.npy'))) == 2
+
+    again = generation.TrialGenerator(**kwargs)
+    assert all(report['seconds'] is None for report in again.feasibility.values())
+
+    # Making a block only samples from the pools
+    monkeypatch.setattr(locations, 'LOCATION_ENGINES', {})
+    block = again.make_block(again.block_rng(0, subject_number=1))
+    assert sorted(len(trial['locations']) for trial in block) == [4] * 8 + [6] * 8
@@ -0,0 +1,74 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+import generation
+import locations
+
+
+@pytest.mark.parametrize('engine', sorted(locations.LOCATION_ENGINES))
+def test_engines_respect_constraints(engine):
+    generate = locations.LOCATION_ENGINES[engine]
+    locs = generate(50, 6, 2.5, 6, 2, rng=np.random.default_rng(1))
+    locs = np.asarray(locs)
+
+    assert locs.shape == (50, 6, 2)
+    assert np.abs(locs).max() <= 6
+
+    # Stimuli are min_distance from fixation and from each other
+    assert np.linalg.norm(locs, axis=2).min() >= 2.5
+    pairs = np.linalg.norm(locs[:, :, None] - locs[:, None], axis=3)
+    pairs[:, np.arange(6), np.arange(6)] = np.inf
+    assert pairs.min() >= 2.5
+
+    quads = locations.which_quad(locs)
+    assert max(np.bincount(trial, minlength=4).max() for trial in quads) <= 2
+
+
+@pytest.mark.parametrize('engine', sorted(locations.LOCATION_ENGINES))
+def test_engines_are_reproducible(engine):
+    generate = locations.LOCATION_ENGINES[engine]
+    first = generate(10, 4, 2.5, 6, 2, rng=np.random.default_rng(7))
+    second = generate(10, 4, 2.5, 6, 2, rng=np.random.default_rng(7))
+
+    np.testing.assert_array_equal(first, second)
+
+
+def test_impossible_set_size_is_rejected():
+    with pytest.raises(ValueError):
+        locations.check_feasibility(40, 2.5, 6, None)
+
+
+def test_timeouts_use_the_samplers_attempts():
+    # Dense but fine: the sampler's 1000 attempts per display almost never run out
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        report = locations.check_feasibility(14, 2.5, 6, None, n_trials=10,
+                                             rng=np.random.default_rng(0))
+
+    assert report['completed'] == 1.0
+
+
+def test_likely_timeouts_are_reported():
+    # About 9% of real batches of 20 displays time out with these values
+    with pytest.warns(RuntimeWarning, match=r'making 20 of them has a \d+% chance'):
+        report = locations.check_feasibility(9, 3.2, 6, None, n_trials=20,
+                                             rng=np.random.default_rng(0))
+
+    assert 0.99 < report['completed'] < 1
+
+
+def test_feasibility_warnings_point_at_the_caller():
+    class Task(generation.TrialGenerator):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+
+    with pytest.warns(RuntimeWarning) as record:
+        Task(set_sizes=[9], min_distance=3.2, stim_size=3.5, max_per_quad=None,
+             number_of_trials_per_block=20, repeat_test_colors=True)
+
+    assert len(record) == 2
+    assert [os.path.basename(warning.filename) for warning in record] == [
+        'test_locations.py'] * len(record)
@@ -0,0 +1,83 @@
+import csv
+import math
+
+import numpy as np
+import pytest
+
+import observer
+import online
+
+
+def add_trials(estimator, set_size, trial_type, n_correct, n_wrong):
+    for acc in [1] * n_correct + [0] * n_wrong:
+        estimator.update({'TrialType': trial_type, 'SetSize': set_size, 'ACC': acc})
+
+
+def test_running_k_and_standard_error():
+    estimator = online.OnlineKEstimator()
+    add_trials(estimator, 4, 'diff', 8, 2)  # 8 hits
+    add_trials(estimator, 4, 'same', 8, 2)  # 2 false alarms
+    estimator.update({'TrialType': 'same', 'SetSize': 4, 'ACC': ''})  # No response, ignored
+
+    estimate = estimator.estimate(4)
+
+    assert (estimate['NSame'], estimate['NDiff'], estimator.n_trials) == (10, 10, 20)
+    assert estimate['HitRate'] == pytest.approx(0.8)
+    assert estimate['FalseAlarmRate'] == pytest.approx(0.2)
+    assert estimate['CowanK'] == pytest.approx(2.4)  # 4 * (0.8 - 0.2)
+    assert estimate['PashlerK'] == pytest.approx(3.0)  # 2.4 / (1 - 0.2)
+
+    # Var(H) = Var(F) = 0.8 * 0.2 / 10
+    assert estimate['SE'] == pytest.approx(4 * math.sqrt(0.032))
+    assert estimate['CIWidth'] == pytest.approx(2 * 1.959964 * 4 * math.sqrt(0.032))
+
+    # Delta method: dK/dH = 4 / 0.8 and dK/dF = 4 * (0.8 - 1) / 0.8 ** 2
+    pashler = online.OnlineKEstimator(single_probe=False)
+    add_trials(pashler, 4, 'diff', 8, 2)
+    add_trials(pashler, 4, 'same', 8, 2)
+    assert pashler.estimate(4)['SE'] == pytest.approx(math.sqrt((25 + 1.5625) * 0.016))
+
+
+def test_unmeasured_set_sizes_are_nan():
+    estimator = online.OnlineKEstimator()
+    add_trials(estimator, 4, 'diff', 3, 0)
+
+    assert math.isnan(estimator.estimate(4)['CowanK'])
+    assert math.isnan(estimator.ci_width(6))
+    assert [row['SetSize'] for row in estimator.estimates()] == [4]
+
+
+def test_converged_needs_every_set_size_and_min_trials():
+    estimator = online.OnlineKEstimator()
+    add_trials(estimator, 4, 'diff', 10, 0)
+    add_trials(estimator, 4, 'same', 10, 0)
+
+    # Perfect rates have no binomial error, so only min_trials holds the session back
+    assert estimator.ci_width(4) == 0
+    assert estimator.converged(0.5, [4], min_trials=10)
+    assert not estimator.converged(0.5, [4], min_trials=11)
+    assert not estimator.converged(0.5, [4, 6], min_trials=10)
+
+    add_trials(estimator, 6, 'diff', 5, 5)
+    add_trials(estimator, 6, 'same', 5, 5)
+    assert not estimator.converged(0.5, [4, 6], min_trials=10)
+    assert estimator.converged(estimator.ci_width(6), [4, 6], min_trials=10)
+
+
+def test_session_stops_early(headless, tmp_path):
+    # An observer that remembers every item is measured precisely once min_trials are reached
+    task = headless.HeadlessKtask(
+        observer=observer.SimulatedObserver(k=10, rng=np.random.default_rng(0)),
+        data_directory=str(tmp_path), number_of_trials_per_block=40, number_of_blocks=3,
+        set_sizes=[4], early_stop_ci_width=0.5, early_stop_min_trials=15,
+        experiment_info={'Subject Number': '1'})
+    task.run()
+
+    with open(str(tmp_path / 'ChangeDetection_001.csv'), newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    assert task.stopped_early
+    assert task.should_stop()
+    assert len(rows) < 120
+    assert min(sum(row['TrialType'] == trial_type for row in rows)
+               for trial_type in ['same', 'diff']) == 15
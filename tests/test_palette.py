@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+import generation
+import palette
+
+WHEEL = palette.color_wheel(36)
+DISTANCES = palette.distance_matrix(WHEEL)
+
+
+def test_displays_without_a_foil_are_resampled():
+    # About half of random displays leave no foil this far from every sample color
+    assert 0.2 < palette.check_color_feasibility(
+        DISTANCES, 3, min_distance=80, rng=np.random.default_rng(0)) < 0.8
+
+    test_locations, stim_indices, foils = palette.sample_colors(
+        DISTANCES, 500, 3, np.random.default_rng(1), min_distance=80)
+
+    assert stim_indices.shape == (500, 3)
+    assert (DISTANCES[foils[:, None], stim_indices] >= 80).all()
+    assert (test_locations < 3).all()
+
+
+def test_sampling_is_reproducible():
+    first = palette.sample_colors(DISTANCES, 50, 4, np.random.default_rng(2))
+    second = palette.sample_colors(DISTANCES, 50, 4, np.random.default_rng(2))
+
+    for a, b in zip(first, second):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_impossible_colors_are_rejected():
+    with pytest.raises(ValueError):
+        palette.check_color_feasibility(DISTANCES, 3, min_distance=200)
+
+    with pytest.raises(ValueError):
+        palette.sample_colors(DISTANCES, 5, 3, np.random.default_rng(0), min_distance=200,
+                              max_attempts=5)
+
+    with pytest.raises(ValueError):
+        generation.TrialGenerator(colors=WHEEL, set_sizes=[3], min_color_distance=200)
@@ -0,0 +1,61 @@
+import csv
+import time
+
+import pytest
+
+import prefetch
+
+
+def test_blocks_are_made_in_order_and_only_max_ahead_wait():
+    made = []
+
+    def make_block(block_num):
+        made.append(block_num)
+        return [block_num] * 3
+
+    prefetcher = prefetch.BlockPrefetcher(make_block, 5, max_ahead=1)
+    time.sleep(0.3)
+
+    # One block waits in the queue and the next one waits to be put there
+    assert made == [0, 1]
+    assert list(prefetcher) == [[i] * 3 for i in range(5)]
+    prefetcher.close()
+
+
+def test_errors_are_raised_when_the_block_is_requested():
+    def make_block(block_num):
+        if block_num == 1:
+            raise ValueError('Timeout')
+        return block_num
+
+    blocks = iter(prefetch.BlockPrefetcher(make_block, 3))
+
+    assert next(blocks) == 0
+    with pytest.raises(ValueError, match='Timeout'):
+        next(blocks)
+
+
+def test_close_stops_the_worker():
+    prefetcher = prefetch.BlockPrefetcher(lambda block_num: block_num, 100)
+    prefetcher.close()
+
+    assert not prefetcher._thread.is_alive()
+
+
+def test_prefetched_session_matches_a_normal_one(headless, tmp_path):
+    rows = []
+
+    for prefetch_blocks in [False, True]:
+        directory = tmp_path / str(prefetch_blocks)
+        task = headless.HeadlessKtask(
+            data_directory=str(directory), number_of_trials_per_block=6, number_of_blocks=3,
+            set_sizes=[4], seed=11, prefetch_blocks=prefetch_blocks,
+            experiment_info={'Subject Number': '1'})
+        task.run()
+
+        with open(str(directory / 'ChangeDetection_001.csv'), newline='') as f:
+            rows.append([(row['Block'], row['Locations'], row['SampleColors'])
+                         for row in csv.DictReader(f)])
+
+    assert len(rows[0]) == 18
+    assert rows[0] == rows[1]
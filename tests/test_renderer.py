@@ -0,0 +1,150 @@
+import csv
+
+import pytest
+
+import generation
+
+# renderer.py needs psychopy
+renderer = pytest.importorskip('renderer')
+
+RED = [1, -1, -1]
+BLUE = [-1, -1, 1]
+
+
+class FakeWindow:
+    """Records what is drawn to it, in order."""
+
+    def __init__(self):
+        self.log = []
+
+    def clearBuffer(self):
+        self.log.append('clear')
+
+
+class FakeStim:
+    """Stands in for the psychopy stimuli, logging a copy of its state when drawn."""
+
+    created = 0
+
+    def __init__(self, window, **kwargs):
+        FakeStim.created += 1
+        self.window = window
+        self.__dict__.update(kwargs)
+
+    def draw(self):
+        self.window.log.append(self.state())
+
+    def state(self):
+        return type(self).__name__
+
+
+class FakeText(FakeStim):
+    def state(self):
+        return 'fixation'
+
+
+class FakeRect(FakeStim):
+    def state(self):
+        return (list(self.pos), list(self.fillColor))
+
+
+class FakeElementArray(FakeStim):
+    def state(self):
+        return (self.xys.tolist(), self.colors.tolist(), self.opacities.tolist())
+
+
+class FakeBuffer(FakeStim):
+    """Captures what had been drawn to the window when it was created."""
+
+    def __init__(self, window, **kwargs):
+        super().__init__(window, **kwargs)
+        self.captured = list(window.log)
+        window.log.append('capture')
+
+
+@pytest.fixture
+def window(monkeypatch):
+    monkeypatch.setattr(renderer.psychopy.visual, 'TextStim', FakeText)
+    monkeypatch.setattr(renderer.psychopy.visual, 'Rect', FakeRect)
+    monkeypatch.setattr(renderer.psychopy.visual, 'ElementArrayStim', FakeElementArray)
+    monkeypatch.setattr(renderer.psychopy.visual, 'BufferImageStim', FakeBuffer)
+    FakeStim.created = 0
+    return FakeWindow()
+
+
+def test_pool_reuses_rects_and_grows_when_needed(window):
+    stim_renderer = renderer.StimulusRenderer(window, 1.5, 2)
+    created = FakeStim.created
+
+    stim_renderer.draw_squares([[0, 1], [2, 3]], [RED, BLUE])
+    stim_renderer.draw_squares([[4, 5]], [BLUE])
+
+    assert FakeStim.created == created
+    assert window.log == [([0, 1], RED), ([2, 3], BLUE), ([4, 5], BLUE)]
+
+    stim_renderer.draw_squares([[0, 0], [1, 1], [2, 2]], [RED, RED, BLUE])
+
+    assert FakeStim.created == created + 1
+    assert len(window.log) == 6
+
+
+def test_element_array_hides_unused_elements(window):
+    stim_renderer = renderer.StimulusRenderer(window, 1.5, 4, 'elementarray')
+
+    stim_renderer.draw_squares([[0, 1], [2, 3]], [RED, BLUE])
+
+    xys, colors, opacities = window.log[0]
+    assert xys[:2] == [[0, 1], [2, 3]]
+    assert colors[:2] == [RED, BLUE]
+    assert opacities == [1, 1, 0, 0]
+
+
+def test_unknown_renderers_are_rejected(window):
+    with pytest.raises(ValueError):
+        renderer.StimulusRenderer(window, 1.5, 4, 'sprites')
+
+
+def test_prerender_captures_the_display_and_clears_the_back_buffer(window):
+    stim_renderer = renderer.StimulusRenderer(window, 1.5, 2)
+
+    display = stim_renderer.prerender([[0, 1], [2, 3]], [RED, BLUE])
+
+    assert display.buffer == 'back'
+    assert display.captured == ['clear', 'fixation', ([0, 1], RED), ([2, 3], BLUE)]
+    assert window.log[-2:] == ['capture', 'clear']
+
+
+def test_prerendered_trial_matches_the_drawn_displays(headless, tmp_path, window):
+    task = headless.HeadlessKtask(
+        data_directory=str(tmp_path), set_sizes=[2], prerender_displays=True)
+    task.experiment_window = window
+    task.renderer = renderer.StimulusRenderer(window, task.stim_size, 2)
+    trial = {'trial_type': 'diff', 'locations': [[0, 1], [2, 3]], 'stim_colors': [RED, BLUE],
+             'test_location': 1, 'test_color': RED}
+
+    displays = task.prerender_trial(trial)
+
+    test_coordinates, test_colors = generation.test_array(
+        'diff', trial['locations'], trial['stim_colors'], 1, RED, task.single_probe)
+    assert displays['sample'].captured[-3:] == ['fixation', ([0, 1], RED), ([2, 3], BLUE)]
+    assert displays['test'].captured[-2:] == [
+        'fixation', (test_coordinates[0], test_colors[0])]
+
+
+def test_prerendered_session_matches_a_normal_one(headless, tmp_path):
+    rows = []
+
+    for prerender_displays in [False, True]:
+        directory = tmp_path / str(prerender_displays)
+        task = headless.HeadlessKtask(
+            data_directory=str(directory), number_of_trials_per_block=6, number_of_blocks=2,
+            set_sizes=[4], seed=5, prerender_displays=prerender_displays,
+            experiment_info={'Subject Number': '1'})
+        task.run()
+
+        with open(str(directory / 'ChangeDetection_001.csv'), newline='') as f:
+            rows.append([(row['Locations'], row['SampleColors'], row['TrialType'])
+                         for row in csv.DictReader(f)])
+
+    assert len(rows[0]) == 12
+    assert rows[0] == rows[1]
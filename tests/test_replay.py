@@ -0,0 +1,101 @@
+import csv
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+import replay
+
+
+def read_png(filename):
+    """Reads an unfiltered 8 bit RGB PNG file written by replay.write_png_rows."""
+    with open(filename, 'rb') as f:
+        contents = f.read()
+
+    position = 8
+    chunks = []
+    while position < len(contents):
+        length, chunk_type = struct.unpack('>I4s', contents[position:position + 8])
+        data = contents[position + 8:position + 8 + length]
+        crc, = struct.unpack('>I', contents[position + 8 + length:position + 12 + length])
+        assert crc == zlib.crc32(chunk_type + data) & 0xffffffff
+        chunks.append((chunk_type, data))
+        position += 12 + length
+
+    width, height = struct.unpack('>II', chunks[0][1][:8])
+    pixels = zlib.decompress(b''.join(
+        data for chunk_type, data in chunks if chunk_type == b'IDAT'))
+    rows = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width * 3 + 1)
+
+    return rows[:, 1:].reshape(height, width, 3)
+
+
+def test_contact_sheet_is_written_row_by_row(tmp_path):
+    rng = np.random.default_rng(0)
+    images = [rng.integers(256, size=(5, 7, 3), dtype=np.uint8) for _ in range(7)]
+    filename = str(tmp_path / 'sheet.png')
+
+    replay.write_png_rows(filename, replay.contact_sheet_rows(iter(images), 7, columns=3))
+
+    np.testing.assert_array_equal(read_png(filename), replay.contact_sheet(images, columns=3))
+    assert read_png(filename).shape == (3 * 9 + 4, 3 * 11 + 4, 3)
+
+
+def test_render_file_sheet(tmp_path):
+    filename = str(tmp_path / 'ChangeDetection_001.csv')
+    fields = ['Block', 'Trial', 'TrialType', 'LocationTested', 'Locations', 'SampleColors',
+              'TestColors']
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, lineterminator='\n')
+        writer.writeheader()
+        for trial in range(3):
+            writer.writerow({
+                'Block': 0, 'Trial': trial, 'TrialType': 'diff', 'LocationTested': 0,
+                'Locations': json.dumps([[-3, 2], [3, -2]]),
+                'SampleColors': json.dumps([[1, -1, -1], [-1, 1, -1]]),
+                'TestColors': json.dumps([-1, -1, 1]),
+            })
+
+    saved = replay.render_file(filename, str(tmp_path / 'out'), pixels_per_degree=4, sheet=True,
+                               columns=2)
+    sheet = read_png(saved[0])
+
+    sample, test = replay.trial_images(
+        'diff', [[-3, 2], [3, -2]], [[1, -1, -1], [-1, 1, -1]], 0, [-1, -1, 1],
+        pixels_per_degree=4)
+    size = sample.shape[0]
+
+    assert sheet.shape == (2 * (size + 4) + 4, 4 * (size + 4) + 4, 3)
+    np.testing.assert_array_equal(sheet[4:4 + size, 4:4 + size], sample)
+    np.testing.assert_array_equal(sheet[4:4 + size, 8 + size:8 + 2 * size], test)
+
+    single = replay.render_file(filename, str(tmp_path / 'single'), pixels_per_degree=4)
+    assert len(single) == 6
+    np.testing.assert_array_equal(read_png(single[1]), test)
+
+
+def test_render_file_with_practice_rows(tmp_path):
+    filename = str(tmp_path / 'ChangeDetection_002.csv')
+    fields = ['Block', 'Trial', 'TrialType', 'LocationTested', 'Locations', 'SampleColors',
+              'TestColors']
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, lineterminator='\n')
+        writer.writeheader()
+        for block in ['practice', 0]:
+            writer.writerow({
+                'Block': block, 'Trial': 0, 'TrialType': 'same', 'LocationTested': 1,
+                'Locations': json.dumps([[-3, 2], [3, -2]]),
+                'SampleColors': json.dumps([[1, -1, -1], [-1, 1, -1]]),
+                'TestColors': json.dumps([-1, 1, -1]),
+            })
+
+    assert replay.read_displays(filename)['Block'].tolist() == ['practice', '0']
+
+    saved = replay.render_file(filename, str(tmp_path / 'out'), pixels_per_degree=4)
+    assert [os.path.basename(name) for name in saved] == [
+        'ChangeDetection_002_bpractice_t0_sample.png', 'ChangeDetection_002_bpractice_t0_test.png',
+        'ChangeDetection_002_b0_t0_sample.png', 'ChangeDetection_002_b0_t0_test.png']
@@ -0,0 +1,89 @@
+import csv
+
+import numpy as np
+import pytest
+
+import columnar
+
+TRIAL_FIELDS = [
+    'Block', 'Trial', 'TrialType', 'SetSize', 'Locations', 'SampleColors', 'TestColors']
+
+
+def make_task(headless, data_directory, **kwargs):
+    return headless.HeadlessKtask(
+        data_directory=str(data_directory), number_of_trials_per_block=6, number_of_blocks=3,
+        set_sizes=[4], stream_data=True, experiment_info={'Subject Number': '1'}, **kwargs)
+
+
+def read_rows(filename):
+    with open(filename, newline='') as f:
+        return [{field: row[field] for field in TRIAL_FIELDS} for row in csv.DictReader(f)]
+
+
+def interrupt(filename, n_rows):
+    """Keeps the header and the first n_rows rows of a data file."""
+    with open(filename) as f:
+        lines = f.readlines()
+    with open(filename, 'w') as f:
+        f.writelines(lines[:n_rows + 1])
+
+
+def test_resume_reads_the_seed_from_the_info_file(headless, tmp_path):
+    data_directory = tmp_path / 'data'
+    make_task(headless, data_directory).run()
+
+    data_file = data_directory / 'ChangeDetection_001.csv'
+    info_file = data_directory / 'ChangeDetection_info_001.txt'
+    complete = read_rows(data_file)
+    info = info_file.read_text()
+
+    interrupt(data_file, 8)
+    make_task(headless, data_directory).run(resume_file=str(data_file))
+
+    assert read_rows(data_file) == complete
+    assert info_file.read_text() == info
+
+
+def test_resume_rejects_a_different_seed(headless, tmp_path):
+    data_directory = tmp_path / 'data'
+    make_task(headless, data_directory, seed=1).run()
+
+    data_file = data_directory / 'ChangeDetection_001.csv'
+    interrupt(data_file, 8)
+
+    with pytest.raises(ValueError):
+        make_task(headless, data_directory, seed=2).run(resume_file=str(data_file))
+
+
+def test_resume_without_info_needs_a_seed(headless, tmp_path):
+    data_directory = tmp_path / 'data'
+    make_task(headless, data_directory, seed=1).run()
+
+    data_file = data_directory / 'ChangeDetection_001.csv'
+    complete = read_rows(data_file)
+    interrupt(data_file, 8)
+    (data_directory / 'ChangeDetection_info_001.txt').unlink()
+
+    with pytest.raises(ValueError):
+        make_task(headless, data_directory).run(resume_file=str(data_file))
+
+    make_task(headless, data_directory, seed=1).run(resume_file=str(data_file))
+    assert read_rows(data_file) == complete
+
+
+def test_resume_rebuilds_columns_from_the_csv(headless, tmp_path):
+    data_directory = tmp_path / 'data'
+    make_task(headless, data_directory, columnar_output=True).run()
+
+    data_file = data_directory / 'ChangeDetection_001.csv'
+    column_directory = str(data_directory / 'ChangeDetection_001_columns')
+    complete = columnar.load_columns(column_directory, mmap=False)
+
+    # Interrupted partway through the second block, after columns from an earlier run were saved
+    interrupt(data_file, 8)
+    make_task(headless, data_directory, columnar_output=True).run(resume_file=str(data_file))
+
+    resumed = columnar.load_columns(column_directory, mmap=False)
+    assert len(resumed['Trial']) == 18
+    for field in ['Block', 'Trial', 'SetSize', 'Locations', 'SampleColors', 'TestColors']:
+        np.testing.assert_array_equal(resumed[field], complete[field])
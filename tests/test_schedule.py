@@ -0,0 +1,75 @@
+import pytest
+
+import generation
+import schedule
+import seeding
+
+
+def make_generator():
+    return generation.TrialGenerator(
+        number_of_trials_per_block=12, number_of_blocks=3, set_sizes=[4, 6])
+
+
+def test_schedule_round_trip(tmp_path):
+    task = make_generator()
+    filename = str(tmp_path / 'schedule.npz')
+    task_seed = task.seed
+
+    seed = schedule.compile_schedule(task, 3, filename, seed=1234)
+
+    assert seed == 1234
+    assert task.seed == task_seed
+    assert schedule.load_schedule_info(filename)['number_of_blocks'] == 3
+
+    blocks = list(schedule.iter_schedule(filename))
+    assert len(blocks) == 3
+
+    for block_num, block in enumerate(blocks):
+        live = make_generator().make_block(seeding.block_rng(1234, 3, block_num))
+        assert block == list(live)
+
+
+def test_schedule_colors_match_the_palette(tmp_path):
+    task = make_generator()
+    filename = str(tmp_path / 'schedule.npz')
+    schedule.compile_schedule(task, 1, filename, seed=5)
+
+    for trial in next(schedule.iter_schedule(filename)):
+        assert trial['stim_colors'] == [task.color_list[i] for i in trial['stim_color_indices']]
+        assert trial['test_color'] == task.color_list[trial['test_color_index']]
+        assert all(isinstance(value, int) for color in trial['stim_colors'] for value in color)
+
+
+def test_check_schedule_compares_every_setting(headless, tmp_path):
+    filename = str(tmp_path / 'schedule.npz')
+    schedule.compile_schedule(make_generator(), 1, filename, seed=1234)
+
+    assert schedule.load_schedule_info(filename)['settings'] == (
+        make_generator().generation_settings())
+
+    task = headless.HeadlessKtask(
+        data_directory=str(tmp_path), number_of_trials_per_block=12, number_of_blocks=3,
+        set_sizes=[4, 6], min_distance=3, experiment_info={'Subject Number': '1'})
+
+    with pytest.raises(ValueError, match='min_distance'):
+        task.run(schedule_file=filename)
+
+
+def test_main_pads_subject_numbers(tmp_path):
+    schedule.main(['2', '--seed', '5', '--directory', str(tmp_path)])
+
+    filename = str(tmp_path / 'ChangeDetection_002_schedule.npz')
+    assert schedule.schedule_filename('ChangeDetection', 2, str(tmp_path)) == filename
+    assert schedule.load_schedule_info(filename)['subject_number'] == '2'
+
+
+def test_padded_subject_numbers_match_the_schedule(headless, tmp_path):
+    filename = str(tmp_path / 'schedule.npz')
+    settings = {'number_of_trials_per_block': 12, 'number_of_blocks': 3, 'set_sizes': [4, 6]}
+    schedule.compile_schedule(generation.TrialGenerator(**settings), 1, filename, seed=1234)
+
+    task = headless.HeadlessKtask(data_directory=str(tmp_path),
+                                  experiment_info={'Subject Number': '001'}, **settings)
+    task.run(schedule_file=filename)
+
+    assert task.seed == 1234
@@ -0,0 +1,59 @@
+import generation
+import seeding
+
+
+def make_generator(**kwargs):
+    return generation.TrialGenerator(
+        number_of_trials_per_block=8, number_of_blocks=4, set_sizes=[4, 6], seed=99, **kwargs)
+
+
+def test_blocks_do_not_depend_on_order():
+    forward = [make_generator().make_seeded_block(block_num, 5) for block_num in range(4)]
+
+    generator = make_generator()
+    backward = [generator.make_seeded_block(block_num, 5) for block_num in reversed(range(4))]
+
+    assert forward == backward[::-1]
+    assert forward[0] != forward[1]
+
+
+def test_compact_blocks_match_list_blocks():
+    compact = make_generator(compact_blocks=True).make_seeded_block(2, 5)
+    assert list(compact) == make_generator().make_seeded_block(2, 5)
+
+
+def test_subject_keys():
+    assert seeding.subject_key(12) == seeding.subject_key('012') == 12
+    assert seeding.subject_key('S01') == seeding.subject_key('S01')
+    assert seeding.subject_key('S01') != seeding.subject_key('S02')
+    assert seeding.subject_key('S01') >= 2 ** 64
+
+
+def test_subject_ids_get_their_own_streams():
+    generator = make_generator()
+    block = generator.make_seeded_block(0, 'S01')
+
+    assert block == make_generator().make_seeded_block(0, 'S01')
+    assert block != generator.make_seeded_block(0, 'S02')
+    assert block != generator.make_seeded_block(0, 1)
+
+
+class LegacyGenerator(generation.TrialGenerator):
+    """Overrides make_block without an rng argument, as older subclasses do."""
+
+    def make_block(self):
+        block = super().make_block()
+        block.append(self.make_trial(4, 'same'))
+        return block
+
+
+def test_make_block_without_rng():
+    task = LegacyGenerator(number_of_trials_per_block=8, set_sizes=[4], seed=3)
+    rng = task.rng
+
+    block = task.make_seeded_block(1, 2)
+
+    assert len(block) == 9
+    assert task.rng is rng
+    assert block == LegacyGenerator(
+        number_of_trials_per_block=8, set_sizes=[4], seed=3).make_seeded_block(1, 2)
@@ -0,0 +1,26 @@
+import numpy as np
+
+import observer
+import simulate
+
+
+def test_observer_accuracy_follows_the_slot_model():
+    subject = observer.SimulatedObserver(k=2, guess_rate=0.5, rng=np.random.default_rng(0))
+    set_sizes = np.full(20000, 4)
+    diff = np.arange(20000) % 2 == 0
+
+    # Half of the items are remembered and half of the rest are guessed correctly
+    assert abs(subject.accuracy(set_sizes, diff).mean() - 0.75) < 0.02
+
+
+def test_simulate_subjects():
+    task_kwargs = {'set_sizes': [4, 6], 'number_of_trials_per_block': 40, 'number_of_blocks': 2}
+
+    rows = simulate.simulate_subjects([1, 2], 7, k=3, task_kwargs=task_kwargs)
+    again = simulate.simulate_subjects([1, 2], 7, k=3, task_kwargs=task_kwargs)
+
+    assert [(row['Subject'], row['SetSize']) for row in rows] == [
+        ('1', 4), ('1', 6), ('2', 4), ('2', 6)]
+    assert [row['TrueK'] for row in rows] == [3, 3, 3, 3]
+    assert all(row['NSame'] + row['NDiff'] == 80 for row in rows)
+    assert [row['CowanK'] for row in rows] == [row['CowanK'] for row in again]
@@ -0,0 +1,78 @@
+import csv
+
+import pytest
+
+import timing
+
+PERIOD = 1 / 60
+
+
+class FakeWindow:
+    """Flips on every frame, except that the flips in skip land one frame late."""
+
+    monitorFramePeriod = PERIOD
+
+    def __init__(self, skip=()):
+        self.skip = set(skip)
+        self.n_flips = 0
+        self.time = 0.0
+
+    def flip(self):
+        self.n_flips += 1
+        self.time += PERIOD * (2 if self.n_flips in self.skip else 1)
+        return self.time
+
+
+def test_displays_last_a_whole_number_of_frames():
+    window = FakeWindow()
+    timer = timing.FrameTimer(window)
+    draws = []
+
+    timer.present(lambda: draws.append('sample'), 0.1, 'sample')
+    timer.present(lambda: draws.append('delay'), 0.05, 'delay')
+    timer.flip('test')
+
+    # 6 frames of sample and 3 of delay, each redrawn before every flip
+    assert draws == ['sample'] * 6 + ['delay'] * 3
+    assert timer.trial_timing() == {
+        'SampleDuration': pytest.approx(100), 'DelayDuration': pytest.approx(50),
+        'DroppedFrames': 0}
+
+
+def test_dropped_frames_shorten_the_display_instead_of_extending_it():
+    window = FakeWindow(skip=[3])
+    timer = timing.FrameTimer(window)
+
+    timer.present(lambda: None, 0.1, 'sample')
+    timer.present(lambda: None, 0.05, 'delay')
+    timer.flip('test')
+
+    assert window.n_flips == 9  # One fewer sample flip than without the dropped frame
+    assert timer.trial_timing()['SampleDuration'] == pytest.approx(100)
+    assert timer.dropped_frames('sample') == 1
+    assert timer.dropped_frames('delay') == 0
+
+
+def test_n_frames_rounds_to_at_least_one_frame():
+    timer = timing.FrameTimer(FakeWindow())
+
+    assert timer.n_frames(0.1) == 6
+    assert timer.n_frames(0.001) == 1
+
+
+def test_frame_timed_session_saves_durations(headless, tmp_path):
+    task = headless.HeadlessKtask(
+        data_directory=str(tmp_path), number_of_trials_per_block=4, number_of_blocks=1,
+        set_sizes=[4], timing_mode='frames', experiment_info={'Subject Number': '1'})
+    task.run()
+
+    with open(str(tmp_path / 'ChangeDetection_001.csv'), newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    assert len(rows) == 4
+    for row in rows:
+        assert int(row['DroppedFrames']) == 0
+        # Durations are whole frames of the 60 Hz NullWindow
+        assert float(row['SampleDuration']) / (1000 * PERIOD) == pytest.approx(
+            round(float(row['SampleDuration']) / (1000 * PERIOD)))
+        assert float(row['DelayDuration']) > 0
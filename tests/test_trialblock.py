@@ -0,0 +1,72 @@
+import random
+
+import numpy as np
+import pytest
+
+import generation
+import trialblock
+
+
+def make_block():
+    generator = generation.TrialGenerator(
+        number_of_trials_per_block=6, set_sizes=[3, 5], compact_blocks=True, seed=4)
+    return generator, generator.make_seeded_block(0, 1)
+
+
+def test_in_place_edits_are_written_back():
+    generator, block = make_block()
+
+    for trial in block:
+        trial['locations'] = [[1.0, 2.0]] * trial['set_size']
+        trial['note'] = 'edited'
+
+    block.shuffle(np.random.default_rng(0))
+    random.shuffle(block)
+
+    for trial in block:
+        assert trial['locations'] == [[1.0, 2.0]] * trial['set_size']
+        assert trial['note'] == 'edited'
+
+
+def test_view_follows_its_trial():
+    generator, block = make_block()
+    trial = block[3]
+    expected = trial.copy()
+
+    block.shuffle(np.random.default_rng(1))
+    block.insert(0, block[-1].copy())
+    del block[1]
+
+    trial['trial_type'] = 'diff' if trial['trial_type'] == 'same' else 'same'
+    expected.update(trial_type=trial['trial_type'], cresp=trial['cresp'])
+
+    assert sum(other == expected for other in block) == 1
+    assert trial['cresp'] == generator.keys[trialblock.TRIAL_TYPES.index(trial['trial_type'])]
+
+
+def test_colors_are_stored_as_indices():
+    generator, block = make_block()
+    trial = block[0]
+
+    trial['test_color'] = generator.color_list[7]
+    trial['stim_colors'] = generator.color_list[:trial['set_size']]
+
+    assert block[0]['test_color_index'] == 7
+    assert block[0]['stim_color_indices'] == list(range(trial['set_size']))
+
+    with pytest.raises(ValueError):
+        trial['test_color'] = [0.5, 0.5, 0.5]
+    with pytest.raises(KeyError):
+        del trial['locations']
+
+
+def test_unknown_keys_are_kept():
+    generator = generation.TrialGenerator(number_of_trials_per_block=4, set_sizes=[3], seed=2)
+    trials = generator.make_seeded_block(0, 1)
+    for trial in trials:
+        trial['practice'] = True
+
+    block = trialblock.TrialBlock.from_trials(trials, generator.colors, generator.keys)
+
+    assert block.tolist() == trials
+    assert block[1:3].tolist() == trials[1:3]
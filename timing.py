@@ -0,0 +1,128 @@
+"""Frame-counted display timing for the change detection experiment.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+Waiting with psychopy.core.wait after a single flip is only as accurate as the operating system's
+sleep. A FrameTimer instead redraws a display on every frame and ends it after a whole number of
+frames, measured from the flip timestamps returned by the window, so durations stay locked to the
+screen refresh even when a frame is dropped. Every flip of a trial is recorded so the achieved
+durations and the number of dropped frames can be saved with the trial data.
+
+Classes:
+FrameTimer -- Presents displays for a number of frames and records flip times.
+
+Attributes:
+TIMING_MODES -- The available timing modes. 'wait' presents each display with a single flip
+    followed by psychopy.core.wait and 'frames' uses a FrameTimer.
+TIMING_FIELDS -- The data fields added to each trial when frame timing is used.
+"""
+
+TIMING_MODES = ['wait', 'frames']
+TIMING_FIELDS = ['SampleDuration', 'DelayDuration', 'DroppedFrames']
+
+
+class FrameTimer:
+    """Presents displays for a whole number of frames and records when each flip happened.
+
+    Parameters:
+    window -- The psychopy window being flipped.
+    frame_period -- The duration of a frame in seconds. If None, the window's measured frame
+        period is used.
+
+    Methods:
+    n_frames -- Converts a duration in seconds to a number of frames.
+    start_trial -- Clears the flips recorded for the last trial.
+    flip -- Flips the window and records the flip time.
+    present -- Presents a display for a duration.
+    dropped_frames -- Counts the frames dropped since a phase started.
+    trial_timing -- Returns the timing data for the current trial.
+    """
+
+    def __init__(self, window, frame_period=None):
+        if frame_period is None:
+            frame_period = window.monitorFramePeriod or 1.0 / window.getActualFrameRate()
+
+        self.window = window
+        self.frame_period = frame_period
+
+        self.flip_times = []
+        self.onsets = {}
+
+    def n_frames(self, seconds):
+        """Returns the number of frames (at least one) closest to a duration in seconds."""
+        return max(int(round(seconds / self.frame_period)), 1)
+
+    def start_trial(self):
+        """Clears the flips and onsets recorded for the previous trial."""
+        self.flip_times = []
+        self.onsets = {}
+
+    def flip(self, phase=None):
+        """Flips the window and records the flip time.
+
+        Returns the flip time.
+
+        Parameters:
+        phase -- If given, the flip is recorded as the onset of this phase.
+        """
+        flip_time = self.window.flip()
+        self.flip_times.append(flip_time)
+
+        if phase is not None:
+            self.onsets[phase] = flip_time
+
+        return flip_time
+
+    def present(self, draw, seconds, phase, callback=None):
+        """Presents a display for the number of frames closest to a duration.
+
+        The display is redrawn before every flip. It stays up until the frame before the intended
+        offset, counted from the onset flip time, so a dropped frame shortens the remaining
+        presentation instead of extending it. The flip that ends the display belongs to whatever is
+        presented next.
+
+        Parameters:
+        draw -- A function that draws the display.
+        seconds -- The intended duration of the display.
+        phase -- The name the onset is recorded under.
+        callback -- An optional function called after the onset flip. Its time is counted as part
+            of the duration.
+        """
+        last_frame = self.n_frames(seconds) - 1
+
+        draw()
+        onset = self.flip(phase)
+
+        if callback is not None:
+            callback()
+
+        while round((self.flip_times[-1] - onset) / self.frame_period) < last_frame:
+            draw()
+            self.flip()
+
+    def dropped_frames(self, phase):
+        """Returns the number of frames dropped since the onset of a phase.
+
+        A gap between flips of n frame periods counts as n - 1 dropped frames.
+
+        Parameters:
+        phase -- The phase to count from.
+        """
+        start = self.flip_times.index(self.onsets[phase])
+        dropped = 0
+
+        for previous, current in zip(self.flip_times[start:], self.flip_times[start + 1:]):
+            dropped += max(int(round((current - previous) / self.frame_period)) - 1, 0)
+
+        return dropped
+
+    def trial_timing(self):
+        """Returns the achieved sample and delay durations (in ms) and the dropped frame count.
+
+        Frames are counted from the sample onset to the test onset.
+        """
+        return {
+            'SampleDuration': (self.onsets['delay'] - self.onsets['sample']) * 1000,
+            'DelayDuration': (self.onsets['test'] - self.onsets['delay']) * 1000,
+            'DroppedFrames': self.dropped_frames('sample'),
+        }
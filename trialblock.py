@@ -0,0 +1,324 @@
+"""A compact, array-backed block of trials.
+
+Repo: https://github.com/colinquirk/PsychopyChangeDetection
+
+A block made of trial dicts holds nested Python lists for every location and color, which takes
+many times more memory than the numbers themselves and is slow to shuffle or save when a
+simulation makes hundreds of thousands of trials. A TrialBlock stores the same trials in one NumPy
+structured array: locations are padded with NaN to the largest set size and colors are stored as
+indices into the palette.
+
+A TrialBlock behaves like a list of trial dicts. Indexing or iterating over it creates a TrialView
+for a single trial when it is needed, with the same keys as Ktask.make_trial, so run_trial and the
+run hooks work unchanged. Setting a key on a TrialView writes it back to the block, so hooks can
+edit trials in place; keys that are not part of the array are kept alongside it. Assigning a trial
+dict to an index, inserting, deleting and random.shuffle work as they do on a list. shuffle
+reorders the array in place with NumPy.
+
+Only assigning a key is written back. Changing a value in place, such as
+trial['locations'][0] = [1, 2], only changes the view, so assign the whole value again instead.
+
+Classes:
+TrialBlock -- A list-like block of trials backed by a structured array.
+TrialView -- A trial of a TrialBlock that writes changes back to the block.
+
+Functions:
+trial_dtype -- Returns the structured array dtype for a maximum set size.
+
+Attributes:
+TRIAL_TYPES -- The trial types, in the order their indices are stored.
+"""
+
+import collections.abc
+
+import numpy as np
+
+TRIAL_TYPES = ['same', 'diff']
+
+# Keys stored in the array, and keys computed from them
+_STORED_KEYS = {
+    'set_size', 'trial_type', 'test_location', 'locations', 'stim_color_indices',
+    'test_color_index',
+}
+_DERIVED_KEYS = {'cresp', 'stim_colors', 'test_color'}
+
+
+def trial_dtype(width):
+    """Returns the structured array dtype used for trials with up to width stimuli.
+
+    Parameters:
+    width -- The largest set size in the block.
+    """
+    return np.dtype([
+        ('set_size', np.uint16),
+        ('trial_type', np.uint8),
+        ('test_location', np.uint16),
+        ('locations', np.float64, (width, 2)),
+        ('stim_color_indices', np.int32, (width,)),
+        ('test_color_index', np.int32),
+    ])
+
+
+class TrialBlock(collections.abc.MutableSequence):
+    """A list-like block of trials backed by a NumPy structured array.
+
+    Parameters:
+    data -- A structured array with the dtype from trial_dtype.
+    colors -- The palette the color indices refer to.
+    keys -- The 'same' and 'different' response keys, used for each trial's cresp.
+
+    Methods:
+    from_trials -- Creates a TrialBlock from trial dicts.
+    shuffle -- Shuffles the trials in place.
+    tolist -- Returns the trials as a list of dicts.
+    """
+
+    def __init__(self, data, colors, keys):
+        self.data = data
+        self.color_list = np.asarray(colors).tolist()
+        self.keys = list(keys)
+
+        # Each trial has an id that moves with it, so a TrialView finds its trial after the block
+        # is shuffled or resized. Keys that are not stored in the array are kept by id.
+        self.ids = np.arange(len(data))
+        self.next_id = len(data)
+        self.extras = {}
+
+    @classmethod
+    def from_trials(cls, trials, colors, keys, width=None):
+        """Creates a TrialBlock from trial dicts with the keys created by Ktask.make_trial.
+
+        Parameters:
+        trials -- The trial dicts. Each needs 'stim_color_indices' and 'test_color_index'.
+        colors -- The palette the color indices refer to.
+        keys -- The 'same' and 'different' response keys.
+        width -- The largest set size the block can hold. Defaults to the largest in trials.
+        """
+        trials = list(trials)
+
+        if width is None:
+            width = max([trial['set_size'] for trial in trials] + [1])
+
+        block = cls(np.zeros(len(trials), dtype=trial_dtype(width)), colors, keys)
+        for i, trial in enumerate(trials):
+            block[i] = trial
+
+        return block
+
+    @property
+    def width(self):
+        """The largest set size the block can hold."""
+        return self.data.dtype['locations'].shape[0]
+
+    def __len__(self):
+        return len(self.data)
+
+    def _encode(self, trial):
+        """Returns a trial dict as a single structured array record and a dict of its other keys.
+        """
+        set_size = trial['set_size']
+
+        if set_size > self.width:
+            raise ValueError('Set size {} does not fit in a block of width {}.'.format(
+                set_size, self.width))
+
+        if 'stim_color_indices' not in trial or 'test_color_index' not in trial:
+            raise ValueError('Trials need color indices to be stored in a TrialBlock.')
+
+        record = np.zeros((), dtype=self.data.dtype)
+        record['set_size'] = set_size
+        record['trial_type'] = TRIAL_TYPES.index(trial['trial_type'])
+        record['test_location'] = trial['test_location']
+        record['locations'] = np.nan
+        record['locations'][:set_size] = trial['locations']
+        record['stim_color_indices'] = -1
+        record['stim_color_indices'][:set_size] = trial['stim_color_indices']
+        record['test_color_index'] = trial['test_color_index']
+
+        extra = {key: value for key, value in trial.items()
+                 if key not in _STORED_KEYS and key not in _DERIVED_KEYS}
+
+        return record, extra
+
+    def _decode(self, record, extra=None):
+        """Returns the trial dict for a single structured array record and its other keys."""
+        set_size = int(record['set_size'])
+        trial_type = TRIAL_TYPES[record['trial_type']]
+        stim_indices = record['stim_color_indices'][:set_size].tolist()
+        test_index = int(record['test_color_index'])
+
+        trial = {
+            'set_size': set_size,
+            'trial_type': trial_type,
+            'cresp': self.keys[record['trial_type']],
+            'locations': record['locations'][:set_size].tolist(),
+            'stim_colors': [self.color_list[i] for i in stim_indices],
+            'test_color': self.color_list[test_index],
+            'test_location': int(record['test_location']),
+            'stim_color_indices': stim_indices,
+            'test_color_index': test_index,
+        }
+        trial.update(extra or {})
+
+        return trial
+
+    def _color_index(self, color):
+        """Returns the palette index of a color."""
+        try:
+            return self.color_list.index(np.asarray(color).tolist())
+        except ValueError:
+            raise ValueError('{} is not in the palette of this block.'.format(color)) from None
+
+    def _trial_id(self, trial):
+        """Returns the id for a trial being stored: its own if it is a view of this block."""
+        if isinstance(trial, TrialView) and trial.block is self:
+            return trial.trial_id
+
+        self.next_id += 1
+        return self.next_id - 1
+
+    def _store(self, trial_id, extra):
+        """Keeps the extra keys of a trial, or drops them if it has none."""
+        if extra:
+            self.extras[trial_id] = extra
+        else:
+            self.extras.pop(trial_id, None)
+
+    def _write(self, trial_id, trial):
+        """Writes a trial to every position holding trial_id. Returns the decoded trial."""
+        record, extra = self._encode(trial)
+        positions = self.ids == trial_id
+
+        # A trial that was removed from the block only changes its view
+        if positions.any():
+            self.data[positions] = record
+            self._store(trial_id, extra)
+
+        return self._decode(record, extra)
+
+    def _forget_removed(self):
+        """Drops the extra keys of trials that are no longer in the block."""
+        for trial_id in set(self.extras).difference(self.ids.tolist()):
+            del self.extras[trial_id]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            block = TrialBlock(self.data[index].copy(), self.color_list, self.keys)
+            block.ids = self.ids[index].copy()
+            block.next_id = self.next_id
+            block.extras = {trial_id: dict(self.extras[trial_id])
+                            for trial_id in block.ids.tolist() if trial_id in self.extras}
+            return block
+
+        trial_id = int(self.ids[index])
+        return TrialView(self, trial_id, self._decode(self.data[index], self.extras.get(trial_id)))
+
+    def __setitem__(self, index, trial):
+        if isinstance(index, slice):
+            positions = range(*index.indices(len(self)))
+            trials = list(trial)
+
+            if len(trials) != len(positions):
+                raise ValueError('A TrialBlock slice can only be replaced by as many trials.')
+
+            for position, value in zip(positions, trials):
+                self[position] = value
+            return
+
+        record, extra = self._encode(trial)
+        trial_id = self._trial_id(trial)
+
+        self.data[index] = record
+        self.ids[index] = trial_id
+        self._store(trial_id, extra)
+
+    def __delitem__(self, index):
+        self.data = np.delete(self.data, index)
+        self.ids = np.delete(self.ids, index)
+        self._forget_removed()
+
+    def insert(self, index, trial):
+        """Inserts a trial dict before index."""
+        record, extra = self._encode(trial)
+        trial_id = self._trial_id(trial)
+
+        self.data = np.insert(self.data, index, record)
+        self.ids = np.insert(self.ids, index, trial_id)
+        self._store(trial_id, extra)
+
+    def shuffle(self, rng):
+        """Shuffles the trials in place.
+
+        Parameters:
+        rng -- A numpy.random.Generator.
+        """
+        order = rng.permutation(len(self.data))
+        self.data[:] = self.data[order]
+        self.ids[:] = self.ids[order]
+
+    def tolist(self):
+        """Returns copies of the trials as a list of dicts."""
+        return [self._decode(record, self.extras.get(trial_id))
+                for record, trial_id in zip(self.data, self.ids.tolist())]
+
+
+class TrialView(collections.abc.MutableMapping):
+    """A trial of a TrialBlock that writes changes back to the block.
+
+    A view reads like the trial dict created by Ktask.make_trial. Setting a key re-encodes the
+    trial into the block, wherever it has been moved to. Setting 'stim_colors' or 'test_color'
+    stores the palette indices of the new colors, 'cresp' follows from 'trial_type', and any other
+    key is kept with the trial. Values changed in place are not written back.
+
+    Parameters:
+    block -- The TrialBlock the trial belongs to.
+    trial_id -- The id of the trial in block.ids.
+    trial -- The decoded trial dict.
+
+    Methods:
+    copy -- Returns the trial as a plain dict.
+    """
+
+    def __init__(self, block, trial_id, trial):
+        self.block = block
+        self.trial_id = trial_id
+        self.trial = trial
+
+    def __getitem__(self, key):
+        return self.trial[key]
+
+    def __setitem__(self, key, value):
+        if key == 'cresp':
+            if value != self.trial['cresp']:
+                raise ValueError("cresp follows from trial_type, set 'trial_type' instead.")
+            return
+
+        if key == 'stim_colors':
+            key, value = 'stim_color_indices', [self.block._color_index(c) for c in value]
+        elif key == 'test_color':
+            key, value = 'test_color_index', self.block._color_index(value)
+
+        trial = dict(self.trial)
+        trial[key] = value
+        self.trial = self.block._write(self.trial_id, trial)
+
+    def __delitem__(self, key):
+        if key in _STORED_KEYS or key in _DERIVED_KEYS:
+            raise KeyError('{} cannot be removed from a trial in a TrialBlock.'.format(key))
+
+        trial = dict(self.trial)
+        del trial[key]
+        self.trial = self.block._write(self.trial_id, trial)
+
+    def __iter__(self):
+        return iter(self.trial)
+
+    def __len__(self):
+        return len(self.trial)
+
+    def __repr__(self):
+        return 'TrialView({!r})'.format(self.trial)
+
+    def copy(self):
+        """Returns the trial as a plain dict."""
+        return dict(self.trial)